@@ -22,4 +22,5 @@ __author__ = 'Ju Zhang'
 __stepname__ = 'Pelvis Landmark HJC Prediction'
 __location__ = 'https://github.com/mapclient-plugins/pelvislandmarkshjcpredictionstep/archive/v0.1.0.zip'
 
+from mapclientplugins.pelvislandmarkshjcpredictionstep import log
 from mapclientplugins.pelvislandmarkshjcpredictionstep import step
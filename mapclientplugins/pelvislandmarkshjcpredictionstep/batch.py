@@ -0,0 +1,279 @@
+'''
+Batched HJC prediction.
+
+Aligns many pelvises to the ISB pelvis anatomic coordinate system at once,
+runs a registered predictor on the whole batch and maps the predicted HJCs
+back to each subject's input frame.
+'''
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from mapclientplugins.pelvislandmarkshjcpredictionstep import predictors
+from mapclientplugins.pelvislandmarkshjcpredictionstep import covariates as cov
+from mapclientplugins.pelvislandmarkshjcpredictionstep import frames as fr
+from mapclientplugins.pelvislandmarkshjcpredictionstep.progress import ProgressTracker, PredictionCancelled
+
+HIPLANDMARKS = ('LASIS', 'RASIS', 'LPSIS', 'RPSIS', 'PS')
+# landmarks defining the ISB pelvis frame
+ALIGNMENT_LANDMARKS = HIPLANDMARKS[:4]
+DEFAULT_CHUNK_SIZE = 65536
+
+# per-subject failure codes of fault tolerant runs, indexing ERROR_MESSAGES
+ERROR_NONE = 0
+ERROR_MISSING_LANDMARK = 1
+ERROR_INVALID_LANDMARK = 2
+ERROR_DEGENERATE_PELVIS = 3
+ERROR_MISSING_COVARIATE = 4
+ERROR_NONFINITE_HJC = 5
+ERROR_MESSAGES = ('',
+                  'missing landmark',
+                  'invalid landmark coordinates',
+                  'degenerate pelvis, alignment undefined',
+                  'missing covariate',
+                  'non-finite HJC prediction',
+                  )
+
+
+def _normalise(v):
+    return v / np.sqrt((v * v).sum(-1))[..., np.newaxis]
+
+
+def pelvisAxes(lasis, rasis, lpsis, rpsis):
+    '''
+    Batched equivalent of gias3 model_alignment.createPelvisACSISB. Inputs
+    are (N, 3) arrays. Returns the origins (N, 3) and rotations (N, 3, 3)
+    whose rows are the x, y, z axes.
+    '''
+    o = 0.5 * (lasis + rasis)
+    op = 0.5 * (lpsis + rpsis)
+    z = _normalise(rasis - lasis)
+    n1 = _normalise(np.cross(rasis - op, lasis - op))
+    x = _normalise(np.cross(n1, z))
+    y = _normalise(np.cross(z, x))
+    return o, np.stack([x, y, z], axis=1)
+
+
+def alignPelvisBatch(coords, lasis, rasis, lpsis, rpsis):
+    '''
+    Align a batch of landmark sets to their pelvis anatomic coordinate
+    systems.
+
+    coords: (N, k, 3) array of landmarks to transform.
+    lasis, rasis, lpsis, rpsis: (N, 3) arrays.
+
+    Returns the aligned (N, k, 3) coordinates, the (N, 4, 4) alignment
+    transforms and their (N, 4, 4) inverses.
+    '''
+    o, R = pelvisAxes(lasis, rasis, lpsis, rpsis)
+    n = len(o)
+    T = np.zeros((n, 4, 4))
+    T[:, :3, :3] = R
+    T[:, :3, 3] = -np.einsum('nij,nj->ni', R, o)
+    T[:, 3, 3] = 1.0
+    inverseT = np.zeros((n, 4, 4))
+    inverseT[:, :3, :3] = R.transpose(0, 2, 1)
+    inverseT[:, :3, 3] = o
+    inverseT[:, 3, 3] = 1.0
+    aligned = np.einsum('nij,nkj->nki', R, coords - o[:, np.newaxis, :])
+    return aligned, T, inverseT
+
+
+def transformBatch(points, T):
+    '''
+    Apply (N, 4, 4) affine transforms to (N, k, 3) points.
+    '''
+    return np.einsum('nij,nkj->nki', T[:, :3, :3], points) + T[:, np.newaxis, :3, 3]
+
+
+def requiredLandmarks(predictor):
+    '''
+    The hip landmarks a prediction with predictor needs, those of the
+    alignment and of the regression, in HIPLANDMARKS order. Others may be
+    missing (NaN).
+    '''
+    return tuple(l for l in HIPLANDMARKS if l in ALIGNMENT_LANDMARKS or l in predictor.landmarks)
+
+
+def errorSummary(errors):
+    '''
+    OrderedDict of failure message to number of subjects, for the nonzero
+    codes in errors.
+    '''
+    codes, counts = np.unique(errors[errors != ERROR_NONE], return_counts=True)
+    return OrderedDict((ERROR_MESSAGES[c], int(n)) for c, n in zip(codes, counts))
+
+
+def stackLandmarks(subjects, names, errors=None, present=None):
+    '''
+    Gather the named landmarks from a sequence of landmark dicts into an
+    (N, k, 3) float array.
+
+    If an (N,) integer errors array is given, a subject with a missing or
+    malformed landmark gets NaN coordinates and an error code there instead
+    of raising. If an (N, k) boolean present array is given, missing
+    landmarks are instead left NaN and marked False there, for the caller
+    to decide which are needed.
+    '''
+    coords = np.empty((len(subjects), len(names), 3))
+    for i, s in enumerate(subjects):
+        for j, name in enumerate(names):
+            try:
+                coords[i, j] = s[name]
+            except KeyError:
+                if present is not None:
+                    coords[i, j] = np.nan
+                    present[i, j] = False
+                    continue
+                if errors is None:
+                    raise RuntimeError('HJC prediction failed, missing landmark: ' + name)
+                coords[i] = np.nan
+                errors[i] = ERROR_MISSING_LANDMARK
+                break
+            except (TypeError, ValueError):
+                if errors is None:
+                    raise RuntimeError('HJC prediction failed, invalid landmark: ' + name)
+                coords[i] = np.nan
+                errors[i] = ERROR_INVALID_LANDMARK
+                break
+    return coords
+
+
+def _flagErrors(errors, coords, T, hjcs, predictor, covariates):
+    # first failure found per subject, in pipeline order, keeping codes
+    # already set while stacking
+    required = [HIPLANDMARKS.index(l) for l in requiredLandmarks(predictor)]
+    failures = ((~np.isfinite(coords[:, required]).all(axis=(1, 2)), ERROR_INVALID_LANDMARK),
+                (~np.isfinite(T).all(axis=(1, 2)), ERROR_DEGENERATE_PELVIS)) + \
+               tuple((~np.isfinite(covariates[c]), ERROR_MISSING_COVARIATE) for c in predictor.covariates) + \
+               ((~np.isfinite(hjcs).all(axis=(1, 2)), ERROR_NONFINITE_HJC),)
+    for failed, code in failures:
+        errors[failed & (errors == ERROR_NONE)] = code
+
+
+def _predictChunk(coords, predictor, classIndices, covariates, frames, errors=None):
+    L = dict(zip(HIPLANDMARKS, np.moveaxis(coords, 1, 0)))
+    if errors is None:
+        aligned, T, inverseT = alignPelvisBatch(coords, *[L[l] for l in HIPLANDMARKS[:4]])
+        alignedL = dict(zip(HIPLANDMARKS, np.moveaxis(aligned, 1, 0)))
+        hjcs = predictor.predictMixed(alignedL, classIndices, covariates)
+    else:
+        # bad subjects run through with the rest of the chunk as NaNs, and
+        # are flagged and blanked afterwards
+        with np.errstate(invalid='ignore', divide='ignore'):
+            aligned, T, inverseT = alignPelvisBatch(coords, *[L[l] for l in HIPLANDMARKS[:4]])
+            alignedL = dict(zip(HIPLANDMARKS, np.moveaxis(aligned, 1, 0)))
+            hjcs = predictor.predictMixed(alignedL, classIndices, covariates)
+        _flagErrors(errors, coords, T, hjcs, predictor, covariates)
+        failed = errors != ERROR_NONE
+        T[failed] = inverseT[failed] = np.nan
+    if frames is None:
+        return transformBatch(hjcs, inverseT)
+    return fr.transformToFrames(hjcs, fr.frameTransforms(frames, L, T, inverseT, hjcs))
+
+
+def predictBatch(coords, method, popClass, covariates=None, chunkSize=DEFAULT_CHUNK_SIZE, workers=1,
+                 frames=None, progress=None, cancel=None, errors=None, out=None, completed=None, checkpoint=None,
+                 fused=False):
+    '''
+    Predict HJCs for a batch of pelvises.
+
+    coords: (N, 5, 3) array of hip landmarks ordered as HIPLANDMARKS.
+    method: name of a registered predictor.
+    popClass: population class supported by the predictor.
+    covariates: optional dict of (N,) arrays from
+        covariates.gatherCovariates. When given, each subject's population
+        class is looked up from its sex and age, with popClass used for
+        subjects of unknown sex, or for all if the dict has no sex, and a
+        measured pelvic width replaces the ASIS-ASIS distance in width
+        scaled regressions.
+    chunkSize: number of subjects processed per chunk, bounding the size
+        of temporary arrays.
+    workers: number of threads to process chunks with. Fused runs process
+        chunks one at a time, the kernel spreading each over Numba's own
+        threads.
+    frames: optional sequence of F registered output frame names.
+    progress: optional callable receiving a progress.ProgressEvent after
+        each chunk.
+    cancel: optional progress.CancelToken checked before each chunk. If it
+        is cancelled, progress.PredictionCancelled is raised carrying the
+        results of the completed chunks.
+    errors: optional (N,) integer array selecting fault tolerant mode.
+        Subjects that cannot be predicted get NaN HJCs and one of the
+        ERROR_ codes here, while the rest of their chunk is predicted as
+        usual. Nonzero codes already set, as by stackLandmarks, are kept.
+    out: optional array to write the HJCs into.
+    completed: optional (N,) boolean array, updated in place, of subjects
+        whose HJCs are already in out. Chunks that are entirely completed
+        are skipped, so passing back the out, errors and completed arrays
+        of an interrupted run resumes it.
+    checkpoint: optional callable checkpoint(start, stop) called after the
+        results of subjects start:stop have been written.
+    fused: use the Numba kernel fusing alignment, prediction and inverse
+        transform (see kernels.py) where it applies: a built-in predictor,
+        HJCs in the input frame only and not fault tolerant. Falls back to
+        the NumPy path otherwise, or if Numba is not installed.
+
+    Returns an (N, 2, 3) array of [left HJC, right HJC] in the input frame,
+    or an (N, F, 2, 3) array with the HJCs in each frame if frames is given.
+    '''
+    coords = np.asarray(coords, dtype=float)
+    predictor = predictors.getPredictor(method)
+    if covariates is None:
+        classIndices = np.full(len(coords), predictor.classIndex(popClass), dtype=np.intp)
+    else:
+        predictor.classIndex(popClass)
+        classIndices = cov.classIndices(covariates, predictor.popClasses, popClass)
+    if frames is None:
+        shape = (len(coords), 2, 3)
+    else:
+        frames = tuple(frames)
+        shape = (len(coords), len(frames), 2, 3)
+    if out is None:
+        hjcs = np.empty(shape)
+    elif out.shape != shape:
+        raise ValueError('out must be %s, got %s' % (shape, out.shape))
+    else:
+        hjcs = out
+    if completed is None:
+        completed = np.zeros(len(coords), dtype=bool)
+    if fused:
+        # imported only when asked for, so that other runs do not load Numba
+        from mapclientplugins.pelvislandmarkshjcpredictionstep import kernels
+        fused = kernels.fusable(predictor) and errors is None and frames in (None, ('input',))
+    starts = [s for s in range(0, len(coords), chunkSize) if not completed[s:s + chunkSize].all()]
+    tracker = ProgressTracker(sum(len(completed[s:s + chunkSize]) for s in starts), progress)
+
+    def run(start):
+        if cancel is not None and cancel.cancelled:
+            return
+        stop = start + chunkSize
+        if fused:
+            hjcs[start:stop] = kernels.fusedChunk(coords[start:stop], predictor, classIndices[start:stop],
+                                                  cov.sliceCovariates(covariates, start, stop)).reshape(
+                hjcs[start:stop].shape)
+        else:
+            hjcs[start:stop] = _predictChunk(coords[start:stop], predictor, classIndices[start:stop],
+                                             cov.sliceCovariates(covariates, start, stop), frames,
+                                             None if errors is None else errors[start:stop])
+        completed[start:stop] = True
+        if checkpoint is not None:
+            checkpoint(start, stop)
+        tracker.update(len(completed[start:stop]))
+
+    # the fused kernel's prange is not nested in our threads, Numba's
+    # threading layers do not support being entered from several threads
+    # and the process can hang at exit
+    if workers > 1 and len(starts) > 1 and not fused:
+        with ThreadPoolExecutor(workers) as pool:
+            list(pool.map(run, starts))
+    else:
+        for start in starts:
+            run(start)
+
+    if not completed.all():
+        hjcs[~completed] = np.nan
+        raise PredictionCancelled(hjcs, completed)
+    return hjcs
@@ -0,0 +1,92 @@
+'''
+Crash recovery for fault tolerant batch runs.
+
+A Checkpoint holds references to the output, error and completion arrays
+of a batch.predictBatch run and, passed as its checkpoint callback, saves
+them to a single .npz file at most once per interval. The file is written
+to a temporary name and renamed, so a crash never leaves a torn
+checkpoint. A rerun over the same inputs and settings restores the arrays
+and predictBatch skips the chunks already completed.
+'''
+
+import hashlib
+import os
+import threading
+import time
+
+import numpy as np
+
+
+def inputKey(coords, covariates=None, settings=''):
+    '''
+    Digest identifying a run: the landmark coordinates, covariate arrays
+    and a string of the prediction settings.
+    '''
+    h = hashlib.sha1()
+    h.update(np.ascontiguousarray(coords).tobytes())
+    for name in sorted(covariates or {}):
+        h.update(name.encode())
+        h.update(np.ascontiguousarray(covariates[name]).tobytes())
+    h.update(settings.encode())
+    return h.hexdigest()
+
+
+class Checkpoint(object):
+    '''
+    path: checkpoint file, conventionally in the step location.
+    key: inputKey of the run, a checkpoint with another key is ignored.
+    hjcs, errors, completed: the out, errors and completed arrays passed
+        to predictBatch.
+    interval: minimum seconds between saves.
+    '''
+
+    def __init__(self, path, key, hjcs, errors, completed, interval=30.0):
+        self.path = path
+        self.key = key
+        self._arrays = {'hjcs': hjcs, 'errors': errors, 'completed': completed}
+        self._interval = interval
+        self._last = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def resume(self):
+        '''
+        Restore the arrays from a checkpoint of the same run, if there is
+        one. Returns the number of subjects restored.
+        '''
+        if not os.path.exists(self.path):
+            return 0
+        with np.load(self.path, allow_pickle=False) as saved:
+            if str(saved['key']) != self.key or any(saved[name].shape != a.shape
+                                                    for name, a in self._arrays.items()):
+                return 0
+            for name, a in self._arrays.items():
+                a[...] = saved[name]
+        return int(self._arrays['completed'].sum())
+
+    def __call__(self, start, stop):
+        with self._lock:
+            if time.perf_counter() - self._last < self._interval:
+                return
+            self._save()
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        # completion is copied first, so every subject it marks has its
+        # results in the copies that follow
+        completed = self._arrays['completed'].copy()
+        tmpPath = self.path + '.tmp'
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(tmpPath, 'wb') as f:
+            np.savez(f, key=np.array(self.key), completed=completed,
+                     hjcs=self._arrays['hjcs'], errors=self._arrays['errors'])
+        os.replace(tmpPath, self.path)
+        self._last = time.perf_counter()
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
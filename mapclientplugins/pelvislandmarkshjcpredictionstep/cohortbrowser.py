@@ -0,0 +1,394 @@
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from PySide6.QtWidgets import QDialog, QAbstractItemView, QHBoxLayout, QVBoxLayout, QTableView, \
+    QHeaderView, QLabel, QPushButton, QCheckBox
+from PySide6.QtGui import QKeySequence, QShortcut
+from PySide6.QtCore import Qt, QAbstractTableModel, QItemSelectionModel, QModelIndex, Signal
+
+from mapclientplugins.pelvislandmarkshjcpredictionstep.hjcpredictionviewerwidget import \
+    MayaviHJCPredictionViewerWidget
+from mapclientplugins.pelvislandmarkshjcpredictionstep import lod
+from gias3.mapclientpluginutilities.viewers.mayaviscenewidget import MayaviSceneWidget
+
+import numpy as np
+
+HJCNAMES = ('HJC_left', 'HJC_right')
+
+
+def _formatPoint(p):
+    return '%.2f, %.2f, %.2f' % (p[0], p[1], p[2])
+
+
+class CohortSubjectModel(QAbstractTableModel):
+    '''
+    One row per subject with its identifier and predicted HJCs. Cells are
+    formatted on request, so only the rows in view cost anything.
+    '''
+    headers = ('subject',) + HJCNAMES
+
+    def __init__(self, subjectIds, hjcs, parent=None):
+        QAbstractTableModel.__init__(self, parent)
+        self._subjectIds = subjectIds
+        self._hjcs = hjcs
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._subjectIds)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or not index.isValid():
+            return None
+        if index.column() == 0:
+            return str(self._subjectIds[index.row()])
+        return _formatPoint(self._hjcs[index.row(), index.column() - 1])
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.headers[section]
+        return None
+
+
+class SubjectLandmarkModel(QAbstractTableModel):
+    '''
+    Landmarks and HJCs of the subject on display, with a visibility check
+    box per row. Paging between subjects only changes the data, never the
+    rows.
+    '''
+    visibilityChanged = Signal()
+    headers = ('landmarks', 'coordinates')
+
+    def __init__(self, names, parent=None):
+        QAbstractTableModel.__init__(self, parent)
+        self._names = names
+        self._points = np.zeros((len(names), 3))
+        self.visible = np.ones(len(names), dtype=bool)
+
+    @property
+    def points(self):
+        return self._points
+
+    def setPoints(self, points):
+        self._points = points
+        self.dataChanged.emit(self.index(0, 1), self.index(len(self._names) - 1, 1))
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._names)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+    def flags(self, index):
+        flags = Qt.ItemIsEnabled | Qt.ItemIsSelectable
+        if index.column() == 0:
+            flags |= Qt.ItemIsUserCheckable
+        return flags
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if index.column() == 0:
+            if role == Qt.DisplayRole:
+                return self._names[index.row()]
+            if role == Qt.CheckStateRole:
+                return Qt.Checked if self.visible[index.row()] else Qt.Unchecked
+        elif role == Qt.DisplayRole:
+            return _formatPoint(self._points[index.row()])
+        return None
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if role != Qt.CheckStateRole or index.column() != 0:
+            return False
+        self.visible[index.row()] = Qt.CheckState(value) == Qt.Checked
+        self.dataChanged.emit(index, index)
+        self.visibilityChanged.emit()
+        return True
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.headers[section]
+        return None
+
+
+class CohortBrowserWidget(QDialog):
+    '''
+    Review the predicted HJCs of a cohort one subject at a time.
+
+    With the subject table focused, subjects are paged with Right/N and
+    Left/P, Home and End jump to the first and last subject, and Up, Down,
+    PageUp and PageDown move through the table as usual. The landmark
+    table keeps its own key navigation. The arrays may be memory-mapped:
+    geometry of the next subjects is copied out on a background thread while
+    the current one is on display.
+
+    The HJCs of the whole cohort can be overlaid as one point cloud, drawn
+    with the viewer's level of detail policy or always as plain points.
+    '''
+    backgroundColour = MayaviHJCPredictionViewerWidget.backgroundColour
+    prefetchCount = 8
+    cacheSize = 64
+    rowHeight = 20
+    _cloudRenderArgs = {'mode': 'sphere', 'scale_factor': 3.0, 'color': (1, 0.6, 0), 'name': 'cohort HJC cloud'}
+
+    def __init__(self, landmarkNames, coords, hjcs, subjectIds=None, parent=None, plainPoints=False):
+        '''
+        landmarkNames: names of the k landmarks in coords.
+        coords: (N, k, 3) array of landmarks.
+        hjcs: (N, 2, 3) array of predicted [left, right] HJCs.
+        subjectIds: optional sequence of N subject identifiers.
+        plainPoints: draw the cohort HJC cloud as plain points at any
+            camera distance.
+        '''
+        QDialog.__init__(self, parent)
+        self._landmarkNames = list(landmarkNames)
+        self._coords = coords
+        self._hjcs = hjcs
+        if subjectIds is None:
+            subjectIds = np.arange(len(coords))
+        self._subjectIds = subjectIds
+        self._current = None
+        self._cache = OrderedDict()
+        self._prefetcher = ThreadPoolExecutor(1)
+        self._landmarkGlyphs = None
+        self._hjcGlyphs = None
+        self._plainPoints = plainPoints
+        self._cloudGlyphs = None
+        self._cloudPoints = None
+        self._lodLevels = {}
+        self._observers = []
+
+        self._setupGui()
+        self._scene = self._sceneWidget.visualisation.scene
+        self._scene.background = self.backgroundColour
+        self._makeConnections()
+        if len(self._subjectIds):
+            self.showSubject(0)
+
+    def _setupGui(self):
+        self.setWindowTitle('HJC Prediction Cohort Review')
+        self.resize(1145, 804)
+        layout = QHBoxLayout(self)
+        panel = QVBoxLayout()
+
+        self._subjectModel = CohortSubjectModel(self._subjectIds, self._hjcs, self)
+        self._subjectView = self._createView(self._subjectModel)
+        panel.addWidget(self._subjectView, 3)
+
+        self._landmarkModel = SubjectLandmarkModel(self._landmarkNames + list(HJCNAMES), self)
+        self._landmarkView = self._createView(self._landmarkModel)
+        panel.addWidget(self._landmarkView, 2)
+
+        self._statusLabel = QLabel(self)
+        panel.addWidget(self._statusLabel)
+        self._cloudCheckBox = QCheckBox('Show cohort HJCs', self)
+        panel.addWidget(self._cloudCheckBox)
+        buttons = QHBoxLayout()
+        self._previousButton = QPushButton('Previous', self)
+        self._nextButton = QPushButton('Next', self)
+        self._closeButton = QPushButton('Close', self)
+        for b in (self._previousButton, self._nextButton, self._closeButton):
+            buttons.addWidget(b)
+        panel.addLayout(buttons)
+        layout.addLayout(panel, 1)
+
+        self._sceneWidget = MayaviSceneWidget(self)
+        layout.addWidget(self._sceneWidget, 2)
+        self._subjectView.setFocus()
+
+    def _createView(self, model):
+        view = QTableView(self)
+        view.setModel(model)
+        view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        view.setSelectionMode(QAbstractItemView.SingleSelection)
+        view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        # fixed row heights keep large models from measuring every row
+        view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        view.verticalHeader().setDefaultSectionSize(self.rowHeight)
+        view.verticalHeader().setVisible(False)
+        view.horizontalHeader().setStretchLastSection(True)
+        return view
+
+    def _makeConnections(self):
+        self._previousButton.clicked.connect(self.showPrevious)
+        self._nextButton.clicked.connect(self.showNext)
+        self._closeButton.clicked.connect(self.accept)
+        self._subjectView.selectionModel().currentRowChanged.connect(self._subjectRowChanged)
+        self._landmarkModel.visibilityChanged.connect(self._redraw)
+        self._cloudCheckBox.toggled.connect(self.showCohortCloud)
+        self._observers = lod.observeInteraction(self._scene, self._updateLevelOfDetail)
+        if not self._observers:
+            self._scene.on_trait_change(self._sceneActivated, 'activated')
+
+        # on the subject table only, so that the landmark table keeps its
+        # arrow keys, and Up/Down/PageUp/PageDown page through the subject
+        # table's current row
+        shortcuts = ((self.showNext, (Qt.Key_Right, Qt.Key_N)),
+                     (self.showPrevious, (Qt.Key_Left, Qt.Key_P)),
+                     (self.showFirst, (Qt.Key_Home,)),
+                     (self.showLast, (Qt.Key_End,)))
+        for slot, keys in shortcuts:
+            for key in keys:
+                shortcut = QShortcut(QKeySequence(key), self._subjectView)
+                shortcut.setContext(Qt.WidgetWithChildrenShortcut)
+                shortcut.activated.connect(slot)
+
+    def showNext(self):
+        if self._current is not None:
+            self.showSubject(min(self._current + 1, len(self._subjectIds) - 1))
+
+    def showPrevious(self):
+        if self._current is not None:
+            self.showSubject(max(self._current - 1, 0))
+
+    def showFirst(self):
+        self.showSubject(0)
+
+    def showLast(self):
+        self.showSubject(len(self._subjectIds) - 1)
+
+    def _subjectRowChanged(self, current, previous):
+        if current.isValid() and current.row() != self._current:
+            self.showSubject(current.row())
+
+    def showSubject(self, i):
+        if i == self._current or not 0 <= i < len(self._subjectIds):
+            return
+        self._current = i
+        points = self._geometry(i)
+        self._landmarkModel.setPoints(points)
+        self._redraw()
+
+        index = self._subjectModel.index(i, 0)
+        self._subjectView.selectionModel().setCurrentIndex(
+            index, QItemSelectionModel.ClearAndSelect | QItemSelectionModel.Rows)
+        self._subjectView.scrollTo(index)
+        self._statusLabel.setText('subject %s (%d of %d)' % (self._subjectIds[i], i + 1, len(self._subjectIds)))
+        self._prefetch(i)
+
+    def _geometry(self, i):
+        entry = self._cache.get(i)
+        if entry is None or entry.cancel():
+            # not prefetched, or still queued behind other prefetches
+            entry = self._cache[i] = Future()
+            entry.set_result(self._loadGeometry(i))
+        self._cache.move_to_end(i)
+        return entry.result()
+
+    def _loadGeometry(self, i):
+        # contiguous copy of landmarks followed by HJCs, touching the
+        # underlying (possibly memory-mapped) pages off the GUI thread
+        return np.concatenate([self._coords[i], self._hjcs[i]]).astype(float)
+
+    def _prefetch(self, i):
+        for j in list(range(i + 1, i + 1 + self.prefetchCount)) + [i - 1]:
+            if 0 <= j < len(self._subjectIds) and j not in self._cache:
+                self._cache[j] = self._prefetcher.submit(self._loadGeometry, j)
+        while len(self._cache) > self.cacheSize:
+            self._cache.popitem(last=False)
+
+    def _redraw(self):
+        points = self._landmarkModel.points
+        visible = self._landmarkModel.visible
+        nLandmarks = len(self._landmarkNames)
+        self._landmarkGlyphs = self._drawPoints(self._landmarkGlyphs, points[:nLandmarks][visible[:nLandmarks]],
+                                                MayaviHJCPredictionViewerWidget._landmarkRenderArgs,
+                                                'cohort landmarks')
+        self._hjcGlyphs = self._drawPoints(self._hjcGlyphs, points[nLandmarks:][visible[nLandmarks:]],
+                                           MayaviHJCPredictionViewerWidget._hjcRenderArgs,
+                                           'cohort HJCs')
+
+    def _drawPoints(self, glyphs, points, renderArgs, name):
+        # one glyph source per point set, updated in place between subjects
+        if glyphs is None:
+            if not len(points):
+                return None
+            args = dict(renderArgs)
+            args['name'] = name
+            return self._scene.mlab.points3d(points[:, 0], points[:, 1], points[:, 2], **args)
+        glyphs.visible = bool(len(points))
+        if len(points):
+            glyphs.mlab_source.reset(x=points[:, 0], y=points[:, 1], z=points[:, 2])
+        return glyphs
+
+    def showCohortCloud(self, show=True):
+        '''
+        Overlay the HJCs of every subject as a single point cloud.
+        '''
+        if show and self._cloudGlyphs is None:
+            points = np.asarray(self._hjcs, dtype=float).reshape(-1, 3)
+            self._cloudPoints = points[np.isfinite(points).all(axis=1)]
+            if not len(self._cloudPoints):
+                return
+            self._scene.disable_render = True
+            try:
+                self._cloudGlyphs = self._scene.mlab.points3d(self._cloudPoints[:, 0], self._cloudPoints[:, 1],
+                                                              self._cloudPoints[:, 2], **self._cloudRenderArgs)
+                self._updateLevelOfDetail()
+            finally:
+                self._scene.disable_render = False
+        elif self._cloudGlyphs is not None:
+            self._cloudGlyphs.visible = show
+
+    def _sceneActivated(self):
+        self._scene.on_trait_change(self._sceneActivated, 'activated', remove=True)
+        self._observers = lod.observeInteraction(self._scene, self._updateLevelOfDetail)
+
+    def _updateLevelOfDetail(self):
+        # subject glyphs are few, only the cohort cloud needs a level of detail
+        if self._cloudGlyphs is None or self._scene is None or self._scene.interactor is None:
+            return
+        lod.updateGlyphs(self._scene, [('cloud', self._cloudGlyphs, self._cloudPoints,
+                                        self._cloudRenderArgs['scale_factor'], self._plainPoints)],
+                         self._lodLevels, MayaviHJCPredictionViewerWidget.levelOfDetail,
+                         MayaviHJCPredictionViewerWidget.plainPointSize)
+
+    def done(self, result):
+        self._prefetcher.shutdown(wait=False)
+        self._cache.clear()
+        QDialog.done(self, result)
+
+    def release(self):
+        '''
+        Tear the browser down: remove the glyph pipelines and interaction
+        observers, close the VTK render window and schedule the dialog for
+        deletion. The browser cannot be used afterwards.
+        '''
+        if self._scene is None:
+            return
+        self._prefetcher.shutdown(wait=False)
+        self._cache.clear()
+        self._scene.disable_render = True
+        for glyphs in (self._landmarkGlyphs, self._hjcGlyphs, self._cloudGlyphs):
+            if glyphs is not None:
+                glyphs.remove()
+        self._landmarkGlyphs = self._hjcGlyphs = self._cloudGlyphs = None
+        self._cloudPoints = None
+        self._lodLevels.clear()
+        lod.removeObservers(self._scene, self._observers)
+        self._scene.on_trait_change(self._sceneActivated, 'activated', remove=True)
+        self._scene.close()
+        self._scene = None
+        self._coords = self._hjcs = None
+        self.close()
+        self.deleteLater()
@@ -0,0 +1,123 @@
+'''
+Preparation of a cohort of subject dicts for batch prediction.
+
+prepareCohort turns the subjects and a step configuration into the arrays
+a cohort run predicts over: the stacked hip landmarks, completed or
+imputed as configured, the error codes of fault tolerant runs, the
+covariates the method is given and, with Deduplicate Subjects, the index
+of distinct landmark sets. It needs neither Qt nor MAP Client, so the
+step's cohort runs and distributed.submitCohort prepare a cohort the same
+way.
+'''
+
+import logging
+
+import numpy as np
+
+from mapclientplugins.pelvislandmarkshjcpredictionstep import configschema
+from mapclientplugins.pelvislandmarkshjcpredictionstep import covariates as cov
+from mapclientplugins.pelvislandmarkshjcpredictionstep import predictors
+from mapclientplugins.pelvislandmarkshjcpredictionstep import completeness
+from mapclientplugins.pelvislandmarkshjcpredictionstep import dedup
+from mapclientplugins.pelvislandmarkshjcpredictionstep import batch
+from mapclientplugins.pelvislandmarkshjcpredictionstep.batch import HIPLANDMARKS
+
+logger = logging.getLogger(__name__)
+
+
+class PreparedCohort(object):
+    '''
+    coords: (N, 5, 3) hip landmarks, imputed ones filled in.
+    present: (N, 5) landmarks given in the subject dicts.
+    imputed: (N, 5) landmarks filled in by imputation.
+    errors: (N,) error codes, None unless the run is fault tolerant.
+    covariates: dict of (N,) covariate arrays, or None.
+    completeness: the completeness report for the batch metadata.
+    duplicates: dedup.DuplicateIndex, None unless deduplicating.
+
+    The run arrays are those predicted, the distinct subjects' rows when
+    deduplicating, and scatter expands results over them to all subjects.
+    '''
+
+    def __init__(self, coords, present, imputed, errors, covariates, completeness, duplicates=None):
+        self.coords = coords
+        self.present = present
+        self.imputed = imputed
+        self.errors = errors
+        self.covariates = covariates
+        self.completeness = completeness
+        self.duplicates = duplicates
+        self.runCoords = self._gather(coords)
+        self.runCovariates = self._gather(covariates)
+        self.runErrors = self._gather(errors)
+
+    def _gather(self, values):
+        return values if self.duplicates is None else self.duplicates.gather(values)
+
+    def scatter(self, values):
+        return values if self.duplicates is None else self.duplicates.scatter(values)
+
+
+def completeLandmarks(coords, present, errors, config):
+    '''
+    Check that every subject has the landmarks of the alignment and the
+    configured method, imputing those missing from a shape model of the
+    batch's complete subjects with Impute Landmarks. Subjects still
+    missing one get ERROR_MISSING_LANDMARK, or RuntimeError is raised if
+    errors is None.
+
+    Returns the coords, the (N, 5) imputed mask and the completeness
+    report.
+    '''
+    method = config['Prediction Method']
+    impute = bool(config.get('Impute Landmarks'))
+    imputed = np.zeros(present.shape, dtype=bool)
+    valid = np.ones(len(coords), dtype=bool) if errors is None else errors == batch.ERROR_NONE
+    usable = completeness.usableSubjects(present, method)
+    if impute and not usable[valid].all():
+        complete = present.all(axis=1) & valid
+        if complete.any():
+            model = completeness.PelvisShapeModel.fit(coords[complete])
+            coords, imputed = model.impute(coords, present, ~usable & valid)
+            usable = completeness.usableSubjects(present | imputed, method)
+        else:
+            logger.warning('no complete subjects to fit the landmark imputation model to')
+    report = completeness.completenessReport(present, method, imputed if impute else None)
+    logger.info('landmark completeness for %s: %s', method, report)
+
+    missing = ~usable & valid
+    if missing.any():
+        if errors is None:
+            required = completeness.requiredMask(method)
+            available = present[np.flatnonzero(missing)[0]]
+            raise RuntimeError('HJC prediction failed, missing landmark: ' +
+                               config[HIPLANDMARKS[np.flatnonzero(required & ~available)[0]]])
+        errors[missing] = batch.ERROR_MISSING_LANDMARK
+    return coords, imputed, report
+
+
+def prepareCohort(subjects, config):
+    '''
+    Prepare a sequence of subject dicts for prediction with config, a step
+    configuration. Keys missing from config take their defaults.
+    '''
+    settings = configschema.defaultConfig()
+    settings.update(config)
+    faultTolerant = bool(settings.get('Fault Tolerant'))
+    errors = np.zeros(len(subjects), dtype=np.int8) if faultTolerant else None
+    present = np.ones((len(subjects), len(HIPLANDMARKS)), dtype=bool)
+    coords = batch.stackLandmarks(subjects, [settings[l] for l in HIPLANDMARKS], errors, present)
+    coords, imputed, report = completeLandmarks(coords, present, errors, settings)
+    subjectCovariates = cov.gatherCovariates(subjects)
+    if not settings.get('Subject Covariates'):
+        # only the method's regression inputs, without sex and age every
+        # subject gets the configured population class
+        predictor = predictors.getPredictor(settings['Prediction Method'])
+        subjectCovariates = dict((c, subjectCovariates[c]) for c in predictor.covariates) or None
+
+    duplicates = None
+    if settings.get('Deduplicate Subjects'):
+        tolerance = float(settings.get('Duplicate Tolerance', 0.0))
+        duplicates = dedup.DuplicateIndex.fromLandmarks(coords, tolerance, subjectCovariates, errors)
+        logger.info('%d subjects have %d distinct landmark sets', duplicates.subjects, len(duplicates))
+    return PreparedCohort(coords, present, imputed, errors, subjectCovariates, report, duplicates)
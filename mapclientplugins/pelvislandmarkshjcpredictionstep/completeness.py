@@ -0,0 +1,183 @@
+'''
+Method-aware landmark completeness and imputation for cohort batches.
+
+A subject can be predicted when it has the landmarks of the ISB pelvis
+alignment, the four iliac spines, and those the selected method's
+regression reads (batch.requiredLandmarks). Tylkowski, Harrington and Hara
+do not need the PS, for example.
+
+Subjects missing required landmarks can have them imputed from a
+PelvisShapeModel, the mean pelvis in the ISB frame and its leading
+principal modes, fitted to the complete subjects of the batch. Each
+incomplete subject's observed landmarks are rigidly registered to the
+model, and the mode weights found by a ridge least squares solve shared
+by every subject missing the same landmarks. Missing landmarks are then
+read off the fitted shape. Subjects are grouped by which landmarks they
+miss, at most 31 groups, and each group is imputed in one vectorised
+pass.
+'''
+
+from collections import OrderedDict
+
+import numpy as np
+
+from mapclientplugins.pelvislandmarkshjcpredictionstep import predictors
+from mapclientplugins.pelvislandmarkshjcpredictionstep.batch import HIPLANDMARKS, alignPelvisBatch, requiredLandmarks
+
+DEFAULT_MODES = 3
+DEFAULT_ITERATIONS = 3
+# smallest observed landmark spread, relative to the largest, for which the
+# registration is well defined
+_MIN_SPREAD = 1e-3
+# smallest mode variance, relative to the squared size of the mean shape,
+# for a mode to be kept
+_MIN_VARIANCE = 1e-12
+
+
+def requiredMask(method):
+    '''
+    (5,) boolean mask over HIPLANDMARKS of the landmarks method needs.
+    '''
+    required = requiredLandmarks(predictors.getPredictor(method))
+    return np.array([l in required for l in HIPLANDMARKS])
+
+
+def usableSubjects(present, method):
+    '''
+    (N,) boolean mask of subjects with every landmark method needs, from
+    the (N, 5) present mask of batch.stackLandmarks.
+    '''
+    return present[:, requiredMask(method)].all(axis=1)
+
+
+def completenessReport(present, method, imputed=None):
+    '''
+    JSON serialisable summary of landmark completeness for method: subject
+    counts, the landmarks it requires and how often each landmark is
+    missing.
+    '''
+    report = OrderedDict()
+    report['subjects'] = len(present)
+    report['complete'] = int(present.all(axis=1).sum())
+    report['usable'] = int(usableSubjects(present, method).sum())
+    report['required'] = list(requiredLandmarks(predictors.getPredictor(method)))
+    report['missing'] = OrderedDict((l, int((~present[:, i]).sum()))
+                                    for i, l in enumerate(HIPLANDMARKS) if not present[:, i].all())
+    if imputed is not None:
+        report['imputed'] = int(imputed.any(axis=1).sum())
+        report['usableAfterImputation'] = int(usableSubjects(present | imputed, method).sum())
+    return report
+
+
+def _register(source, target):
+    # least squares rotations R and translations t with R source + t ~ target,
+    # for (n, m, 3) point sets, and whether each is well defined
+    sourceMean = source.mean(axis=1)
+    targetMean = target.mean(axis=1)
+    H = np.einsum('nmi,nmj->nij', source - sourceMean[:, np.newaxis], target - targetMean[:, np.newaxis])
+    U, S, Vt = np.linalg.svd(H)
+    V = Vt.transpose(0, 2, 1)
+    d = np.sign(np.linalg.det(V @ U.transpose(0, 2, 1)))
+    V[:, :, 2] *= d[:, np.newaxis]
+    R = V @ U.transpose(0, 2, 1)
+    t = targetMean - np.einsum('nij,nj->ni', R, sourceMean)
+    return R, t, S[:, 1] > _MIN_SPREAD * S[:, 0]
+
+
+class PelvisShapeModel(object):
+    '''
+    mean: (5, 3) mean hip landmarks, ordered as HIPLANDMARKS, in the ISB
+        pelvis frame.
+    modes: (15, k) orthonormal principal modes of the flattened landmarks.
+    variances: (k,) variance along each mode.
+    noise: residual variance per coordinate not explained by the modes,
+        weighting the ridge penalty on the mode weights.
+    '''
+
+    def __init__(self, mean, modes, variances, noise):
+        self.mean = np.asarray(mean, dtype=float)
+        self.variances = np.asarray(variances, dtype=float)
+        self.modes = np.asarray(modes, dtype=float).reshape(15, len(self.variances))
+        self.noise = float(noise)
+
+    @classmethod
+    def fit(cls, coords, modes=DEFAULT_MODES):
+        '''
+        Fit to (n, 5, 3) complete hip landmarks in any frames. modes=0
+        gives a mean shape model. Modes without variance, as when the
+        subjects are identical, are left out.
+        '''
+        coords = np.asarray(coords, dtype=float)
+        coords = coords[np.isfinite(coords).all(axis=(1, 2))]
+        if not len(coords):
+            raise RuntimeError('HJC prediction failed, no complete subjects to fit the imputation model to')
+        with np.errstate(invalid='ignore', divide='ignore'):
+            aligned = alignPelvisBatch(coords, *[coords[:, i] for i in range(4)])[0]
+        aligned = aligned[np.isfinite(aligned).all(axis=(1, 2))].reshape(-1, 15)
+        if not len(aligned):
+            raise RuntimeError('HJC prediction failed, no complete subjects to fit the imputation model to')
+        mean = aligned.mean(axis=0)
+        k = min(modes, len(aligned) - 1, 15)
+        if k > 0:
+            _, s, Vt = np.linalg.svd(aligned - mean, full_matrices=False)
+            eigenvalues = s ** 2 / (len(aligned) - 1)
+            # a mode of zero variance would make its ridge penalty infinite
+            k = int((eigenvalues[:k] > _MIN_VARIANCE * (mean ** 2).sum()).sum())
+        if k > 0:
+            rest = eigenvalues[k:]
+            noise = rest.mean() if len(rest) else 0.0
+            # floor, so that the ridge still regularises a model that fits
+            # its subjects exactly
+            noise = max(noise, 1e-6 * eigenvalues.sum(), 1e-12)
+            return cls(mean.reshape(5, 3), Vt[:k].T, eigenvalues[:k], noise)
+        return cls(mean.reshape(5, 3), np.zeros((15, 0)), np.zeros(0), 1.0)
+
+    def impute(self, coords, present, subjects=None, iterations=DEFAULT_ITERATIONS):
+        '''
+        Fill missing landmarks.
+
+        coords: (N, 5, 3) hip landmarks, NaN where missing.
+        present: (N, 5) boolean mask of the landmarks given.
+        subjects: optional (N,) boolean mask of the subjects to impute, by
+            default all those missing a landmark.
+
+        Returns a copy of coords with the missing landmarks filled and an
+        (N, 5) boolean mask of the landmarks imputed. Subjects with fewer
+        than three observed landmarks, or whose observed landmarks are
+        collinear, are left as they are.
+        '''
+        coords = np.array(coords, dtype=float)
+        imputed = np.zeros(present.shape, dtype=bool)
+        todo = ~present.all(axis=1)
+        if subjects is not None:
+            todo &= subjects
+        patterns, groups = np.unique(present[todo], axis=0, return_inverse=True)
+        rows = np.flatnonzero(todo)
+        for g, observed in enumerate(patterns):
+            if observed.sum() < 3:
+                continue
+            group = rows[groups.ravel() == g]
+            filled, ok = self._imputeGroup(coords[group], observed, iterations)
+            coords[group[ok]] = filled[ok]
+            imputed[group[ok]] = ~observed
+        return coords, imputed
+
+    def _imputeGroup(self, coords, observed, iterations):
+        # subjects missing the same landmarks share the ridge system
+        n = len(coords)
+        target = coords[:, observed]
+        modes = self.modes.reshape(5, 3, len(self.variances))[observed].reshape(3 * observed.sum(), len(self.variances))
+        system = modes.T @ modes + np.diag(self.noise / self.variances) if len(self.variances) else None
+        shapes = np.broadcast_to(self.mean, (n, 5, 3))
+        R, t, ok = _register(shapes[:, observed], target)
+        for _ in range(iterations if system is not None else 0):
+            # observed landmarks in the model frame, R^T (x - t)
+            local = np.einsum('nji,nmj->nmi', R, target - t[:, np.newaxis])
+            residuals = (local - self.mean[observed]).reshape(n, -1)
+            weights = np.linalg.solve(system, modes.T @ residuals.T)
+            shapes = self.mean + (self.modes @ weights).T.reshape(n, 5, 3)
+            # the pose of the updated shapes, which the filled landmarks take
+            R, t, ok = _register(shapes[:, observed], target)
+        filled = coords.copy()
+        filled[:, ~observed] = np.einsum('nij,nmj->nmi', R, shapes[:, ~observed]) + t[:, np.newaxis]
+        return filled, ok
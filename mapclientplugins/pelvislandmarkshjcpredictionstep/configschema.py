@@ -0,0 +1,114 @@
+'''
+Step configuration schema and validation without Qt.
+
+The defaults and the checks on each configuration key live here, so that
+deserialize, the configure dialog and headless runs share one validator
+and loading a workflow does not need to construct a dialog.
+'''
+
+from collections import OrderedDict
+
+from mapclientplugins.pelvislandmarkshjcpredictionstep import predictors
+from mapclientplugins.pelvislandmarkshjcpredictionstep import frames
+from mapclientplugins.pelvislandmarkshjcpredictionstep.batch import HIPLANDMARKS, DEFAULT_CHUNK_SIZE
+
+BOOL_KEYS = ('GUI', 'Subject Covariates', 'Profile', 'Fault Tolerant', 'Resumable Job', 'Spatial Index',
+             'Plain Cohort Points', 'Fused Kernel', 'HJC Jacobian', 'Impute Landmarks', '2D Preview',
+             'Deduplicate Subjects')
+POSITIVE_INT_KEYS = ('Chunk Size', 'Workers')
+NON_NEGATIVE_FLOAT_KEYS = ('Duplicate Tolerance',)
+
+
+def defaultConfig():
+    config = OrderedDict()
+    config['identifier'] = ''
+    config['Prediction Method'] = predictors.predictorNames()[0]
+    config['Population Class'] = predictors.getPredictor(config['Prediction Method']).popClasses[0]
+    config['GUI'] = True
+    config['Subject Covariates'] = False
+    config['Profile'] = False
+    config['Output Frames'] = ''
+    config['Chunk Size'] = DEFAULT_CHUNK_SIZE
+    config['Workers'] = 1
+    config['Fault Tolerant'] = False
+    config['Resumable Job'] = False
+    config['Spatial Index'] = False
+    config['Plain Cohort Points'] = False
+    config['Fused Kernel'] = False
+    config['HJC Jacobian'] = False
+    config['Impute Landmarks'] = False
+    config['2D Preview'] = False
+    config['Deduplicate Subjects'] = False
+    config['Duplicate Tolerance'] = 0.0
+    for l in HIPLANDMARKS:
+        config[l] = l
+    return config
+
+
+def _isPositiveInt(value):
+    try:
+        return int(value) == value and int(value) > 0
+    except (TypeError, ValueError):
+        return False
+
+
+def _isNonNegativeNumber(value):
+    try:
+        return not isinstance(value, bool) and float(value) >= 0.0
+    except (TypeError, ValueError):
+        return False
+
+
+def invalidKeys(config, identifierOccursCount=None, previousIdentifier=None):
+    '''
+    Keys of config with invalid values, in schema order. Missing keys are
+    invalid.
+
+    identifierOccursCount: optional callable giving the number of steps in
+        the workflow with an identifier. When given, the identifier must
+        be unused, or used once if it is previousIdentifier, which
+        defaults to the configured identifier.
+    '''
+    invalid = []
+    for key in defaultConfig():
+        if key not in config:
+            invalid.append(key)
+
+    if 'identifier' in config and identifierOccursCount is not None:
+        identifier = config['identifier']
+        if previousIdentifier is None:
+            previousIdentifier = identifier
+        count = identifierOccursCount(identifier)
+        if not (count == 0 or (count == 1 and previousIdentifier == identifier)):
+            invalid.append('identifier')
+
+    method = config.get('Prediction Method')
+    if method not in predictors.predictorNames():
+        invalid += ['Prediction Method', 'Population Class']
+    elif config.get('Population Class') not in predictors.getPredictor(method).popClasses:
+        invalid.append('Population Class')
+
+    outputFrames = config.get('Output Frames', '')
+    if not isinstance(outputFrames, str) or \
+            not all(f in frames.frameNames() for f in frames.parseFrameNames(outputFrames)):
+        invalid.append('Output Frames')
+
+    for key in BOOL_KEYS:
+        if key in config and not isinstance(config[key], (bool, int)):
+            invalid.append(key)
+    for key in POSITIVE_INT_KEYS:
+        if key in config and not _isPositiveInt(config[key]):
+            invalid.append(key)
+    for key in NON_NEGATIVE_FLOAT_KEYS:
+        if key in config and not _isNonNegativeNumber(config[key]):
+            invalid.append(key)
+    for key in HIPLANDMARKS:
+        if key in config and not (isinstance(config[key], str) and config[key]):
+            invalid.append(key)
+
+    order = list(defaultConfig())
+    return sorted(set(invalid), key=lambda k: order.index(k) if k in order else len(order))
+
+
+def isValid(config, identifierOccursCount=None, previousIdentifier=None):
+    return not invalidKeys(config, identifierOccursCount, previousIdentifier)
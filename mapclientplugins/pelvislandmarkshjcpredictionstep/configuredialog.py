@@ -1,5 +1,8 @@
 from PySide6 import QtWidgets
 from mapclientplugins.pelvislandmarkshjcpredictionstep.ui_configuredialog import Ui_Dialog
+from mapclientplugins.pelvislandmarkshjcpredictionstep import predictors
+from mapclientplugins.pelvislandmarkshjcpredictionstep import configschema
+from mapclientplugins.pelvislandmarkshjcpredictionstep.batch import DEFAULT_CHUNK_SIZE
 
 INVALID_STYLE_SHEET = 'background-color: rgba(239, 0, 0, 50)'
 DEFAULT_STYLE_SHEET = ''
@@ -10,7 +13,7 @@ class ConfigureDialog(QtWidgets.QDialog):
     Configure dialog to present the user with the options to configure this step.
     '''
 
-    def __init__(self, methods, popClasses, parent=None):
+    def __init__(self, methods, parent=None):
         '''
         Constructor
         '''
@@ -23,23 +26,43 @@ class ConfigureDialog(QtWidgets.QDialog):
         # and know how many occurrences of the current identifier there should
         # be.
         self._previousIdentifier = ''
+        # Options without a widget are carried through unchanged.
+        self._config = {}
         # Set a place holder for a callable that will get set from the step.
         # We will use this method to decide whether the identifier is unique.
         self.identifierOccursCount = None
 
         self._methods = methods
-        self._popClasses = popClasses
         self._makeConnections()
         self._initOptions()
 
     def _makeConnections(self):
         self._ui.lineEdit0.textChanged.connect(self.validate)
+        self._ui.lineEditFrames.textChanged.connect(self.validate)
+        for lineEdit in (self._ui.lineEditLASIS, self._ui.lineEditRASIS, self._ui.lineEditLPSIS,
+                         self._ui.lineEditRPSIS, self._ui.lineEditPS):
+            lineEdit.textChanged.connect(self._landmarkChanged)
+        self._ui.comboBoxMethod.currentTextChanged.connect(self._methodChanged)
 
     def _initOptions(self):
         for m in self._methods:
             self._ui.comboBoxMethod.addItem(m)
-        for c in self._popClasses:
-            self._ui.comboBoxClass.addItem(c)
+
+    def _methodChanged(self, method):
+        # offer only the population classes the selected method supports
+        currentClass = self._ui.comboBoxClass.currentText()
+        self._ui.comboBoxClass.clear()
+        if method in predictors.predictorNames():
+            popClasses = predictors.getPredictor(method).popClasses
+            self._ui.comboBoxClass.addItems(popClasses)
+            if currentClass in popClasses:
+                self._ui.comboBoxClass.setCurrentIndex(popClasses.index(currentClass))
+        if self.identifierOccursCount is not None:
+            self.validate()
+
+    def _landmarkChanged(self):
+        if self.identifierOccursCount is not None:
+            self.validate()
 
     def accept(self):
         '''
@@ -64,14 +87,27 @@ class ConfigureDialog(QtWidgets.QDialog):
         '''
         # Determine if the current identifier is unique throughout the workflow
         # The identifierOccursCount method is part of the interface to the workflow framework.
-        value = self.identifierOccursCount(self._ui.lineEdit0.text())
-        valid = (value == 0) or (value == 1 and self._previousIdentifier == self._ui.lineEdit0.text())
-        if valid:
-            self._ui.lineEdit0.setStyleSheet(DEFAULT_STYLE_SHEET)
-        else:
-            self._ui.lineEdit0.setStyleSheet(INVALID_STYLE_SHEET)
+        invalid = configschema.invalidKeys(self._currentConfig(), self.identifierOccursCount,
+                                           self._previousIdentifier)
+        fields = ((self._ui.lineEdit0, ('identifier',)),
+                  (self._ui.comboBoxClass, ('Prediction Method', 'Population Class')),
+                  (self._ui.lineEditFrames, ('Output Frames',)),
+                  (self._ui.lineEditLASIS, ('LASIS',)),
+                  (self._ui.lineEditRASIS, ('RASIS',)),
+                  (self._ui.lineEditLPSIS, ('LPSIS',)),
+                  (self._ui.lineEditRPSIS, ('RPSIS',)),
+                  (self._ui.lineEditPS, ('PS',)),
+                  (self._ui.spinBoxChunkSize, ('Chunk Size',)),
+                  (self._ui.spinBoxWorkers, ('Workers',)),
+                  (self._ui.doubleSpinBoxTolerance, ('Duplicate Tolerance',)),
+                  )
+        for widget, keys in fields:
+            if any(k in invalid for k in keys):
+                widget.setStyleSheet(INVALID_STYLE_SHEET)
+            else:
+                widget.setStyleSheet(DEFAULT_STYLE_SHEET)
 
-        return valid
+        return not invalid
 
     def getConfig(self):
         '''
@@ -80,7 +116,10 @@ class ConfigureDialog(QtWidgets.QDialog):
         identifier over the whole of the workflow.
         '''
         self._previousIdentifier = self._ui.lineEdit0.text()
-        config = {}
+        return self._currentConfig()
+
+    def _currentConfig(self):
+        config = dict(self._config)
         config['identifier'] = self._ui.lineEdit0.text()
         config['Prediction Method'] = self._ui.comboBoxMethod.currentText()
         config['Population Class'] = self._ui.comboBoxClass.currentText()
@@ -90,6 +129,21 @@ class ConfigureDialog(QtWidgets.QDialog):
         config['RPSIS'] = self._ui.lineEditRPSIS.text()
         config['PS'] = self._ui.lineEditPS.text()
         config['GUI'] = self._ui.checkBoxGUI.isChecked()
+        config['Subject Covariates'] = self._ui.checkBoxCovariates.isChecked()
+        config['Profile'] = self._ui.checkBoxProfile.isChecked()
+        config['Output Frames'] = self._ui.lineEditFrames.text()
+        config['Fault Tolerant'] = self._ui.checkBoxFaultTolerant.isChecked()
+        config['Resumable Job'] = self._ui.checkBoxJob.isChecked()
+        config['Spatial Index'] = self._ui.checkBoxIndex.isChecked()
+        config['Impute Landmarks'] = self._ui.checkBoxImpute.isChecked()
+        config['2D Preview'] = self._ui.checkBoxPreview.isChecked()
+        config['Chunk Size'] = self._ui.spinBoxChunkSize.value()
+        config['Workers'] = self._ui.spinBoxWorkers.value()
+        config['Plain Cohort Points'] = self._ui.checkBoxPlainPoints.isChecked()
+        config['Fused Kernel'] = self._ui.checkBoxFused.isChecked()
+        config['HJC Jacobian'] = self._ui.checkBoxJacobian.isChecked()
+        config['Deduplicate Subjects'] = self._ui.checkBoxDedup.isChecked()
+        config['Duplicate Tolerance'] = self._ui.doubleSpinBoxTolerance.value()
         return config
 
     def setConfig(self, config):
@@ -98,13 +152,30 @@ class ConfigureDialog(QtWidgets.QDialog):
         set the _previousIdentifier value so that we can check uniqueness of the
         identifier over the whole of the workflow.
         '''
+        self._config = dict(config)
         self._previousIdentifier = config['identifier']
         self._ui.lineEdit0.setText(config['identifier'])
-        self._ui.comboBoxMethod.setCurrentIndex(self._methods.index(config['Prediction Method']))
-        self._ui.comboBoxClass.setCurrentIndex(self._popClasses.index(config['Population Class']))
+        if config['Prediction Method'] in self._methods:
+            self._ui.comboBoxMethod.setCurrentIndex(self._methods.index(config['Prediction Method']))
+        self._ui.comboBoxClass.setCurrentIndex(self._ui.comboBoxClass.findText(config['Population Class']))
         self._ui.lineEditLASIS.setText(config['LASIS'])
         self._ui.lineEditRASIS.setText(config['RASIS'])
         self._ui.lineEditLPSIS.setText(config['LPSIS'])
         self._ui.lineEditRPSIS.setText(config['RPSIS'])
         self._ui.lineEditPS.setText(config['PS'])
         self._ui.checkBoxGUI.setChecked(bool(config['GUI']))
+        self._ui.checkBoxCovariates.setChecked(bool(config.get('Subject Covariates', False)))
+        self._ui.checkBoxProfile.setChecked(bool(config.get('Profile', False)))
+        self._ui.lineEditFrames.setText(config.get('Output Frames', ''))
+        self._ui.checkBoxFaultTolerant.setChecked(bool(config.get('Fault Tolerant', False)))
+        self._ui.checkBoxJob.setChecked(bool(config.get('Resumable Job', False)))
+        self._ui.checkBoxIndex.setChecked(bool(config.get('Spatial Index', False)))
+        self._ui.checkBoxImpute.setChecked(bool(config.get('Impute Landmarks', False)))
+        self._ui.checkBoxPreview.setChecked(bool(config.get('2D Preview', False)))
+        self._ui.spinBoxChunkSize.setValue(int(config.get('Chunk Size', DEFAULT_CHUNK_SIZE)))
+        self._ui.spinBoxWorkers.setValue(int(config.get('Workers', 1)))
+        self._ui.checkBoxPlainPoints.setChecked(bool(config.get('Plain Cohort Points', False)))
+        self._ui.checkBoxFused.setChecked(bool(config.get('Fused Kernel', False)))
+        self._ui.checkBoxJacobian.setChecked(bool(config.get('HJC Jacobian', False)))
+        self._ui.checkBoxDedup.setChecked(bool(config.get('Deduplicate Subjects', False)))
+        self._ui.doubleSpinBoxTolerance.setValue(float(config.get('Duplicate Tolerance', 0.0)))
@@ -0,0 +1,119 @@
+'''
+Per-subject covariates for subject-specific HJC prediction.
+
+Covariates are read from the input landmark dict under the names in
+COVARIATES. Sex and age select each subject's population class through a
+lookup table precomputed per predictor, so a mixed cohort is mapped to
+coefficient rows with a single gather. Numeric covariates missing for a
+subject are NaN.
+'''
+
+import numpy as np
+
+COVARIATES = ('sex', 'age', 'leg_length', 'pelvic_width')
+NUMERIC_COVARIATES = ('age', 'leg_length', 'pelvic_width')
+ADULT_AGE = 18.0
+
+SEX_UNKNOWN, SEX_MALE, SEX_FEMALE = 0, 1, 2
+_SEX_CODES = {
+    'm': SEX_MALE, 'male': SEX_MALE, 'man': SEX_MALE, 'men': SEX_MALE,
+    'f': SEX_FEMALE, 'female': SEX_FEMALE, 'woman': SEX_FEMALE, 'women': SEX_FEMALE,
+}
+AGE_ADULT, AGE_CHILD = 0, 1
+
+# preferred population classes for each (sex, age group), best first
+_CLASS_PREFERENCES = {
+    (SEX_UNKNOWN, AGE_ADULT): ('adults', 'all'),
+    (SEX_MALE, AGE_ADULT): ('men', 'adults', 'all'),
+    (SEX_FEMALE, AGE_ADULT): ('women', 'adults', 'all'),
+    (SEX_UNKNOWN, AGE_CHILD): ('children', 'adults', 'all'),
+    (SEX_MALE, AGE_CHILD): ('boys', 'children', 'men', 'adults', 'all'),
+    (SEX_FEMALE, AGE_CHILD): ('girls', 'children', 'women', 'adults', 'all'),
+}
+
+
+def sexCode(value):
+    if value is None:
+        return SEX_UNKNOWN
+    return _SEX_CODES.get(str(value).strip().lower(), SEX_UNKNOWN)
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def pointNames(landmarks):
+    '''
+    Sorted names of the 3D points in a landmark dict, leaving out the
+    covariates and any other value that is not a 3-vector.
+    '''
+    names = []
+    for name, value in landmarks.items():
+        if name in COVARIATES:
+            continue
+        try:
+            if np.asarray(value, dtype=float).shape == (3,):
+                names.append(name)
+        except (TypeError, ValueError):
+            pass
+    return sorted(names)
+
+
+def gatherCovariates(subjects):
+    '''
+    Collect covariates from a sequence of landmark dicts. Returns a dict of
+    (N,) arrays: integer sex codes and float age, leg_length and
+    pelvic_width.
+    '''
+    covariates = {'sex': np.array([sexCode(s.get('sex')) for s in subjects], dtype=np.int8)}
+    for name in NUMERIC_COVARIATES:
+        covariates[name] = np.array([_number(s.get(name)) for s in subjects], dtype=float)
+    return covariates
+
+
+def classLookupTable(popClasses, defaultClass):
+    '''
+    Precompute the (sex, age group) -> population class index table for a
+    predictor. Subjects of unknown sex and age fall back to defaultClass.
+    '''
+    table = np.empty((3, 2), dtype=np.intp)
+    for (sex, ageGroup), preferences in _CLASS_PREFERENCES.items():
+        if sex == SEX_UNKNOWN and ageGroup == AGE_ADULT:
+            preferences = (defaultClass,) + preferences
+        for c in preferences:
+            if c in popClasses:
+                table[sex, ageGroup] = popClasses.index(c)
+                break
+        else:
+            table[sex, ageGroup] = popClasses.index(defaultClass)
+    return table
+
+
+def classIndices(covariates, popClasses, defaultClass):
+    '''
+    Population class index of each subject, looked up from its sex and age.
+    A covariates dict without sex or age, such as one carrying only the
+    regression inputs of a method, is treated as every subject's being
+    unknown, so subjects of unknown sex get defaultClass and subjects of
+    unknown age are taken as adults.
+    '''
+    table = classLookupTable(popClasses, defaultClass)
+    n = len(next(iter(covariates.values()))) if covariates else 0
+    sex = covariates.get('sex')
+    if sex is None:
+        sex = np.full(n, SEX_UNKNOWN, dtype=np.int8)
+    age = covariates.get('age')
+    if age is None:
+        ageGroup = np.full(len(sex), AGE_ADULT, dtype=np.intp)
+    else:
+        ageGroup = (age < ADULT_AGE).astype(np.intp)
+    return table[sex, ageGroup]
+
+
+def sliceCovariates(covariates, start, stop):
+    if covariates is None:
+        return None
+    return {k: v[start:stop] for k, v in covariates.items()}
@@ -0,0 +1,155 @@
+'''
+Detection of repeated landmark sets within a cohort batch.
+
+Cohorts often hold the same hip landmarks several times: repeated static
+trials, copied sessions or a template subject reused across studies. A
+DuplicateIndex maps every subject to the first with the same canonical
+key: its five configured landmarks and, as they change the prediction,
+its covariates and any error code already set. The batch is predicted
+over those representatives only and the results scattered back to all
+subjects.
+
+Keys are hashed to 64 bits in one vectorised FNV-1a pass over their
+columns and grouped by sorting the hashes. Every subject's key is then
+checked against its representative's, falling back to a dict of the full
+keys in the unlikely event of a collision.
+
+With tolerance 0 keys are the exact coordinates, -0.0 and every NaN
+canonicalised, so deduplication does not change any result. A positive
+tolerance quantises coordinates to multiples of it first, so landmark
+sets differing by less than it mostly share a key, and duplicates take
+the representative's HJCs. Sets either side of a quantisation boundary
+keep separate keys however close they are.
+'''
+
+from collections import OrderedDict
+import time
+
+import numpy as np
+
+_FNV_OFFSET = np.uint64(14695981039346656037)
+_FNV_PRIME = np.uint64(1099511628211)
+
+
+def canonicalKeys(coords, tolerance=0.0, covariates=None, errors=None):
+    '''
+    (N, k) float array of each subject's key, rows equal exactly when the
+    subjects are duplicates.
+    '''
+    coords = np.asarray(coords, dtype=float).reshape(len(coords), -1)
+    if tolerance > 0:
+        coords = np.round(coords / tolerance)
+    columns = [coords]
+    for name in sorted(covariates or {}):
+        columns.append(np.asarray(covariates[name], dtype=float)[:, np.newaxis])
+    if errors is not None:
+        columns.append(np.asarray(errors, dtype=float)[:, np.newaxis])
+    # adding 0.0 turns -0.0 into 0.0, and NaNs of any payload become one
+    keys = np.concatenate(columns, axis=1) + 0.0
+    keys[np.isnan(keys)] = np.nan
+    return keys
+
+
+def _hashKeys(bits):
+    # FNV-1a over the 64 bit words of each row, a column at a time
+    h = np.full(len(bits), _FNV_OFFSET)
+    for column in np.ascontiguousarray(bits.T):
+        h ^= column
+        h *= _FNV_PRIME
+    return h
+
+
+def _groupByDict(bits):
+    # exact grouping of the full keys, in order of first occurrence
+    rows = bits.view(np.dtype((np.void, bits.dtype.itemsize * bits.shape[1]))).ravel()
+    first = {}
+    representatives = []
+    inverse = np.empty(len(bits), dtype=np.intp)
+    for i, row in enumerate(rows.tolist()):
+        j = first.get(row)
+        if j is None:
+            j = first[row] = len(representatives)
+            representatives.append(i)
+        inverse[i] = j
+    return np.array(representatives, dtype=np.intp), inverse
+
+
+class DuplicateIndex(object):
+    '''
+    representatives: (M,) index of the first subject with each distinct key.
+    inverse: (N,) position in representatives of each subject's key.
+    hashSeconds: time taken to build the index.
+    '''
+
+    def __init__(self, representatives, inverse, hashSeconds=0.0):
+        self.representatives = np.asarray(representatives, dtype=np.intp)
+        self.inverse = np.asarray(inverse, dtype=np.intp)
+        self.hashSeconds = hashSeconds
+
+    @classmethod
+    def fromLandmarks(cls, coords, tolerance=0.0, covariates=None, errors=None):
+        '''
+        Index the (N, 5, 3) landmarks of a batch, with its covariates dict
+        of (N,) arrays and (N,) error codes if given.
+        '''
+        start = time.perf_counter()
+        bits = np.ascontiguousarray(canonicalKeys(coords, tolerance, covariates, errors)).view(np.uint64)
+        _, representatives, inverse = np.unique(_hashKeys(bits), return_index=True, return_inverse=True)
+        inverse = inverse.ravel()
+        # number the sets in order of first occurrence
+        order = np.argsort(representatives)
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        representatives = representatives[order]
+        inverse = rank[inverse]
+        if not (bits[representatives[inverse]] == bits).all():
+            representatives, inverse = _groupByDict(bits)
+        return cls(representatives, inverse, time.perf_counter() - start)
+
+    def __len__(self):
+        return len(self.representatives)
+
+    @property
+    def subjects(self):
+        return len(self.inverse)
+
+    @property
+    def ratio(self):
+        '''
+        Subjects per distinct landmark set, 1 if there are no duplicates.
+        '''
+        return float(self.subjects) / len(self) if len(self) else 1.0
+
+    def gather(self, values):
+        '''
+        The representatives' rows of an (N, ...) array, or of each array of
+        a dict such as the covariates. None passes through.
+        '''
+        if values is None:
+            return None
+        if isinstance(values, dict):
+            return dict((k, v[self.representatives]) for k, v in values.items())
+        return values[self.representatives]
+
+    def scatter(self, values):
+        '''
+        Expand an (M, ...) array over the representatives to all N subjects.
+        '''
+        return values[self.inverse]
+
+    def report(self, predictSeconds):
+        '''
+        JSON serialisable summary: subject and distinct set counts, the
+        deduplication ratio and the estimated seconds saved, the
+        prediction time of the duplicates at the measured rate less the
+        time spent hashing.
+        '''
+        report = OrderedDict()
+        report['subjects'] = self.subjects
+        report['unique'] = len(self)
+        report['ratio'] = self.ratio
+        report['hashSeconds'] = self.hashSeconds
+        report['predictSeconds'] = predictSeconds
+        perSubject = predictSeconds / len(self) if len(self) else 0.0
+        report['savedSeconds'] = perSubject * (self.subjects - len(self)) - self.hashSeconds
+        return report
@@ -0,0 +1,434 @@
+'''
+Distributed batch prediction over a shared directory.
+
+A coordinator submits a job to a directory visible to every node: the
+landmark and covariate arrays, a spec.json of the prediction settings and
+one task file per chunk. submitCohort submits subject dicts instead, and
+prepares them with cohortinput.prepareCohort as the step prepares a
+cohort run. Missing landmarks are imputed or reported, and with
+Deduplicate Subjects only the distinct landmark sets are queued, the
+merge expanding their results back to every subject. Workers claim tasks
+by atomically renaming them into claimed/, run batch.predictBatch on the
+chunk and write the results to results/<chunk id>.npz. Results are keyed by chunk ID and written by
+rename, so a chunk processed twice, after a retry, leaves the same file.
+The coordinator merges the results once every chunk has one.
+
+Layout of a job directory:
+
+    spec.json             prediction settings and chunk count
+    input/                coords.npy, errors.npy, cov_<name>.npy, and
+                          cohort.npz for submitCohort jobs
+    tasks/<id>.json       chunks waiting for a worker
+    claimed/<id>.<worker>.json
+                          chunks being processed, by worker host-pid
+    failed/<id>.json      chunks that failed maxAttempts times
+    failed/<id>.txt       traceback of the last failure of a chunk
+    results/<id>.npz      chunk results
+
+runLocal runs a number of worker processes on this machine, standing in
+for a cluster. From the command line:
+
+    python -m mapclientplugins.pelvislandmarkshjcpredictionstep.distributed worker JOBDIR
+    python -m mapclientplugins.pelvislandmarkshjcpredictionstep.distributed local JOBDIR -j 8
+    python -m mapclientplugins.pelvislandmarkshjcpredictionstep.distributed status JOBDIR
+    python -m mapclientplugins.pelvislandmarkshjcpredictionstep.distributed requeue JOBDIR --failed
+    python -m mapclientplugins.pelvislandmarkshjcpredictionstep.distributed merge JOBDIR OUTDIR
+'''
+
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import time
+import traceback
+
+import numpy as np
+
+from mapclientplugins.pelvislandmarkshjcpredictionstep import batch
+from mapclientplugins.pelvislandmarkshjcpredictionstep import covariates as cov
+from mapclientplugins.pelvislandmarkshjcpredictionstep import cohortinput
+from mapclientplugins.pelvislandmarkshjcpredictionstep import configschema
+from mapclientplugins.pelvislandmarkshjcpredictionstep import frames as hjcframes
+from mapclientplugins.pelvislandmarkshjcpredictionstep.batch import HIPLANDMARKS
+from mapclientplugins.pelvislandmarkshjcpredictionstep.landmarkbatch import LandmarkBatch
+
+SPEC_FILE = 'spec.json'
+COHORT_FILE = 'cohort.npz'
+_DIRECTORIES = ('input', 'tasks', 'claimed', 'failed', 'results')
+
+
+def _chunkId(i):
+    return '%08d' % i
+
+
+def _workerId():
+    return '%s-%d' % (socket.gethostname(), os.getpid())
+
+
+def _path(root, directory, name):
+    return os.path.join(root, directory, name)
+
+
+def _writeJSON(path, data):
+    tmpPath = '%s.%s.tmp' % (path, _workerId())
+    with open(tmpPath, 'w') as f:
+        json.dump(data, f, indent=4, sort_keys=True)
+    os.replace(tmpPath, path)
+
+
+def _readJSON(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _move(src, dst):
+    # atomic on a single filesystem, exactly one of several racing workers
+    # succeeds
+    try:
+        os.rename(src, dst)
+        return True
+    except (FileNotFoundError, FileExistsError):
+        return False
+
+
+def submitJob(root, coords, method, popClass, covariates=None, frames=(), chunkSize=batch.DEFAULT_CHUNK_SIZE,
+              errors=None, maxAttempts=3, metadata=None):
+    '''
+    Write a job to directory root.
+
+    coords: (N, 5, 3) hip landmarks ordered as HIPLANDMARKS.
+    method, popClass, covariates: as for batch.predictBatch.
+    frames: extra output frames, HJCs are always predicted in the input
+        frame first.
+    errors: optional (N,) error codes from batch.stackLandmarks, selecting
+        fault tolerant prediction.
+    maxAttempts: number of times a failing chunk is retried before it is
+        left in failed/.
+    metadata: optional JSON serialisable dict added to the merged batch
+        metadata.
+
+    Returns the number of chunks.
+    '''
+    if os.path.exists(os.path.join(root, SPEC_FILE)):
+        raise RuntimeError('HJC prediction job already submitted to ' + root)
+    for d in _DIRECTORIES:
+        if not os.path.isdir(os.path.join(root, d)):
+            os.makedirs(os.path.join(root, d))
+    coords = np.asarray(coords, dtype=float)
+    np.save(_path(root, 'input', 'coords.npy'), coords, allow_pickle=False)
+    if errors is not None:
+        np.save(_path(root, 'input', 'errors.npy'), np.asarray(errors, dtype=np.int8), allow_pickle=False)
+    for name, values in (covariates or {}).items():
+        np.save(_path(root, 'input', 'cov_%s.npy' % name), values, allow_pickle=False)
+
+    starts = range(0, len(coords), chunkSize)
+    for i, start in enumerate(starts):
+        _writeJSON(_path(root, 'tasks', _chunkId(i) + '.json'),
+                   {'id': _chunkId(i), 'start': start, 'stop': min(start + chunkSize, len(coords)), 'attempts': 0})
+    # the spec is written last, workers ignore a directory without one
+    _writeJSON(os.path.join(root, SPEC_FILE),
+               {'method': method,
+                'populationClass': popClass,
+                'covariates': sorted(covariates or {}),
+                'frames': ['input'] + [f for f in frames if f != 'input'],
+                'faultTolerant': errors is not None,
+                'subjects': len(coords),
+                'chunks': len(starts),
+                'maxAttempts': maxAttempts,
+                'metadata': metadata or {},
+                })
+    return len(starts)
+
+
+def submitCohort(root, subjects, config, chunkSize=None, maxAttempts=3):
+    '''
+    Write a job predicting a sequence of subject dicts to directory root.
+
+    config: step configuration, as from serialize(). Its landmark names,
+        method, population class, Output Frames, Fault Tolerant, Subject
+        Covariates, Impute Landmarks and Deduplicate Subjects settings
+        apply as they do in the step, and Chunk Size if chunkSize is None.
+
+    Raises RuntimeError if a subject misses a landmark and the run is not
+    fault tolerant. Returns the number of chunks.
+    '''
+    if os.path.exists(os.path.join(root, SPEC_FILE)):
+        raise RuntimeError('HJC prediction job already submitted to ' + root)
+    settings = configschema.defaultConfig()
+    settings.update(config)
+    cohort = cohortinput.prepareCohort(subjects, settings)
+    metadata = {'subjectCovariates': bool(settings['Subject Covariates']),
+                'landmarks': dict((l, settings[l]) for l in HIPLANDMARKS),
+                'completeness': cohort.completeness,
+                }
+    arrays = {'coords': cohort.coords, 'imputed': cohort.imputed}
+    if cohort.duplicates is not None:
+        arrays['inverse'] = cohort.duplicates.inverse
+        metadata['deduplication'] = {'subjects': cohort.duplicates.subjects, 'unique': len(cohort.duplicates),
+                                     'ratio': cohort.duplicates.ratio}
+    if chunkSize is None:
+        chunkSize = int(settings['Chunk Size'])
+    if not os.path.isdir(os.path.join(root, 'input')):
+        os.makedirs(os.path.join(root, 'input'))
+    # written before the spec, so that a submitted job always has it
+    with open(_path(root, 'input', COHORT_FILE), 'wb') as f:
+        np.savez(f, **arrays)
+    return submitJob(root, cohort.runCoords, settings['Prediction Method'], settings['Population Class'],
+                     cohort.runCovariates, hjcframes.parseFrameNames(settings['Output Frames']), chunkSize,
+                     cohort.runErrors, maxAttempts, metadata)
+
+
+def _loadCohort(root):
+    # the full cohort's arrays of a submitCohort job, None for submitJob
+    path = _path(root, 'input', COHORT_FILE)
+    if not os.path.exists(path):
+        return None
+    with np.load(path, allow_pickle=False) as cohort:
+        return dict(cohort)
+
+
+def _loadInputs(root, spec):
+    coords = np.load(_path(root, 'input', 'coords.npy'), mmap_mode='r')
+    errors = np.load(_path(root, 'input', 'errors.npy'), mmap_mode='r') if spec['faultTolerant'] else None
+    covariates = dict((name, np.load(_path(root, 'input', 'cov_%s.npy' % name), mmap_mode='r'))
+                      for name in spec['covariates']) or None
+    return coords, errors, covariates
+
+
+def _claim(root):
+    for name in sorted(os.listdir(os.path.join(root, 'tasks'))):
+        if not name.endswith('.json'):
+            continue
+        # a worker's own claim name, so a requeued chunk claimed again
+        # elsewhere never shares a claim file
+        claimed = _path(root, 'claimed', '%s.%s.json' % (name[:-len('.json')], _workerId()))
+        if _move(_path(root, 'tasks', name), claimed):
+            # the claim time, for finding claims of workers that died
+            os.utime(claimed, None)
+            return claimed
+    return None
+
+
+def predictChunk(root, task, spec=None, inputs=None):
+    '''
+    Run the headless prediction on one chunk and write its results file.
+    '''
+    if spec is None:
+        spec = _readJSON(os.path.join(root, SPEC_FILE))
+    coords, errors, covariates = _loadInputs(root, spec) if inputs is None else inputs
+    start, stop = task['start'], task['stop']
+    chunkErrors = None if errors is None else np.array(errors[start:stop])
+    hjcs = batch.predictBatch(np.array(coords[start:stop]), spec['method'], spec['populationClass'],
+                              covariates=cov.sliceCovariates(covariates, start, stop),
+                              chunkSize=stop - start, frames=spec['frames'], errors=chunkErrors)
+    arrays = {'hjcs': hjcs}
+    if chunkErrors is not None:
+        arrays['errors'] = chunkErrors
+    resultPath = _path(root, 'results', task['id'] + '.npz')
+    tmpPath = '%s.%s.tmp' % (resultPath, _workerId())
+    with open(tmpPath, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmpPath, resultPath)
+
+
+def runWorker(root, maxChunks=None, wait=0.0, poll=1.0):
+    '''
+    Claim and process chunks until none are left, or maxChunks have been
+    processed. With wait > 0, keep polling for up to wait seconds for a
+    job to be submitted or for requeued chunks. Returns the number of
+    chunks processed.
+    '''
+    specPath = os.path.join(root, SPEC_FILE)
+    deadline = time.time() + wait
+    while not os.path.exists(specPath):
+        if time.time() >= deadline:
+            return 0
+        time.sleep(poll)
+    spec = _readJSON(specPath)
+    inputs = _loadInputs(root, spec)
+    processed = 0
+    while maxChunks is None or processed < maxChunks:
+        claimed = _claim(root)
+        if claimed is None:
+            if time.time() >= deadline:
+                break
+            time.sleep(poll)
+            continue
+        task = _readJSON(claimed)
+        try:
+            predictChunk(root, task, spec, inputs)
+        except Exception:
+            task['attempts'] += 1
+            with open(_path(root, 'failed', task['id'] + '.txt'), 'w') as f:
+                f.write(traceback.format_exc())
+            _writeJSON(claimed, task)
+            retry = task['attempts'] < spec['maxAttempts']
+            _move(claimed, _path(root, 'tasks' if retry else 'failed', task['id'] + '.json'))
+        else:
+            try:
+                os.remove(claimed)
+            except FileNotFoundError:
+                # requeued as stale while it was being processed
+                pass
+        processed += 1
+    return processed
+
+
+def _worker(root, wait):
+    runWorker(root, wait=wait, poll=0.1)
+
+
+def runLocal(root, workers=None, wait=0.0):
+    '''
+    Process a submitted job with worker processes on this machine.
+    '''
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    processes = [multiprocessing.Process(target=_worker, args=(root, wait)) for _ in range(workers)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+
+
+def requeue(root, staleAfter=None, failed=False):
+    '''
+    Return chunks to the task queue: claims older than staleAfter seconds,
+    left by workers that died, and with failed=True the chunks that used
+    up their attempts. Requeuing a chunk that is still being processed is
+    harmless, its results are written under the same chunk ID. Returns the
+    chunk IDs requeued.
+    '''
+    requeued = []
+    now = time.time()
+    sources = []
+    if staleAfter is not None:
+        sources.append('claimed')
+    if failed:
+        sources.append('failed')
+    for directory in sources:
+        for name in sorted(os.listdir(os.path.join(root, directory))):
+            if not name.endswith('.json'):
+                continue
+            path = _path(root, directory, name)
+            if directory == 'claimed' and now - os.path.getmtime(path) < staleAfter:
+                continue
+            if directory == 'failed':
+                task = _readJSON(path)
+                task['attempts'] = 0
+                _writeJSON(path, task)
+            chunkId = name.split('.')[0]
+            if _move(path, _path(root, 'tasks', chunkId + '.json')):
+                requeued.append(chunkId)
+    return requeued
+
+
+def status(root):
+    '''
+    Dict of chunk counts: total, done, queued, claimed and failed.
+    '''
+    spec = _readJSON(os.path.join(root, SPEC_FILE))
+
+    def count(directory, suffix):
+        return sum(1 for n in os.listdir(os.path.join(root, directory)) if n.endswith(suffix))
+
+    return {'total': spec['chunks'],
+            'done': count('results', '.npz'),
+            'queued': count('tasks', '.json'),
+            'claimed': count('claimed', '.json'),
+            'failed': count('failed', '.json'),
+            }
+
+
+def mergeResults(root):
+    '''
+    Assemble the chunk results into (N, F, 2, 3) HJCs, in the spec's
+    frames, and (N,) error codes. The results of a deduplicated cohort are
+    expanded to every subject. Raises RuntimeError naming the chunks
+    without results.
+    '''
+    spec = _readJSON(os.path.join(root, SPEC_FILE))
+    missing = [_chunkId(i) for i in range(spec['chunks'])
+               if not os.path.exists(_path(root, 'results', _chunkId(i) + '.npz'))]
+    if missing:
+        raise RuntimeError('HJC prediction job incomplete, %d of %d chunks missing: %s' % (
+            len(missing), spec['chunks'], ', '.join(missing[:10]) + (' ...' if len(missing) > 10 else '')))
+    hjcs = np.empty((spec['subjects'], len(spec['frames']), 2, 3))
+    errors = np.zeros(spec['subjects'], dtype=np.int8)
+    start = 0
+    for i in range(spec['chunks']):
+        with np.load(_path(root, 'results', _chunkId(i) + '.npz'), allow_pickle=False) as result:
+            stop = start + len(result['hjcs'])
+            hjcs[start:stop] = result['hjcs']
+            if 'errors' in result:
+                errors[start:stop] = result['errors']
+        start = stop
+    cohort = _loadCohort(root)
+    if cohort is not None and 'inverse' in cohort:
+        hjcs, errors = hjcs[cohort['inverse']], errors[cohort['inverse']]
+    return hjcs, errors
+
+
+def mergeBatch(root, subjectIds=None):
+    '''
+    Merged results as a LandmarkBatch.
+    '''
+    spec = _readJSON(os.path.join(root, SPEC_FILE))
+    hjcs, errors = mergeResults(root)
+    metadata = {'method': spec['method'],
+                'populationClass': spec['populationClass'],
+                'frame': 'input',
+                'failed': batch.errorSummary(errors),
+                }
+    metadata.update(spec.get('metadata', {}))
+    cohort = _loadCohort(root)
+    coords = np.load(_path(root, 'input', 'coords.npy')) if cohort is None else cohort['coords']
+    return LandmarkBatch(HIPLANDMARKS, coords, hjcs[:, 0], subjectIds,
+                         metadata, dict((f, hjcs[:, i]) for i, f in enumerate(spec['frames']) if i > 0), errors)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Distributed HJC prediction over a shared directory.')
+    commands = parser.add_subparsers(dest='command')
+    worker = commands.add_parser('worker', help='process chunks of a job')
+    worker.add_argument('root')
+    worker.add_argument('--wait', type=float, default=0.0,
+                        help='seconds to keep polling for work once the queue is empty')
+    worker.add_argument('--max-chunks', type=int, default=None)
+    local = commands.add_parser('local', help='process a job with worker processes on this machine')
+    local.add_argument('root')
+    local.add_argument('-j', '--workers', type=int, default=None)
+    requeueCommand = commands.add_parser('requeue', help='requeue stale claims and failed chunks')
+    requeueCommand.add_argument('root')
+    requeueCommand.add_argument('--stale-after', type=float, default=3600.0)
+    requeueCommand.add_argument('--failed', action='store_true')
+    statusCommand = commands.add_parser('status')
+    statusCommand.add_argument('root')
+    merge = commands.add_parser('merge', help='merge the results into a LandmarkBatch')
+    merge.add_argument('root')
+    merge.add_argument('output')
+    options = parser.parse_args(args)
+
+    if options.command == 'worker':
+        print('processed %d chunks' % runWorker(options.root, options.max_chunks, options.wait))
+    elif options.command == 'local':
+        runLocal(options.root, options.workers)
+    elif options.command == 'requeue':
+        print('requeued %d chunks' % len(requeue(options.root, options.stale_after, options.failed)))
+    elif options.command == 'status':
+        print(', '.join('%s %d' % item for item in status(options.root).items()))
+    elif options.command == 'merge':
+        try:
+            mergeBatch(options.root).save(options.output)
+        except RuntimeError as e:
+            print(e)
+            return 1
+    else:
+        parser.print_help()
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,121 @@
+'''
+Registry of coordinate frames HJCs can be output in.
+
+HJCs are predicted in the ISB pelvis anatomic frame. Each registered frame
+is a function
+
+    frameFunc(L, T, inverseT) -> (N, 4, 4) transforms
+
+giving, per subject, the affine transform from input coordinates to the
+frame, where L maps hip landmark names, and HJC_left and HJC_right, to
+(N, 3) input coordinates and T and inverseT are the (N, 4, 4)
+input-to-pelvis alignment transforms and their inverses. All requested
+frames are composed with inverseT and applied to the HJCs in a single
+batched product.
+
+Built in are the input and pelvis frames, the femoral frames of either
+side (femoral_left, femoral_right) and a lab frame (lab, see labFrame).
+Without knee landmarks the femoral frames are those of the ISB femur in
+the neutral pose: origin at the HJC, axes those of the pelvis.
+'''
+
+from collections import OrderedDict
+
+import numpy as np
+
+_registry = OrderedDict()
+
+
+def registerFrame(name, frameFunc, replace=False):
+    if name in _registry and not replace:
+        raise ValueError('HJC output frame already registered: ' + name)
+    _registry[name] = frameFunc
+
+
+def unregisterFrame(name):
+    del _registry[name]
+
+
+def frameNames():
+    return tuple(_registry.keys())
+
+
+def parseFrameNames(text):
+    '''
+    Frame names from a comma separated configuration string.
+    '''
+    return tuple(f.strip() for f in text.split(',') if f.strip())
+
+
+def frameTransforms(names, L, T, inverseT, hjcs=None):
+    '''
+    (N, F, 4, 4) transforms from the pelvis anatomic frame to each of the
+    named frames.
+
+    hjcs: optional (N, 2, 3) [left, right] HJCs in the pelvis frame, given
+        to the frame functions in L in input coordinates.
+    '''
+    if hjcs is not None:
+        L = dict(L)
+        L['HJC_left'], L['HJC_right'] = np.moveaxis(transformToFrames(hjcs, inverseT[:, np.newaxis])[:, 0], 1, 0)
+    try:
+        toFrames = np.stack([_registry[name](L, T, inverseT) for name in names], axis=1)
+    except KeyError as e:
+        raise RuntimeError('HJC prediction failed, unknown output frame: ' + e.args[0])
+    return np.matmul(toFrames, inverseT[:, np.newaxis])
+
+
+def transformToFrames(points, M):
+    '''
+    Apply (N, F, 4, 4) frame transforms to (N, k, 3) points, giving
+    (N, F, k, 3).
+    '''
+    return np.einsum('nfij,nkj->nfki', M[:, :, :3, :3], points) + M[:, :, np.newaxis, :3, 3]
+
+
+def _inputFrame(L, T, inverseT):
+    return np.broadcast_to(np.eye(4), T.shape)
+
+
+def _pelvisFrame(L, T, inverseT):
+    return T
+
+
+def _femoralFrame(side):
+    def frameFunc(L, T, inverseT):
+        M = T.copy()
+        M[:, :3, 3] = -np.einsum('nij,nj->ni', T[:, :3, :3], L['HJC_' + side])
+        return M
+    return frameFunc
+
+
+def labFrame(up=(0.0, 0.0, 1.0)):
+    '''
+    Frame function of a lab frame with the ISB global axes, x anterior, y
+    up and z to the right, turned to the subject's heading: origin at the
+    input origin, y along up, the input's vertical, and x the pelvis
+    anterior axis projected onto the horizontal. The built-in lab frame
+    takes the input z axis as vertical. For a y-up lab, replace it with
+
+        registerFrame('lab', labFrame(up=(0, 1, 0)), replace=True)
+    '''
+    up = np.asarray(up, dtype=float)
+    up = up / np.linalg.norm(up)
+
+    def frameFunc(L, T, inverseT):
+        anterior = T[:, 0, :3]
+        x = anterior - np.outer(anterior.dot(up), up)
+        x /= np.linalg.norm(x, axis=1)[:, np.newaxis]
+        y = np.broadcast_to(up, x.shape)
+        M = np.zeros(T.shape)
+        M[:, :3, :3] = np.stack([x, y, np.cross(x, y)], axis=1)
+        M[:, 3, 3] = 1.0
+        return M
+    return frameFunc
+
+
+registerFrame('input', _inputFrame)
+registerFrame('pelvis', _pelvisFrame)
+registerFrame('femoral_left', _femoralFrame('left'))
+registerFrame('femoral_right', _femoralFrame('right'))
+registerFrame('lab', labFrame())
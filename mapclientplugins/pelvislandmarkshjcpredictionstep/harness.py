@@ -0,0 +1,198 @@
+'''
+Deterministic accuracy and timing harness for the HJC prediction paths.
+
+Generates synthetic pelvises, runs every method and population class
+through the gias3 reference pipeline (alignAnatomicPelvis, the gias3
+predictor, inverse transform, one subject at a time) and through each
+registered accelerated mode, and reports the maximum and mean HJC
+deviation from the reference along with timings. The float32-input mode
+rounds the landmarks to single precision and predicts them in double
+precision, so its deviations are those of float32 inputs.
+
+Run as
+
+    python -m mapclientplugins.pelvislandmarkshjcpredictionstep.harness -n 2000 --seed 0
+'''
+
+import argparse
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from gias3.musculoskeletal import model_alignment as ma
+
+from mapclientplugins.pelvislandmarkshjcpredictionstep import predictors
+from mapclientplugins.pelvislandmarkshjcpredictionstep import batch
+from mapclientplugins.pelvislandmarkshjcpredictionstep import kernels
+from mapclientplugins.pelvislandmarkshjcpredictionstep.batch import HIPLANDMARKS
+
+# approximate adult pelvis in the ISB pelvis frame (mm): LASIS, RASIS, LPSIS, RPSIS, PS
+_TEMPLATE = np.array([[0.0, 0.0, -115.0],
+                      [0.0, 0.0, 115.0],
+                      [-150.0, 25.0, -40.0],
+                      [-150.0, 25.0, 40.0],
+                      [-15.0, -85.0, 0.0]])
+
+_modes = OrderedDict()
+
+
+def registerMode(name, func):
+    '''
+    Register an accelerated prediction mode to compare against the
+    reference. func(coords, method, popClass) returns (N, 2, 3) HJCs in
+    the input frame.
+    '''
+    _modes[name] = func
+
+
+def modeNames():
+    return tuple(_modes.keys())
+
+
+def _randomRotations(rng, n, maxAngle):
+    axes = rng.normal(size=(n, 3))
+    axes /= np.sqrt((axes ** 2).sum(1))[:, np.newaxis]
+    angles = rng.uniform(-maxAngle, maxAngle, n)
+    K = np.zeros((n, 3, 3))
+    K[:, 0, 1], K[:, 0, 2], K[:, 1, 2] = -axes[:, 2], axes[:, 1], -axes[:, 0]
+    K -= K.transpose(0, 2, 1)
+    s, c = np.sin(angles)[:, np.newaxis, np.newaxis], np.cos(angles)[:, np.newaxis, np.newaxis]
+    return np.eye(3) + s * K + (1 - c) * np.matmul(K, K)
+
+
+def syntheticPelvises(n, seed=0, plausible=True):
+    '''
+    (n, 5, 3) hip landmarks ordered as HIPLANDMARKS.
+
+    Plausible pelvises scale and perturb an adult template by a few
+    millimetres and place it in a lab frame with a moderate rotation.
+    Otherwise landmarks get large independent perturbations and arbitrary
+    orientations, exercising poorly conditioned alignments.
+    '''
+    rng = np.random.RandomState(seed)
+    if plausible:
+        scale = rng.normal(1.0, 0.08, n)[:, np.newaxis, np.newaxis]
+        coords = _TEMPLATE * scale + rng.normal(0.0, 4.0, (n, 5, 3))
+        R = _randomRotations(rng, n, np.pi / 6)
+        t = rng.uniform(-1000.0, 1000.0, (n, 1, 3))
+    else:
+        coords = _TEMPLATE + rng.normal(0.0, 30.0, (n, 5, 3))
+        R = _randomRotations(rng, n, np.pi)
+        t = rng.uniform(-5000.0, 5000.0, (n, 1, 3))
+    return np.einsum('nij,nkj->nki', R, coords) + t
+
+
+def referencePredict(coords, method, popClass):
+    '''
+    HJCs predicted one subject at a time through gias3, as the step did
+    before the batched path.
+    '''
+    predictor = predictors.getPredictor(method)
+    hjcs = np.empty((len(coords), 2, 3))
+    for i, c in enumerate(coords):
+        aligned, T = ma.alignAnatomicPelvis(c, c[0], c[1], c[2], c[3], return_t=True)
+        if T.shape == (3, 4):
+            T = np.vstack([T, [0, 0, 0, 1]])
+        L = dict(zip(HIPLANDMARKS, aligned))
+        predictions = np.array(predictor.referenceFunc(*[L[l] for l in predictor.landmarks] + [popClass])[:2])
+        hjcs[i] = ma.transform3D.transformAffine(predictions, np.linalg.inv(T))
+    return hjcs
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def runHarness(n=1000, seed=0, plausible=True, methods=None, modes=None):
+    '''
+    Compare each accelerated mode to the reference for every method with a
+    reference implementation and every population class it supports.
+    Returns a list of result dicts.
+    '''
+    coords = syntheticPelvises(n, seed, plausible)
+    if methods is None:
+        methods = predictors.predictorNames()
+    if modes is None:
+        modes = modeNames()
+    results = []
+    for method in methods:
+        predictor = predictors.getPredictor(method)
+        if predictor.referenceFunc is None:
+            continue
+        for popClass in predictor.popClasses:
+            reference, referenceTime = _timed(referencePredict, coords, method, popClass)
+            for mode in modes:
+                # keep one-off costs such as JIT compilation out of the timing
+                _modes[mode](coords[:2], method, popClass)
+                hjcs, modeTime = _timed(_modes[mode], coords, method, popClass)
+                deviation = np.sqrt(((hjcs - reference) ** 2).sum(-1))
+                results.append({'method': method,
+                                'popClass': popClass,
+                                'mode': mode,
+                                'subjects': n,
+                                'maxDeviation': float(np.max(deviation)),
+                                'meanDeviation': float(np.mean(deviation)),
+                                'referenceTime': referenceTime,
+                                'modeTime': modeTime,
+                                })
+    return results
+
+
+def formatReport(results):
+    header = '%-10s %-8s %-14s %12s %12s %10s %10s %9s' % ('method', 'class', 'mode', 'max dev', 'mean dev',
+                                                           'ref (s)', 'mode (s)', 'speedup')
+    lines = [header, '-' * len(header)]
+    for r in results:
+        lines.append('%-10s %-8s %-14s %12.3e %12.3e %10.4f %10.4f %8.1fx' % (
+            r['method'], r['popClass'], r['mode'], r['maxDeviation'], r['meanDeviation'],
+            r['referenceTime'], r['modeTime'], r['referenceTime'] / max(r['modeTime'], 1e-12)))
+    return '\n'.join(lines)
+
+
+def _batchMode(coords, method, popClass):
+    return batch.predictBatch(coords, method, popClass)
+
+
+def _threadedMode(coords, method, popClass):
+    return batch.predictBatch(coords, method, popClass, chunkSize=max(1, len(coords) // 8), workers=4)
+
+
+def _float32InputMode(coords, method, popClass):
+    # landmarks rounded to float32, as from a float32 source, then predicted
+    # in float64: measures the effect of single precision inputs, not of a
+    # single precision pipeline
+    return batch.predictBatch(coords.astype(np.float32), method, popClass)
+
+
+registerMode('batch', _batchMode)
+registerMode('threaded', _threadedMode)
+registerMode('float32-input', _float32InputMode)
+if kernels.NUMBA_AVAILABLE:
+    def _fusedMode(coords, method, popClass):
+        return batch.predictBatch(coords, method, popClass, fused=True)
+
+    registerMode('fused', _fusedMode)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Compare accelerated HJC prediction against gias3.')
+    parser.add_argument('-n', '--subjects', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--random', action='store_true', help='unconstrained rather than plausible pelvises')
+    parser.add_argument('--methods', nargs='*')
+    parser.add_argument('--modes', nargs='*')
+    parser.add_argument('--tolerance', type=float, default=None,
+                        help='exit with status 1 if any max deviation exceeds this (mm)')
+    options = parser.parse_args(args)
+    results = runHarness(options.subjects, options.seed, not options.random, options.methods, options.modes)
+    print(formatReport(results))
+    if options.tolerance is not None and any(r['maxDeviation'] > options.tolerance for r in results):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
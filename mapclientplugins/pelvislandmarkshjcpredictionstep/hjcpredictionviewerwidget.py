@@ -17,38 +17,44 @@ This file is part of MAP Client. (http://launchpad.net/mapclient)
     You should have received a copy of the GNU General Public License
     along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
 '''
+import logging
 import os
 
 os.environ['ETS_TOOLKIT'] = 'qt5'
 
-from PySide6.QtWidgets import QDialog, QAbstractItemView, QTableWidgetItem
-from PySide6.QtGui import QIntValidator
+from PySide6.QtWidgets import QAbstractItemView, QTableWidgetItem
 from PySide6.QtCore import Qt
 
 from mapclientplugins.pelvislandmarkshjcpredictionstep.ui_hjcpredictionviewerwidget import Ui_Dialog
 from traits.api import HasTraits, Instance, on_trait_change, \
     Int, Dict
 
+from mapclientplugins.pelvislandmarkshjcpredictionstep import lod
+from mapclientplugins.pelvislandmarkshjcpredictionstep import covariates
+from mapclientplugins.pelvislandmarkshjcpredictionstep.viewercontrols import HJCViewerControls
 from gias3.mapclientpluginutilities.viewers import MayaviViewerObjectsContainer, MayaviViewerLandmark, colours
 
 import numpy as np
 
+logger = logging.getLogger(__name__)
 
-class MayaviHJCPredictionViewerWidget(QDialog):
+
+class MayaviHJCPredictionViewerWidget(HJCViewerControls):
     '''
     Configure dialog to present the user with the options to configure this step.
     '''
     defaultColor = colours['bone']
-    objectTableHeaderColumns = {'landmarks': 0}
     backgroundColour = (0.0, 0.0, 0.0)
     _landmarkRenderArgs = {'mode': 'sphere', 'scale_factor': 5.0, 'color': (0, 1, 0)}
     _hjcRenderArgs = {'mode': 'sphere', 'scale_factor': 10.0, 'color': (1, 0, 0)}
+    levelOfDetail = lod.LevelOfDetail()
+    plainPointSize = 3.0
 
-    def __init__(self, landmarks, config, predictFunc, predMethods, popClasses, parent=None):
+    def __init__(self, landmarks, config, predictFunc, predMethods, parent=None):
         '''
         Constructor
         '''
-        QDialog.__init__(self, parent)
+        HJCViewerControls.__init__(self, parent)
         self._ui = Ui_Dialog()
         self._ui.setupUi(self)
 
@@ -57,11 +63,14 @@ class MayaviHJCPredictionViewerWidget(QDialog):
 
         self.selectedObjectName = None
         self._landmarks = landmarks
-        self._landmarkNames = sorted(self._landmarks.keys())
+        # the subject dict may carry covariates too
+        self._landmarkNames = covariates.pointNames(self._landmarks)
         self._predictFunc = predictFunc
         self._predMethods = predMethods
-        self._popClasses = popClasses
         self._config = config
+        self._clouds = {}
+        self._lodLevels = {}
+        self._observers = []
 
         # print 'init...', self._config
 
@@ -73,85 +82,147 @@ class MayaviHJCPredictionViewerWidget(QDialog):
         self._initialiseObjectTable()
         self._initialiseSettings()
         self._refresh()
+        self._observers = lod.observeInteraction(self._scene, self._updateLevelOfDetail)
+        if not self._observers:
+            self._scene.on_trait_change(self._sceneActivated, 'activated')
 
         # self.testPlot()
         # self.drawObjects()
-        print('finished init...', self._config)
+        logger.debug('viewer initialised with %s', self._config)
 
     def _initViewerObjects(self):
         self._objects = MayaviViewerObjectsContainer()
         for ln in self._landmarkNames:
-            self._objects.addObject(ln, MayaviViewerLandmark(ln, self._landmarks[ln],
-                                                             render_args=self._landmarkRenderArgs)
-                                    )
-
-        hjcl = self._objects.getObject('HJC_left')
-        hjcl.setRenderArgs(self._hjcRenderArgs)
-        hjcr = self._objects.getObject('HJC_right')
-        hjcr.setRenderArgs(self._hjcRenderArgs)
-        # self._objects.addObject('HJC_left', MayaviViewerLandmark('HJC_left', [0,0,0], render_args=self._hjcRenderArgs))
-        # self._objects.addObject('HJC_right', MayaviViewerLandmark('HJC_right', [0,0,0], render_args=self._hjcRenderArgs))
-
-    def _setupGui(self):
-        self._ui.screenshotPixelXLineEdit.setValidator(QIntValidator())
-        self._ui.screenshotPixelYLineEdit.setValidator(QIntValidator())
-        for l in self._landmarkNames:
-            self._ui.comboBoxLASIS.addItem(l)
-            self._ui.comboBoxRASIS.addItem(l)
-            self._ui.comboBoxLPSIS.addItem(l)
-            self._ui.comboBoxRPSIS.addItem(l)
-            self._ui.comboBoxPS.addItem(l)
-
-        for m in self._predMethods:
-            self._ui.comboBoxPredMethod.addItem(m)
-
-        for p in self._popClasses:
-            self._ui.comboBoxPopClass.addItem(p)
-
-    def _makeConnections(self):
-        self._ui.tableWidget.itemClicked.connect(self._tableItemClicked)
-        self._ui.tableWidget.itemChanged.connect(self._visibleBoxChanged)
-        self._ui.screenshotSaveButton.clicked.connect(self._saveScreenShot)
-        self._ui.predictButton.clicked.connect(self._predict)
-        self._ui.resetButton.clicked.connect(self._reset)
-        self._ui.abortButton.clicked.connect(self._abort)
-        self._ui.acceptButton.clicked.connect(self._accept)
-
-        self._ui.comboBoxPredMethod.activated.connect(self._updateConfigPredMethod)
-        self._ui.comboBoxPopClass.activated.connect(self._updateConfigPopClass)
-        self._ui.comboBoxLASIS.activated.connect(self._updateConfigLASIS)
-        self._ui.comboBoxRASIS.activated.connect(self._updateConfigRASIS)
-        self._ui.comboBoxLPSIS.activated.connect(self._updateConfigLPSIS)
-        self._ui.comboBoxRPSIS.activated.connect(self._updateConfigRPSIS)
-        self._ui.comboBoxPS.activated.connect(self._updateConfigPS)
-
-    def _initialiseSettings(self):
-        self._ui.comboBoxPredMethod.setCurrentIndex(self._predMethods.index(self._config['Prediction Method']))
-        self._ui.comboBoxPopClass.setCurrentIndex(self._popClasses.index(self._config['Population Class']))
-        if self._config['LASIS'] in self._landmarkNames:
-            self._ui.comboBoxLASIS.setCurrentIndex(self._landmarkNames.index(self._config['LASIS']))
-        else:
-            self._ui.comboBoxLASIS.setCurrentIndex(0)
-
-        if self._config['RASIS'] in self._landmarkNames:
-            self._ui.comboBoxRASIS.setCurrentIndex(self._landmarkNames.index(self._config['RASIS']))
-        else:
-            self._ui.comboBoxRASIS.setCurrentIndex(0)
-
-        if self._config['LPSIS'] in self._landmarkNames:
-            self._ui.comboBoxLPSIS.setCurrentIndex(self._landmarkNames.index(self._config['LPSIS']))
+            self._addViewerObject(ln)
+
+    def _addViewerObject(self, name):
+        obj = MayaviViewerLandmark(name, self._landmarks[name], render_args=self._landmarkRenderArgs)
+        if name in ('HJC_left', 'HJC_right'):
+            obj.setRenderArgs(self._hjcRenderArgs)
+        self._objects.addObject(name, obj)
+
+    def _removeViewerObject(self, name):
+        # remove the glyph pipeline from the scene, not just the container entry
+        obj = self._objects.getObject(name)
+        if obj.sceneObject is not None:
+            obj.sceneObject.remove()
+            obj.sceneObject = None
+        self._objects.removeObject(name)
+
+    def reload(self, landmarks, config):
+        '''
+        Show a new landmark set in the existing scene. Only landmarks that
+        were added, removed or moved are redrawn, and the table and landmark
+        comboboxes are rebuilt only if the set of landmark names changed.
+        '''
+        self._landmarks = landmarks
+        self._config = config
+        oldNames = set(self._landmarkNames)
+        landmarkNames = covariates.pointNames(self._landmarks)
+        namesChanged = landmarkNames != self._landmarkNames
+        self._landmarkNames = landmarkNames
+
+        self._scene.disable_render = True
+        try:
+            for name in oldNames.difference(self._landmarkNames):
+                self._removeViewerObject(name)
+            for name in self._landmarkNames:
+                if name not in oldNames:
+                    self._addViewerObject(name)
+                else:
+                    obj = self._objects.getObject(name)
+                    if not np.array_equal(obj.coords, self._landmarks[name]):
+                        self._moveObject(obj, self._landmarks[name])
+        finally:
+            self._scene.disable_render = False
+
+        if namesChanged:
+            self._ui.tableWidget.blockSignals(True)
+            self._ui.tableWidget.clearContents()
+            self._initialiseObjectTable()
+            self._ui.tableWidget.blockSignals(False)
+            self._populateLandmarkComboBoxes()
         else:
-            self._ui.comboBoxLPSIS.setCurrentIndex(0)
+            for name in ('HJC_left', 'HJC_right'):
+                self._ui.tableWidget.item(self._landmarkNames.index(name),
+                                          self.objectTableHeaderColumns['landmarks']).setCheckState(Qt.Unchecked)
 
-        if self._config['RPSIS'] in self._landmarkNames:
-            self._ui.comboBoxRPSIS.setCurrentIndex(self._landmarkNames.index(self._config['RPSIS']))
-        else:
-            self._ui.comboBoxRPSIS.setCurrentIndex(0)
+        self._initialiseSettings()
+        self._refresh()
 
-        if self._config['PS'] in self._landmarkNames:
-            self._ui.comboBoxPS.setCurrentIndex(self._landmarkNames.index(self._config['PS']))
+    def _moveObject(self, obj, coords):
+        # move the existing glyph instead of rebuilding its pipeline
+        point = None
+        if obj.sceneObject is not None:
+            point = obj.sceneObject.sceneObject.get('landmark point ' + obj.name)
+        if point is None:
+            obj.updateGeometry(coords, self._scene)
         else:
-            self._ui.comboBoxPS.setCurrentIndex(0)
+            obj.coords = coords
+            point.mlab_source.set(x=[coords[0]], y=[coords[1]], z=[coords[2]])
+
+    def _sceneActivated(self):
+        self._scene.on_trait_change(self._sceneActivated, 'activated', remove=True)
+        self._observers = lod.observeInteraction(self._scene, self._updateLevelOfDetail)
+        self._updateLevelOfDetail()
+
+    def _glyphSets(self):
+        # (key, glyph, points, glyph size, plain) of everything drawn, keyed
+        # by glyph so that redrawn glyphs get their level applied again
+        glyphSets = []
+        for name in self._landmarkNames:
+            obj = self._objects.getObject(name)
+            if obj.sceneObject is None:
+                continue
+            glyph = obj.sceneObject.sceneObject.get('landmark point ' + name)
+            if glyph is None:
+                continue
+            renderArgs = self._hjcRenderArgs if name in ('HJC_left', 'HJC_right') else self._landmarkRenderArgs
+            glyphSets.append((id(glyph), glyph, np.reshape(obj.coords, (1, 3)), renderArgs['scale_factor'], False))
+        plain = bool(self._config.get('Plain Cohort Points'))
+        for glyph, points, glyphSize in self._clouds.values():
+            glyphSets.append((id(glyph), glyph, points, glyphSize, plain))
+        return glyphSets
+
+    def _updateLevelOfDetail(self):
+        '''
+        Set glyph resolutions for the current camera distance and point
+        count, switching to plain points where glyphs would be too small or
+        too many to draw interactively.
+        '''
+        if self._scene is None or self._scene.interactor is None:
+            return
+        render = not self._scene.disable_render
+        self._scene.disable_render = True
+        try:
+            lod.updateGlyphs(self._scene, self._glyphSets(), self._lodLevels, self.levelOfDetail,
+                             self.plainPointSize)
+        finally:
+            if render:
+                self._scene.disable_render = False
+
+    def showPointCloud(self, name, points, renderArgs=None):
+        '''
+        Overlay (n, 3) points, such as the HJCs of a cohort, as a single
+        glyph set under the level of detail policy. With the Plain Cohort
+        Points option they are always drawn as plain points.
+        '''
+        self.removePointCloud(name)
+        points = np.asarray(points, dtype=float).reshape(-1, 3)
+        points = points[np.isfinite(points).all(axis=1)]
+        args = dict(self._hjcRenderArgs if renderArgs is None else renderArgs)
+        args['name'] = name
+        self._scene.disable_render = True
+        try:
+            glyph = self._scene.mlab.points3d(points[:, 0], points[:, 1], points[:, 2], **args)
+            self._clouds[name] = (glyph, points, args['scale_factor'])
+            self._updateLevelOfDetail()
+        finally:
+            self._scene.disable_render = False
+
+    def removePointCloud(self, name):
+        if name in self._clouds:
+            self._clouds.pop(name)[0].remove()
 
     def _initialiseObjectTable(self):
         self._ui.tableWidget.setRowCount(self._objects.getNumberOfObjects())
@@ -160,9 +231,10 @@ class MayaviHJCPredictionViewerWidget(QDialog):
         self._ui.tableWidget.setSelectionBehavior(QAbstractItemView.SelectRows)
         self._ui.tableWidget.setSelectionMode(QAbstractItemView.SingleSelection)
 
+        debug = logger.isEnabledFor(logging.DEBUG)
         r = 0
         for ln in self._landmarkNames:
-            self._addObjectToTable(r, ln, self._objects.getObject(ln))
+            self._addObjectToTable(r, ln, self._objects.getObject(ln), debug=debug)
             r += 1
 
         hjclTableItem = self._ui.tableWidget.item(self._landmarkNames.index('HJC_left'),
@@ -174,9 +246,9 @@ class MayaviHJCPredictionViewerWidget(QDialog):
 
         self._ui.tableWidget.resizeColumnToContents(self.objectTableHeaderColumns['landmarks'])
 
-    def _addObjectToTable(self, row, name, obj, checked=True):
-        typeName = obj.typeName
-        print('adding to table: %s (%s)' % (name, typeName))
+    def _addObjectToTable(self, row, name, obj, checked=True, debug=True):
+        if debug:
+            logger.debug('adding to table: %s (%s)', name, obj.typeName)
         tableItem = QTableWidgetItem(name)
         if checked:
             tableItem.setCheckState(Qt.Checked)
@@ -186,15 +258,6 @@ class MayaviHJCPredictionViewerWidget(QDialog):
         self._ui.tableWidget.setItem(row, self.objectTableHeaderColumns['landmarks'], tableItem)
         # self._ui.tableWidget.setItem(row, self.objectTableHeaderColumns['type'], QTableWidgetItem(typeName))
 
-    def _tableItemClicked(self):
-        selectedRow = self._ui.tableWidget.currentRow()
-        self.selectedObjectName = self._ui.tableWidget.item(
-            selectedRow,
-            self.objectTableHeaderColumns['landmarks']
-        ).text()
-        print(selectedRow)
-        print(self.selectedObjectName)
-
     def _visibleBoxChanged(self, tableItem):
         # get name of object selected
         # name = self._getSelectedObjectName()
@@ -205,50 +268,19 @@ class MayaviHJCPredictionViewerWidget(QDialog):
             name = tableItem.text()
             visible = tableItem.checkState().name == 'Checked'
 
-            print('visibleboxchanged name', name)
-            print('visibleboxchanged visible', visible)
-
             # toggle visibility
             obj = self._objects.getObject(name)
-            print(obj.name)
             if obj.sceneObject:
-                print('changing existing visibility')
+                logger.debug('%s: setting visibility %s', name, visible)
                 obj.setVisibility(visible)
             else:
-                print('drawing new')
+                logger.debug('%s: drawing new', name)
                 obj.draw(self._scene)
 
-    def _getSelectedObjectName(self):
-        return self.selectedObjectName
-
-    def _getSelectedScalarName(self):
-        return 'none'
-
     def drawObjects(self):
         for name in self._objects.getObjectNames():
             self._objects.getObject(name).draw(self._scene)
 
-    def _updateConfigPredMethod(self):
-        self._config['Prediction Method'] = self._ui.comboBoxPredMethod.currentText()
-
-    def _updateConfigPopClass(self):
-        self._config['Population Class'] = self._ui.comboBoxPopClass.currentText()
-
-    def _updateConfigLASIS(self):
-        self._config['LASIS'] = self._ui.comboBoxLASIS.currentText()
-
-    def _updateConfigRASIS(self):
-        self._config['RASIS'] = self._ui.comboBoxRASIS.currentText()
-
-    def _updateConfigLPSIS(self):
-        self._config['LPSIS'] = self._ui.comboBoxLPSIS.currentText()
-
-    def _updateConfigRPSIS(self):
-        self._config['RPSIS'] = self._ui.comboBoxRPSIS.currentText()
-
-    def _updateConfigPS(self):
-        self._config['PS'] = self._ui.comboBoxPS.currentText()
-
     def _predict(self):
         self._predictFunc()
 
@@ -264,6 +296,7 @@ class MayaviHJCPredictionViewerWidget(QDialog):
         hjcrTableItem = self._ui.tableWidget.item(self._landmarkNames.index('HJC_right'),
                                                   self.objectTableHeaderColumns['landmarks'])
         hjcrTableItem.setCheckState(Qt.Checked)
+        self._updateLevelOfDetail()
 
     def _reset(self):
         # delete viewer table row
@@ -291,33 +324,54 @@ class MayaviHJCPredictionViewerWidget(QDialog):
         self._close()
 
     def _close(self):
-        for name in self._objects.getObjectNames():
-            self._objects.getObject(name).remove()
+        # landmark glyphs are kept so that reload() only redraws what
+        # changes, overlays belong to the subject just reviewed
+        for name in list(self._clouds):
+            self.removePointCloud(name)
 
-        self._objects._objects = {}
-        self._objects == None
-
-        # for r in xrange(self._ui.tableWidget.rowCount()):
-        #     self._ui.tableWidget.removeRow(r)
+    def release(self):
+        '''
+        Tear the viewer down: remove every glyph pipeline and interaction
+        observer, close the VTK render window and schedule the dialog for
+        deletion. The viewer cannot be used afterwards.
+        '''
+        if self._scene is None:
+            return
+        self._scene.disable_render = True
+        self._close()
+        for name in list(self._objects.getObjectNames()):
+            self._removeViewerObject(name)
+        self._lodLevels.clear()
+        lod.removeObservers(self._scene, self._observers)
+        self._scene.on_trait_change(self._sceneActivated, 'activated', remove=True)
+        self._scene.close()
+        self._scene = None
+        self._objects = None
+        self._landmarks = None
+        self._predictFunc = None
+        self._ui.tableWidget.clearContents()
+        self.close()
+        self.deleteLater()
 
     def _refresh(self):
+        debug = logger.isEnabledFor(logging.DEBUG)
         for r in range(self._ui.tableWidget.rowCount()):
             tableItem = self._ui.tableWidget.item(r, self.objectTableHeaderColumns['landmarks'])
             name = tableItem.text()
             visible = tableItem.checkState().name == 'Checked'
             obj = self._objects.getObject(name)
-            print(obj.name)
             if obj.sceneObject:
-                print('changing existing visibility')
+                if debug:
+                    logger.debug('%s: setting visibility %s', name, visible)
                 obj.setVisibility(visible)
             else:
-                print('drawing new')
+                if debug:
+                    logger.debug('%s: drawing new', name)
                 obj.draw(self._scene)
+        self._updateLevelOfDetail()
 
     def _saveScreenShot(self):
-        filename = self._ui.screenshotFilenameLineEdit.text()
-        width = int(self._ui.screenshotPixelXLineEdit.text())
-        height = int(self._ui.screenshotPixelYLineEdit.text())
+        filename, width, height = self._screenshotSettings()
         self._scene.mlab.savefig(filename, size=(width, height))
 
     # ================================================================#
@@ -326,7 +380,7 @@ class MayaviHJCPredictionViewerWidget(QDialog):
         # This function is called when the view is opened. We don't
         # populate the scene when the view is not yet open, as some
         # VTK features require a GLContext.
-        print('trait_changed')
+        logger.debug('trait_changed')
 
         # We can do normal mlab calls on the embedded scene.
         self._scene.mlab.test_points3d()
@@ -0,0 +1,189 @@
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+import logging
+
+from PySide6.QtWidgets import QAbstractItemView, QTableWidgetItem
+from PySide6.QtCore import Qt
+
+from mapclientplugins.pelvislandmarkshjcpredictionstep.ui_hjcpreviewwidget import Ui_Dialog
+from mapclientplugins.pelvislandmarkshjcpredictionstep import covariates
+from mapclientplugins.pelvislandmarkshjcpredictionstep.viewercontrols import HJCViewerControls
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+HJCNAMES = ('HJC_left', 'HJC_right')
+
+
+class HJCPreviewWidget(HJCViewerControls):
+    '''
+    Single subject viewer drawing the landmarks and HJCs as orthographic 2D
+    projections with Qt painting, in place of the Mayavi scene. It has the
+    Mayavi viewer's controls and interface, so the step uses either.
+    '''
+    _landmarkRenderArgs = {'scale_factor': 5.0, 'color': (0, 1, 0)}
+    _hjcRenderArgs = {'scale_factor': 10.0, 'color': (1, 0, 0)}
+
+    def __init__(self, landmarks, config, predictFunc, predMethods, parent=None):
+        HJCViewerControls.__init__(self, parent)
+        self._ui = Ui_Dialog()
+        self._ui.setupUi(self)
+        self._view = self._ui.orthographicView
+
+        self.selectedObjectName = None
+        self._landmarks = landmarks
+        # the subject dict may carry covariates too
+        self._landmarkNames = covariates.pointNames(self._landmarks)
+        self._predictFunc = predictFunc
+        self._predMethods = predMethods
+        self._config = config
+        self._clouds = set()
+
+        self._setupGui()
+        self._makeConnections()
+        self._initialiseObjectTable()
+        self._initialiseSettings()
+        self._refresh()
+        logger.debug('preview initialised with %s', self._config)
+
+    def reload(self, landmarks, config):
+        '''
+        Show a new landmark set, rebuilding the table and landmark
+        comboboxes only if the set of landmark names changed.
+        '''
+        self._landmarks = landmarks
+        self._config = config
+        landmarkNames = covariates.pointNames(self._landmarks)
+        namesChanged = landmarkNames != self._landmarkNames
+        self._landmarkNames = landmarkNames
+
+        self._ui.tableWidget.blockSignals(True)
+        if namesChanged:
+            self._ui.tableWidget.clearContents()
+            self._initialiseObjectTable()
+            self._populateLandmarkComboBoxes()
+        else:
+            for name in HJCNAMES:
+                self._tableItem(name).setCheckState(Qt.Unchecked)
+        self._ui.tableWidget.blockSignals(False)
+
+        self._initialiseSettings()
+        self._refresh()
+
+    def _renderArgs(self, name):
+        return self._hjcRenderArgs if name in HJCNAMES else self._landmarkRenderArgs
+
+    def _tableItem(self, name):
+        return self._ui.tableWidget.item(self._landmarkNames.index(name), self.objectTableHeaderColumns['landmarks'])
+
+    def _initialiseObjectTable(self):
+        self._ui.tableWidget.setRowCount(len(self._landmarkNames))
+        self._ui.tableWidget.verticalHeader().setVisible(False)
+        self._ui.tableWidget.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self._ui.tableWidget.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self._ui.tableWidget.setSelectionMode(QAbstractItemView.SingleSelection)
+
+        for r, ln in enumerate(self._landmarkNames):
+            tableItem = QTableWidgetItem(ln)
+            tableItem.setCheckState(Qt.Unchecked if ln in HJCNAMES else Qt.Checked)
+            self._ui.tableWidget.setItem(r, self.objectTableHeaderColumns['landmarks'], tableItem)
+
+        self._ui.tableWidget.resizeColumnToContents(self.objectTableHeaderColumns['landmarks'])
+
+    def _tableItemClicked(self):
+        HJCViewerControls._tableItemClicked(self)
+        self._view.setSelected(self.selectedObjectName)
+
+    def _visibleBoxChanged(self, tableItem):
+        if tableItem.column() == self.objectTableHeaderColumns['landmarks']:
+            self._view.setVisibility(tableItem.text(), tableItem.checkState().name == 'Checked')
+
+    def _drawLandmark(self, name, visible):
+        args = self._renderArgs(name)
+        self._view.setPoints(name, self._landmarks[name], args['color'], args['scale_factor'], visible)
+
+    def _refresh(self):
+        for name in set(self._view.names()).difference(self._landmarkNames, self._clouds):
+            self._view.removePoints(name)
+        for name in self._landmarkNames:
+            self._drawLandmark(name, self._tableItem(name).checkState().name == 'Checked')
+
+    def showPointCloud(self, name, points, renderArgs=None):
+        '''
+        Overlay (n, 3) points, such as the HJCs of a cohort, as a single
+        point set.
+        '''
+        args = self._hjcRenderArgs if renderArgs is None else renderArgs
+        self._view.setPoints(name, points, args['color'], args['scale_factor'])
+        self._clouds.add(name)
+
+    def removePointCloud(self, name):
+        if name in self._clouds:
+            self._clouds.discard(name)
+            self._view.removePoints(name)
+
+    def _predict(self):
+        self._predictFunc()
+
+        # checking the rows shows the predicted HJCs
+        for name in HJCNAMES:
+            self._drawLandmark(name, True)
+            self._tableItem(name).setCheckState(Qt.Checked)
+
+    def _reset(self):
+        for name in HJCNAMES:
+            self._view.setPoints(name, np.zeros(3), self._hjcRenderArgs['color'], self._hjcRenderArgs['scale_factor'],
+                                 False)
+            self._tableItem(name).setCheckState(Qt.Unchecked)
+
+    def _accept(self):
+        self._close()
+
+    def _abort(self):
+        self._reset()
+        del self._landmarks['HJC_left']
+        del self._landmarks['HJC_right']
+        self._close()
+
+    def _close(self):
+        # overlays belong to the subject just reviewed
+        for name in list(self._clouds):
+            self.removePointCloud(name)
+
+    def release(self):
+        '''
+        Clear the views and schedule the dialog for deletion. The preview
+        cannot be used afterwards.
+        '''
+        if self._view is None:
+            return
+        self._close()
+        self._view.clear()
+        self._view = None
+        self._landmarks = None
+        self._predictFunc = None
+        self._ui.tableWidget.clearContents()
+        self.close()
+        self.deleteLater()
+
+    def _saveScreenShot(self):
+        filename, width, height = self._screenshotSettings()
+        self._view.saveImage(filename, width, height)
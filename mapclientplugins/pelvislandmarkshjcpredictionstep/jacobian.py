@@ -0,0 +1,158 @@
+'''
+Jacobians of the predicted HJCs with respect to the input landmarks.
+
+For each subject the (6, 15) Jacobian has rows [HJC_left, HJC_right] x, y,
+z and columns the x, y, z of the hip landmarks ordered as HIPLANDMARKS.
+It is computed by batched forward-mode differentiation: the tangents of
+the ISB pelvis frame with respect to the 15 input coordinates are carried
+through pelvisAxes alongside its values, chained with each predictor's
+Jacobian in the pelvis frame and with the inverse transform, so the whole
+batch costs a few times one prediction rather than 15 perturbed ones.
+'''
+
+import numpy as np
+
+from mapclientplugins.pelvislandmarkshjcpredictionstep import predictors
+from mapclientplugins.pelvislandmarkshjcpredictionstep import covariates as cov
+from mapclientplugins.pelvislandmarkshjcpredictionstep.batch import HIPLANDMARKS, DEFAULT_CHUNK_SIZE, predictBatch
+
+# Values are held as (3, N) and tangents as (3, 15, N) arrays, subjects
+# last, so that the arithmetic below runs on contiguous (15, N) planes.
+
+# d(landmark k)/d(inputs), (5, 3, 15, 1)
+_SEEDS = np.eye(15).reshape(5, 3, 15, 1)
+
+
+def _cross(a, da, b, db):
+    # value and tangent of a x b
+    value = np.array([a[1] * b[2] - a[2] * b[1], a[2] * b[0] - a[0] * b[2], a[0] * b[1] - a[1] * b[0]])
+    a, b = a[:, np.newaxis], b[:, np.newaxis]
+    tangent = np.array([da[1] * b[2] - da[2] * b[1] + a[1] * db[2] - a[2] * db[1],
+                        da[2] * b[0] - da[0] * b[2] + a[2] * db[0] - a[0] * db[2],
+                        da[0] * b[1] - da[1] * b[0] + a[0] * db[1] - a[1] * db[0]])
+    return value, tangent
+
+
+def _normalise(v, dv):
+    length = np.sqrt(v[0] * v[0] + v[1] * v[1] + v[2] * v[2])
+    u = v / length
+    along = dv[0] * u[0] + dv[1] * u[1] + dv[2] * u[2]
+    return u, (dv - u[:, np.newaxis] * along) / length
+
+
+def pelvisAxesTangents(lasis, rasis, lpsis, rpsis):
+    '''
+    Forward-mode pelvisAxes, for (3, N) landmark arrays. Returns the
+    origins (3, N) and rotations (3, 3, N), rows the x, y, z axes, with
+    their tangents (3, 15, N) and (3, 3, 15, N), axis -2 indexing the hip
+    landmark coordinates.
+    '''
+    n = lasis.shape[-1]
+    o = 0.5 * (lasis + rasis)
+    do = np.broadcast_to(0.5 * (_SEEDS[0] + _SEEDS[1]), (3, 15, n))
+    op = 0.5 * (lpsis + rpsis)
+    dop = 0.5 * (_SEEDS[2] + _SEEDS[3])
+    z, dz = _normalise(rasis - lasis, np.broadcast_to(_SEEDS[1] - _SEEDS[0], (3, 15, n)))
+    n1, dn1 = _normalise(*_cross(rasis - op, _SEEDS[1] - dop, lasis - op, _SEEDS[0] - dop))
+    x, dx = _normalise(*_cross(n1, dn1, z, dz))
+    y, dy = _normalise(*_cross(z, dz, x, dx))
+    return o, do, np.array([x, y, z]), np.array([dx, dy, dz])
+
+
+def _jacobianChunk(coords, predictor, classIndices, covariates):
+    p = np.ascontiguousarray(coords.transpose(1, 2, 0))
+    o, do, R, dR = pelvisAxesTangents(*p[:4])
+    offsets = p - o
+    aligned = np.empty_like(p)
+    # d(aligned landmarks)/d(inputs), (5, 3, 15, N), filled a (15, N) plane
+    # at a time to stay in cache
+    dAligned = np.empty((5, 3, 15, p.shape[-1]))
+    term = np.empty((15, p.shape[-1]))
+    for k in range(5):
+        for i in range(3):
+            aligned[k, i] = R[i, 0] * offsets[k, 0] + R[i, 1] * offsets[k, 1] + R[i, 2] * offsets[k, 2]
+            plane = dAligned[k, i]
+            np.multiply(dR[i, 0], offsets[k, 0], out=plane)
+            for j in (1, 2):
+                np.multiply(dR[i, j], offsets[k, j], out=term)
+                plane += term
+            # R (d(landmark k) - d(origin)), the seeds being unit columns
+            plane[3 * k:3 * k + 3] += R[i]
+            plane[0:3] -= 0.5 * R[i]
+            plane[3:6] -= 0.5 * R[i]
+    dAligned = dAligned.reshape(15, 15, -1)
+
+    alignedL = dict(zip(HIPLANDMARKS, aligned.transpose(0, 2, 1)))
+    hjcs = predictor.predictMixed(alignedL, classIndices, covariates).transpose(1, 2, 0)
+    Jh = np.ascontiguousarray(predictor.jacobianMixed(alignedL, classIndices, covariates).transpose(1, 2, 0))
+    # skipping landmarks the method does not use
+    dHJCs = np.zeros((6, 15, p.shape[-1]))
+    for r in range(6):
+        for m in np.flatnonzero(Jh[r].any(axis=-1)):
+            np.multiply(Jh[r, m], dAligned[m], out=term)
+            dHJCs[r] += term
+    dHJCs = dHJCs.reshape(2, 3, 15, -1)
+
+    # input frame HJCs o + R^T h, the origin's tangent being the mean of
+    # the ASIS seeds
+    inputHJCs = np.empty((2, 3, p.shape[-1]))
+    J = np.empty((2, 3, 15, p.shape[-1]))
+    for h in range(2):
+        for i in range(3):
+            inputHJCs[h, i] = o[i] + R[0, i] * hjcs[h, 0] + R[1, i] * hjcs[h, 1] + R[2, i] * hjcs[h, 2]
+            plane = J[h, i]
+            np.multiply(dR[0, i], hjcs[h, 0], out=plane)
+            for j in range(3):
+                if j:
+                    np.multiply(dR[j, i], hjcs[h, j], out=term)
+                    plane += term
+                np.multiply(R[j, i], dHJCs[h, j], out=term)
+                plane += term
+            plane[i] += 0.5
+            plane[3 + i] += 0.5
+    return inputHJCs.transpose(2, 0, 1), J.reshape(6, 15, -1).transpose(2, 0, 1)
+
+
+def jacobianBatch(coords, method, popClass, covariates=None, chunkSize=DEFAULT_CHUNK_SIZE // 32):
+    '''
+    Predict HJCs with their Jacobians for a batch of pelvises.
+
+    coords, method, popClass and covariates are as batch.predictBatch.
+    chunkSize is smaller by default so that the tangents, about 30 times
+    the size of the landmarks, stay in cache.
+
+    Returns the (N, 2, 3) HJCs in the input frame and their (N, 6, 15)
+    Jacobians. Degenerate pelvises give NaN.
+    '''
+    coords = np.asarray(coords, dtype=float)
+    predictor = predictors.getPredictor(method)
+    if covariates is None:
+        classIndices = np.full(len(coords), predictor.classIndex(popClass), dtype=np.intp)
+    else:
+        predictor.classIndex(popClass)
+        classIndices = cov.classIndices(covariates, predictor.popClasses, popClass)
+    hjcs = np.empty((len(coords), 2, 3))
+    J = np.empty((len(coords), 6, 15))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for start in range(0, len(coords), chunkSize):
+            stop = start + chunkSize
+            hjcs[start:stop], J[start:stop] = _jacobianChunk(coords[start:stop], predictor, classIndices[start:stop],
+                                                             cov.sliceCovariates(covariates, start, stop))
+    return hjcs, J
+
+
+def finiteDifferenceJacobian(coords, method, popClass, covariates=None, step=1e-4):
+    '''
+    Central difference Jacobians of batch.predictBatch, 30 predictions of
+    the batch, for checking jacobianBatch.
+    '''
+    coords = np.asarray(coords, dtype=float)
+    J = np.empty((len(coords), 6, 15))
+    for c in range(15):
+        shifted = coords.copy()
+        shifted[:, c // 3, c % 3] += step
+        forward = predictBatch(shifted, method, popClass, covariates)
+        shifted[:, c // 3, c % 3] -= 2.0 * step
+        backward = predictBatch(shifted, method, popClass, covariates)
+        J[:, :, c] = (forward - backward).reshape(len(coords), 6) / (2.0 * step)
+    return J
@@ -0,0 +1,144 @@
+'''
+Resumable cohort prediction jobs.
+
+A job directory in the step location holds one .npz file of results per
+completed chunk and a manifest.json recording the input hash, a snapshot
+of the step configuration and the completed chunk ranges. Passed to
+batch.predictBatch as its checkpoint callback, a CohortJob writes each
+chunk as it completes. On restart the completed chunks are loaded back and
+skipped, after checking that the inputs and the configuration are those
+the job was started with.
+'''
+
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'manifest.json'
+# configuration keys that do not change the results
+RUNTIME_KEYS = ('identifier', 'GUI', 'Profile', 'Workers', 'Resumable Job', 'Spatial Index',
+                'Plain Cohort Points', 'Fused Kernel', 'HJC Jacobian', '2D Preview')
+
+
+def _chunkFile(start, stop):
+    return 'chunk_%012d_%012d.npz' % (start, stop)
+
+
+def _mergeRanges(ranges):
+    merged = []
+    for start, stop in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], stop)
+        else:
+            merged.append([start, stop])
+    return merged
+
+
+def _resultConfig(config):
+    return dict((k, v) for k, v in config.items() if k not in RUNTIME_KEYS)
+
+
+def _atomicWrite(path, write):
+    tmpPath = path + '.tmp'
+    with open(tmpPath, 'wb') as f:
+        write(f)
+    os.replace(tmpPath, path)
+
+
+class CohortJob(object):
+    '''
+    path: job directory.
+    key: checkpoint.inputKey of the landmarks and covariates of every
+        subject, before any deduplication.
+    config: the step configuration as saved by serialize().
+    hjcs, errors, completed: the out, errors and completed arrays passed
+        to predictBatch. errors may be None.
+    '''
+
+    def __init__(self, path, key, config, hjcs, errors, completed):
+        self.path = path
+        self.key = key
+        self.config = config
+        self._hjcs = hjcs
+        self._errors = errors
+        self._completed = completed
+        self._chunks = []
+        self._lock = threading.Lock()
+
+    def resume(self):
+        '''
+        Start the job, or load the completed chunks of an earlier run of it.
+        A job directory of other inputs is started over, with a warning.
+        Raises RuntimeError if the inputs match but the configuration has
+        changed. Returns the number of subjects loaded.
+        '''
+        manifestPath = os.path.join(self.path, MANIFEST_FILE)
+        if os.path.exists(manifestPath):
+            with open(manifestPath) as f:
+                manifest = json.load(f)
+            if manifest['inputKey'] == self.key:
+                # checked before the subject count, which settings such as
+                # Deduplicate Subjects change
+                if _resultConfig(manifest['config']) != _resultConfig(self.config):
+                    changed = sorted(k for k in set(manifest['config']) | set(self.config)
+                                     if k not in RUNTIME_KEYS and
+                                     manifest['config'].get(k) != self.config.get(k))
+                    raise RuntimeError('HJC prediction job in %s was started with a different configuration (%s), '
+                                       'restore it or remove the job directory' % (self.path, ', '.join(changed)))
+                if manifest['subjects'] == len(self._completed):
+                    return self._load(manifest['completedChunks'])
+            logger.warning('HJC prediction job in %s was started over other inputs, discarding its %d completed '
+                           'subjects', self.path, sum(stop - start for start, stop in manifest['completedRanges']))
+            self._clearChunks()
+        self._chunks = []
+        self._writeManifest()
+        return 0
+
+    def _load(self, chunks):
+        for start, stop in chunks:
+            with np.load(os.path.join(self.path, _chunkFile(start, stop)), allow_pickle=False) as saved:
+                self._hjcs[start:stop] = saved['hjcs']
+                if self._errors is not None and 'errors' in saved:
+                    self._errors[start:stop] = saved['errors']
+            self._completed[start:stop] = True
+        self._chunks = [list(c) for c in chunks]
+        return int(self._completed.sum())
+
+    def __call__(self, start, stop):
+        stop = min(stop, len(self._completed))
+        arrays = {'hjcs': self._hjcs[start:stop]}
+        if self._errors is not None:
+            arrays['errors'] = self._errors[start:stop]
+        _atomicWrite(os.path.join(self.path, _chunkFile(start, stop)), lambda f: np.savez(f, **arrays))
+        with self._lock:
+            self._chunks.append([start, stop])
+            self._writeManifest()
+
+    def _writeManifest(self):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        manifest = {'inputKey': self.key,
+                    'subjects': len(self._completed),
+                    'config': self.config,
+                    # chunk files are listed individually, the merged
+                    # ranges summarise progress
+                    'completedChunks': sorted(self._chunks),
+                    'completedRanges': _mergeRanges(self._chunks),
+                    }
+        _atomicWrite(os.path.join(self.path, MANIFEST_FILE),
+                     lambda f: f.write(json.dumps(manifest, indent=4, sort_keys=True).encode()))
+
+    def _clearChunks(self):
+        for name in os.listdir(self.path):
+            if name.startswith('chunk_') and name.endswith('.npz'):
+                os.remove(os.path.join(self.path, name))
+
+    @property
+    def completedRanges(self):
+        with self._lock:
+            return _mergeRanges(self._chunks)
@@ -0,0 +1,150 @@
+'''
+Optional Numba kernel fusing alignment, prediction and the inverse
+transform.
+
+The NumPy batch path makes several passes over the batch, allocating an
+(N, ...) temporary at each step. The fused kernel instead handles one
+subject at a time in scalar locals: it builds the ISB pelvis frame from
+the four iliac spines, takes the landmarks it needs into that frame,
+evaluates the regression and maps the two HJCs straight back, writing only
+the (N, 2, 3) output. Subjects are spread over threads with prange.
+
+The built-in predictors have fused equivalents, identified by their batch
+functions so that a replaced predictor is never mistaken for a built-in.
+batch.predictBatch(fused=True) uses the NumPy path for other predictors,
+or when Numba is not installed.
+'''
+
+import math
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+from mapclientplugins.pelvislandmarkshjcpredictionstep import predictors
+
+NUMBA_AVAILABLE = numba is not None
+
+_SEIDEL, _BELL, _TYLKOWSKI, _HARRINGTON, _HARA = range(5)
+_KERNEL_CODES = {predictors._seidelBatch: _SEIDEL,
+                 predictors._bellBatch: _BELL,
+                 predictors._tylkowskiBatch: _TYLKOWSKI,
+                 predictors._harringtonBatch: _HARRINGTON,
+                 predictors._haraBatch: _HARA,
+                 }
+
+if NUMBA_AVAILABLE:
+    # numpy error model: degenerate pelvises give NaN, not ZeroDivisionError
+    _jit = numba.njit(parallel=True, cache=True, error_model='numpy')
+    _prange = numba.prange
+else:
+    def _jit(func):
+        return func
+    _prange = range
+
+
+@_jit
+def _fusedKernel(coords, code, coefficientTable, classIndices, pelvicWidth, legLength, out):
+    for i in _prange(coords.shape[0]):
+        # input landmarks
+        lax, lay, laz = coords[i, 0, 0], coords[i, 0, 1], coords[i, 0, 2]
+        rax, ray, raz = coords[i, 1, 0], coords[i, 1, 1], coords[i, 1, 2]
+        lpx, lpy, lpz = coords[i, 2, 0], coords[i, 2, 1], coords[i, 2, 2]
+        rpx, rpy, rpz = coords[i, 3, 0], coords[i, 3, 1], coords[i, 3, 2]
+        psx, psy, psz = coords[i, 4, 0], coords[i, 4, 1], coords[i, 4, 2]
+
+        # ISB pelvis frame, as batch.pelvisAxes
+        ox, oy, oz = 0.5 * (lax + rax), 0.5 * (lay + ray), 0.5 * (laz + raz)
+        opx, opy, opz = 0.5 * (lpx + rpx), 0.5 * (lpy + rpy), 0.5 * (lpz + rpz)
+        zx, zy, zz = rax - lax, ray - lay, raz - laz
+        s = 1.0 / math.sqrt(zx * zx + zy * zy + zz * zz)
+        zx, zy, zz = zx * s, zy * s, zz * s
+        ax, ay, az = rax - opx, ray - opy, raz - opz
+        bx, by, bz = lax - opx, lay - opy, laz - opz
+        nx, ny, nz = ay * bz - az * by, az * bx - ax * bz, ax * by - ay * bx
+        s = 1.0 / math.sqrt(nx * nx + ny * ny + nz * nz)
+        nx, ny, nz = nx * s, ny * s, nz * s
+        xx, xy, xz = ny * zz - nz * zy, nz * zx - nx * zz, nx * zy - ny * zx
+        s = 1.0 / math.sqrt(xx * xx + xy * xy + xz * xz)
+        xx, xy, xz = xx * s, xy * s, xz * s
+        yx, yy, yz = zy * xz - zz * xy, zz * xx - zx * xz, zx * xy - zy * xx
+        s = 1.0 / math.sqrt(yx * yx + yy * yy + yz * yz)
+        yx, yy, yz = yx * s, yy * s, yz * s
+
+        # landmarks in the pelvis frame
+        dx, dy, dz = lax - ox, lay - oy, laz - oz
+        lx, ly, lz = xx * dx + xy * dy + xz * dz, yx * dx + yy * dy + yz * dz, zx * dx + zy * dy + zz * dz
+        dx, dy, dz = rax - ox, ray - oy, raz - oz
+        rx, ry, rz = xx * dx + xy * dy + xz * dz, yx * dx + yy * dy + yz * dz, zx * dx + zy * dy + zz * dz
+        dx, dy, dz = lpx - ox, lpy - oy, lpz - oz
+        plx, ply, plz = xx * dx + xy * dy + xz * dz, yx * dx + yy * dy + yz * dz, zx * dx + zy * dy + zz * dz
+        dx, dy, dz = rpx - ox, rpy - oy, rpz - oz
+        prx, pry, prz = xx * dx + xy * dy + xz * dz, yx * dx + yy * dy + yz * dz, zx * dx + zy * dy + zz * dz
+        dx, dy, dz = psx - ox, psy - oy, psz - oz
+        sx, sy, sz = xx * dx + xy * dy + xz * dz, yx * dx + yy * dy + yz * dz, zx * dx + zy * dy + zz * dz
+
+        # measured pelvic width where given, ASIS-ASIS distance otherwise
+        W = pelvicWidth[i]
+        if not math.isfinite(W):
+            W = math.sqrt((lx - rx) ** 2 + (ly - ry) ** 2 + (lz - rz) ** 2)
+
+        c = coefficientTable[classIndices[i]]
+        if code == _SEIDEL:
+            H = 0.5 * (abs(ly - sy) + abs(ry - sy))
+            D = 0.5 * (abs(lx - plx) + abs(rx - prx))
+            hlx, hly, hlz = lx - c[2] * D, ly - c[0] * H, lz + c[1] * W
+            hrx, hry, hrz = rx - c[2] * D, ry - c[0] * H, rz - c[1] * W
+        elif code == _BELL:
+            hlx, hly, hlz = lx - c[0] * W, 0.5 * (ly + sy) - c[1], 0.5 * (lz + sz) - c[2]
+            hrx, hry, hrz = rx - c[0] * W, 0.5 * (ry + sy) - c[1], 0.5 * (rz + sz) + c[2]
+        elif code == _TYLKOWSKI:
+            hlx, hly, hlz = lx - c[2] * W, ly - c[0] * W, lz + c[1] * W
+            hrx, hry, hrz = rx - c[2] * W, ry - c[0] * W, rz - c[1] * W
+        elif code == _HARRINGTON:
+            PD = math.sqrt((0.5 * (lx + rx - plx - prx)) ** 2 + (0.5 * (ly + ry - ply - pry)) ** 2 +
+                           (0.5 * (lz + rz - plz - prz)) ** 2)
+            hrx, hry, hrz = c[0] * PD + c[1], c[2] * W + c[3], c[4] * W + c[5]
+            hlx, hly, hlz = hrx, hry, -hrz
+        else:
+            LL = legLength[i]
+            hrx, hry, hrz = c[0] + c[1] * LL, c[2] + c[3] * LL, c[4] + c[5] * LL
+            hlx, hly, hlz = hrx, hry, -hrz
+
+        # back to the input frame, o + R^T h
+        out[i, 0, 0] = ox + xx * hlx + yx * hly + zx * hlz
+        out[i, 0, 1] = oy + xy * hlx + yy * hly + zy * hlz
+        out[i, 0, 2] = oz + xz * hlx + yz * hly + zz * hlz
+        out[i, 1, 0] = ox + xx * hrx + yx * hry + zx * hrz
+        out[i, 1, 1] = oy + xy * hrx + yy * hry + zy * hrz
+        out[i, 1, 2] = oz + xz * hrx + yz * hry + zz * hrz
+
+
+def fusable(predictor):
+    '''
+    Whether predictor has a fused kernel and Numba is available to run it.
+    '''
+    return NUMBA_AVAILABLE and predictor.batchFunc in _KERNEL_CODES
+
+
+def fusedChunk(coords, predictor, classIndices, covariates=None):
+    '''
+    (N, 2, 3) HJCs in the input frame of (N, 5, 3) hip landmarks ordered
+    as batch.HIPLANDMARKS, computed by the fused kernel. The predictor
+    must be fusable.
+    '''
+    n = len(coords)
+    covariates = covariates or {}
+    missing = [c for c in predictor.covariates if c not in covariates]
+    if missing:
+        raise RuntimeError('HJC prediction failed, missing covariate: ' + missing[0])
+    pelvicWidth = np.ascontiguousarray(covariates.get('pelvic_width', np.full(n, np.nan)), dtype=float)
+    legLength = np.ascontiguousarray(covariates.get('leg_length', np.full(n, np.nan)), dtype=float)
+    out = np.empty((n, 2, 3))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        _fusedKernel(np.ascontiguousarray(coords, dtype=float), _KERNEL_CODES[predictor.batchFunc],
+                     predictor.coefficientTable, np.ascontiguousarray(classIndices, dtype=np.intp),
+                     pelvicWidth, legLength, out)
+    return out
@@ -0,0 +1,161 @@
+'''
+Array-native container for batches of pelvic landmarks and predicted HJCs.
+
+A LandmarkBatch is what the step provides on its batch port: a names index,
+an (N, k, 3) coordinate array, an (N, 2, 3) HJC array, subject identifiers
+and a metadata dict. Consumers can take the arrays directly instead of
+walking per-landmark dicts.
+'''
+
+import json
+import os
+
+import numpy as np
+
+from mapclientplugins.pelvislandmarkshjcpredictionstep.batch import stackLandmarks, ERROR_NONE, ERROR_MESSAGES
+
+HJCNAMES = ('HJC_left', 'HJC_right')
+_ARRAYS = ('coords', 'hjcs', 'subjectIds', 'errors')
+_INDEX_FILE = 'batch.json'
+
+
+class LandmarkBatch(object):
+    '''
+    names: tuple of the k landmark names indexing axis 1 of coords.
+    coords: (N, k, 3) C-contiguous float array of landmarks.
+    hjcs: (N, 2, 3) float array of [HJC_left, HJC_right], NaN where not
+        predicted.
+    subjectIds: (N,) array of subject identifiers.
+    metadata: dict of JSON serialisable prediction settings.
+    frames: dict of output frame name to (N, 2, 3) HJCs in that frame, for
+        frames other than the one coords and hjcs are in.
+    errors: (N,) int8 array of batch.ERROR_ codes, nonzero for subjects a
+        fault tolerant run could not predict.
+    jacobians: optional (N, 6, 15) derivatives of the HJCs with respect to
+        the hip landmarks, see jacobian.py.
+    '''
+
+    def __init__(self, names, coords, hjcs=None, subjectIds=None, metadata=None, frames=None, errors=None,
+                 jacobians=None):
+        self.names = tuple(names)
+        self.coords = np.ascontiguousarray(coords, dtype=float)
+        if self.coords.ndim != 3 or self.coords.shape[1:] != (len(self.names), 3):
+            raise ValueError('coords must be (N, %d, 3), got %s' % (len(self.names), self.coords.shape))
+        n = len(self.coords)
+        if hjcs is None:
+            hjcs = np.full((n, 2, 3), np.nan)
+        self.hjcs = np.ascontiguousarray(hjcs, dtype=float)
+        if self.hjcs.shape != (n, 2, 3):
+            raise ValueError('hjcs must be (%d, 2, 3), got %s' % (n, self.hjcs.shape))
+        if subjectIds is None:
+            subjectIds = np.arange(n)
+        self.subjectIds = np.asarray(subjectIds)
+        if self.subjectIds.shape != (n,):
+            raise ValueError('subjectIds must be (%d,), got %s' % (n, self.subjectIds.shape))
+        self.metadata = {} if metadata is None else dict(metadata)
+        self.frames = {}
+        for name, frameHJCs in ({} if frames is None else frames).items():
+            self.frames[name] = np.ascontiguousarray(frameHJCs, dtype=float)
+            if self.frames[name].shape != (n, 2, 3):
+                raise ValueError('%s frame hjcs must be (%d, 2, 3), got %s' % (name, n, self.frames[name].shape))
+        if errors is None:
+            errors = np.zeros(n, dtype=np.int8)
+        self.errors = np.asarray(errors, dtype=np.int8)
+        if self.errors.shape != (n,):
+            raise ValueError('errors must be (%d,), got %s' % (n, self.errors.shape))
+        self.jacobians = None if jacobians is None else np.ascontiguousarray(jacobians, dtype=float)
+        if self.jacobians is not None and self.jacobians.shape != (n, 6, 15):
+            raise ValueError('jacobians must be (%d, 6, 15), got %s' % (n, self.jacobians.shape))
+
+    def __len__(self):
+        return len(self.coords)
+
+    def index(self, name):
+        return self.names.index(name)
+
+    def landmark(self, name):
+        '''
+        (N, 3) view of one landmark across the batch. HJC_left and
+        HJC_right index the HJC array.
+        '''
+        if name in HJCNAMES:
+            return self.hjcs[:, HJCNAMES.index(name)]
+        return self.coords[:, self.index(name)]
+
+    def subject(self, i):
+        '''
+        Landmark dict of subject i.
+        '''
+        d = dict(zip(self.names, self.coords[i]))
+        d.update(zip(HJCNAMES, self.hjcs[i]))
+        return d
+
+    @property
+    def failed(self):
+        '''
+        (N,) boolean mask of subjects that could not be predicted.
+        '''
+        return self.errors != ERROR_NONE
+
+    def errorTable(self):
+        '''
+        List of (subject id, failure message) for failed subjects.
+        '''
+        return [(self.subjectIds[i], ERROR_MESSAGES[self.errors[i]]) for i in np.flatnonzero(self.failed)]
+
+    @classmethod
+    def fromDicts(cls, subjects, names, subjectIds=None, metadata=None, keys=None, frames=(), allowMissing=False):
+        '''
+        Build a batch from a sequence of landmark dicts. HJCs are taken from
+        the HJC_left and HJC_right entries where present, and those of each
+        of frames from the HJC_left_<frame> and HJC_right_<frame> entries.
+        keys optionally gives the dict key each of names is read from. With
+        allowMissing, missing landmarks are NaN instead of an error.
+        '''
+        present = np.ones((len(subjects), len(names)), dtype=bool) if allowMissing else None
+        coords = stackLandmarks(subjects, names if keys is None else keys, present=present)
+
+        def gather(suffix):
+            hjcs = np.full((len(subjects), 2, 3), np.nan)
+            for i, s in enumerate(subjects):
+                for j, name in enumerate(HJCNAMES):
+                    if name + suffix in s:
+                        hjcs[i, j] = s[name + suffix]
+            return hjcs
+
+        return cls(names, coords, gather(''), subjectIds, metadata, dict((f, gather('_' + f)) for f in frames))
+
+    def save(self, path):
+        '''
+        Write the batch to directory path as .npy arrays plus a JSON index,
+        so it can be reloaded memory-mapped.
+        '''
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for name in _ARRAYS:
+            np.save(os.path.join(path, name + '.npy'), getattr(self, name), allow_pickle=False)
+        for name, frameHJCs in self.frames.items():
+            np.save(os.path.join(path, 'hjcs_%s.npy' % name), frameHJCs, allow_pickle=False)
+        if self.jacobians is not None:
+            np.save(os.path.join(path, 'jacobians.npy'), self.jacobians, allow_pickle=False)
+        with open(os.path.join(path, _INDEX_FILE), 'w') as f:
+            json.dump({'names': self.names, 'metadata': self.metadata, 'frames': sorted(self.frames)},
+                      f, indent=4, sort_keys=True)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        with open(os.path.join(path, _INDEX_FILE)) as f:
+            index = json.load(f)
+        arrays = [np.load(os.path.join(path, name + '.npy'), mmap_mode='r' if mmap else None)
+                  for name in _ARRAYS[:3]]
+        batch = cls.__new__(cls)
+        batch.names = tuple(index['names'])
+        batch.coords, batch.hjcs, batch.subjectIds = arrays
+        batch.errors = np.load(os.path.join(path, 'errors.npy'))
+        jacobiansPath = os.path.join(path, 'jacobians.npy')
+        batch.jacobians = np.load(jacobiansPath, mmap_mode='r' if mmap else None) \
+            if os.path.exists(jacobiansPath) else None
+        batch.metadata = index['metadata']
+        batch.frames = dict((name, np.load(os.path.join(path, 'hjcs_%s.npy' % name), mmap_mode='r' if mmap else None))
+                            for name in index['frames'])
+        return batch
@@ -0,0 +1,134 @@
+'''
+Level-of-detail policy for landmark glyphs.
+
+Sphere glyphs cost roughly 2 * resolution^2 triangles each. The policy
+picks a sphere resolution for a set of glyphs from the size they appear
+on screen, which falls with camera distance, and from the number of
+points, capping the triangles of the whole scene. Glyphs that would be a
+pixel or two across, or sets too large for even the coarsest spheres
+within the budget, are drawn as plain points instead.
+
+The helpers below apply the policy to Mayavi glyph modules passed in by
+the viewers, this module itself does not import Mayavi.
+'''
+
+import numpy as np
+
+PLAIN_POINTS = 0
+
+
+class LevelOfDetail(object):
+    '''
+    pixelsPerLevel: (projected glyph diameter in pixels, sphere resolution)
+        pairs in increasing order. Glyphs smaller than the first are
+        drawn as plain points.
+    triangleBudget: approximate triangles allowed over all glyphs.
+    minResolution: coarsest sphere worth drawing, below it points are
+        used.
+    '''
+    pixelsPerLevel = ((3.0, 4), (8.0, 6), (20.0, 10), (60.0, 16))
+    triangleBudget = 1000000
+    minResolution = 4
+
+    def projectedSize(self, glyphSize, distance, viewAngle, viewportHeight):
+        '''
+        Approximate on-screen diameter in pixels of a glyph of glyphSize at
+        distance from a perspective camera with vertical viewAngle in
+        degrees.
+        '''
+        distance = max(distance, 1e-9)
+        return glyphSize * viewportHeight / (2.0 * distance * np.tan(np.radians(viewAngle) / 2.0))
+
+    def resolution(self, nPoints, glyphSize, distance, viewAngle=30.0, viewportHeight=800, totalPoints=None):
+        '''
+        Sphere resolution for nPoints glyphs of glyphSize at distance from
+        the camera, or PLAIN_POINTS. totalPoints is the number of glyphs
+        in the whole scene sharing the triangle budget, nPoints if None.
+        '''
+        pixels = self.projectedSize(glyphSize, distance, viewAngle, viewportHeight)
+        level = PLAIN_POINTS
+        for minPixels, res in self.pixelsPerLevel:
+            if pixels >= minPixels:
+                level = res
+        if level == PLAIN_POINTS:
+            return PLAIN_POINTS
+        total = max(nPoints if totalPoints is None else totalPoints, 1)
+        budgeted = int(np.sqrt(self.triangleBudget / (2.0 * total)))
+        level = min(level, budgeted)
+        return level if level >= self.minResolution else PLAIN_POINTS
+
+    def nearestDistance(self, points, cameraPosition):
+        '''
+        Distance from the camera to the nearest of (n, 3) points, the
+        glyphs that appear largest.
+        '''
+        points = np.asarray(points, dtype=float).reshape(-1, 3)
+        return float(np.sqrt(((points - cameraPosition) ** 2).sum(-1)).min()) if len(points) else np.inf
+
+
+def setGlyphLevel(glyph, level, pointSize=3.0):
+    '''
+    Switch a Mayavi glyph module between sphere glyphs of resolution level
+    and plain points.
+    '''
+    source = glyph.glyph.glyph_source
+    if level == PLAIN_POINTS:
+        source.glyph_source = source.glyph_dict['point_source']
+        glyph.actor.property.point_size = pointSize
+    else:
+        source.glyph_source = source.glyph_dict['sphere_source']
+        source.glyph_source.theta_resolution = level
+        source.glyph_source.phi_resolution = level
+
+
+def updateGlyphs(scene, glyphSets, levels, policy=None, pointSize=3.0):
+    '''
+    Apply the level of detail for the current camera to each glyph set.
+
+    scene: Mayavi scene model the glyphs are in.
+    glyphSets: sequence of (key, glyph module, (n, 3) points, glyph size,
+        plain), plain forcing plain points.
+    levels: dict of key to the level last applied, updated in place so
+        that unchanged glyphs are not touched.
+    '''
+    if policy is None:
+        policy = LevelOfDetail()
+    camera = scene.camera
+    position = np.asarray(camera.position, dtype=float)
+    viewportHeight = scene.render_window.size[1] or 800
+    totalPoints = sum(len(points) for _, _, points, _, _ in glyphSets)
+    for key in set(levels).difference(key for key, _, _, _, _ in glyphSets):
+        del levels[key]
+    for key, glyph, points, glyphSize, plain in glyphSets:
+        if plain:
+            level = PLAIN_POINTS
+        else:
+            level = policy.resolution(len(points), glyphSize, policy.nearestDistance(points, position),
+                                      camera.view_angle, viewportHeight, totalPoints)
+        if levels.get(key) != level:
+            setGlyphLevel(glyph, level, pointSize)
+            levels[key] = level
+
+
+def observeInteraction(scene, callback):
+    '''
+    Call callback when a rotation, pan or zoom of scene ends. Returns the
+    observer tags for removeObservers, an empty list if the scene has no
+    interactor yet.
+    '''
+    interactor = scene.interactor
+    if interactor is None:
+        return []
+    return [interactor.add_observer(event, lambda obj, event: callback())
+            for event in ('EndInteractionEvent', 'MouseWheelForwardEvent', 'MouseWheelBackwardEvent')]
+
+
+def removeObservers(scene, tags):
+    '''
+    Remove observers added by observeInteraction, releasing the callbacks
+    they hold.
+    '''
+    if scene.interactor is not None:
+        for tag in tags:
+            scene.interactor.remove_observer(tag)
+    del tags[:]
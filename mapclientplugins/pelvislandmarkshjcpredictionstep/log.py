@@ -0,0 +1,82 @@
+'''
+Logging for the plugin.
+
+Each module logs to its own logger under the package logger,
+
+    logger = logging.getLogger(__name__)
+
+passing arguments rather than formatted strings, so messages below the
+enabled level are never formatted. Per-landmark and per-event
+diagnostics go to DEBUG, and loops test the level once, so they cost
+nothing unless debug logging is enabled.
+
+The package logger has a NullHandler and writes nothing until the
+application, or setLevel and enableRingBuffer here, configures it. A
+RingBufferHandler keeps the latest records in memory, e.g. to attach to a
+bug report from an interactive session without a log file.
+'''
+
+import logging
+from collections import deque
+
+PACKAGE_LOGGER = 'mapclientplugins.pelvislandmarkshjcpredictionstep'
+DEFAULT_CAPACITY = 1000
+
+packageLogger = logging.getLogger(PACKAGE_LOGGER)
+packageLogger.addHandler(logging.NullHandler())
+
+
+class RingBufferHandler(logging.Handler):
+    '''
+    Keeps the last capacity records. Messages are formatted when a record
+    reaches the handler, so the buffer does not hold on to, or show later
+    changes of, the arrays and dicts passed as arguments.
+    '''
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, level=logging.NOTSET):
+        logging.Handler.__init__(self, level)
+        self.records = deque(maxlen=capacity)
+
+    def emit(self, record):
+        try:
+            record.msg = record.getMessage()
+            record.args = None
+            self.records.append(record)
+        except Exception:
+            self.handleError(record)
+
+    def messages(self):
+        '''
+        The buffered records formatted with the handler's formatter, oldest
+        first.
+        '''
+        return [self.format(r) for r in list(self.records)]
+
+    def clear(self):
+        self.records.clear()
+
+
+def setLevel(level):
+    '''
+    Set the level of the package logger, e.g. logging.DEBUG to enable the
+    per-landmark diagnostics.
+    '''
+    packageLogger.setLevel(level)
+
+
+def enableRingBuffer(capacity=DEFAULT_CAPACITY, level=logging.DEBUG):
+    '''
+    Attach a RingBufferHandler for records of level and above to the
+    package logger, lowering the logger's level to it if needed. Returns
+    the handler.
+    '''
+    handler = RingBufferHandler(capacity, level)
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    packageLogger.addHandler(handler)
+    if packageLogger.getEffectiveLevel() > level:
+        packageLogger.setLevel(level)
+    return handler
+
+
+def disableRingBuffer(handler):
+    packageLogger.removeHandler(handler)
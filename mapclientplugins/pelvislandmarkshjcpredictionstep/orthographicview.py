@@ -0,0 +1,158 @@
+'''
+Orthographic 2D projections of landmarks painted with QPainter.
+
+OrthographicView draws named point sets in three views on a common scale,
+front (x right, y up), side (z right, y up) and top (x right, z up), with
+the selected landmark's coordinates in the fourth quadrant. It needs no
+OpenGL context, so it opens quickly and redraws cheaply over remote
+desktop and X forwarded sessions where VTK is slow.
+'''
+
+from collections import OrderedDict
+
+from PySide6.QtWidgets import QWidget, QSizePolicy
+from PySide6.QtGui import QPainter, QColor, QPen, QImage
+from PySide6.QtCore import Qt, QPointF, QRectF
+
+import numpy as np
+
+
+class OrthographicView(QWidget):
+    '''
+    Point sets are drawn as discs of their glyph size in data units, and at
+    least minimumRadius pixels, sets of more than maxDiscs points as plain
+    points.
+    '''
+    projections = (('front', 0, 1), ('side', 2, 1), ('top', 0, 2))
+    # grid cell (column, row) of each projection
+    cells = ((0, 0), (1, 0), (0, 1))
+    axisNames = 'xyz'
+    backgroundColour = QColor(0, 0, 0)
+    frameColour = QColor(90, 90, 90)
+    textColour = QColor(200, 200, 200)
+    selectedColour = QColor(255, 255, 255)
+    minimumRadius = 2.0
+    maxDiscs = 2000
+    margin = 0.1
+
+    def __init__(self, parent=None):
+        QWidget.__init__(self, parent)
+        self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+        self.setMinimumSize(300, 300)
+        self._pointSets = OrderedDict()
+        self.selectedName = None
+
+    def setPoints(self, name, points, colour, size, visible=True):
+        '''
+        Add or replace a set of (n, 3) points drawn in colour, an RGB tuple
+        in [0, 1], as discs of diameter size. Non-finite points are
+        skipped.
+        '''
+        points = np.asarray(points, dtype=float).reshape(-1, 3)
+        self._pointSets[name] = [points[np.isfinite(points).all(axis=1)], QColor.fromRgbF(*colour), float(size),
+                                 visible]
+        self.update()
+
+    def removePoints(self, name):
+        if self._pointSets.pop(name, None) is not None:
+            self.update()
+
+    def setVisibility(self, name, visible):
+        if name in self._pointSets:
+            self._pointSets[name][3] = visible
+            self.update()
+
+    def setSelected(self, name):
+        self.selectedName = name
+        self.update()
+
+    def names(self):
+        return list(self._pointSets)
+
+    def clear(self):
+        self._pointSets.clear()
+        self.selectedName = None
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        try:
+            self.paint(painter, QRectF(self.rect()))
+        finally:
+            painter.end()
+
+    def saveImage(self, filename, width, height):
+        '''
+        Paint the views into a width by height image and save it to
+        filename, the format following its extension.
+        '''
+        image = QImage(width, height, QImage.Format_RGB32)
+        painter = QPainter(image)
+        try:
+            self.paint(painter, QRectF(0, 0, width, height))
+        finally:
+            painter.end()
+        if not image.save(filename):
+            raise RuntimeError('could not save screenshot to ' + filename)
+
+    def _bounds(self):
+        # centre and extent of the visible points, padded by the largest
+        # glyph so that discs at the edges are not clipped
+        visible = [(points, size) for points, _, size, shown in self._pointSets.values() if shown and len(points)]
+        if not visible:
+            return None, None
+        lower = np.min([p.min(axis=0) for p, _ in visible], axis=0)
+        upper = np.max([p.max(axis=0) for p, _ in visible], axis=0)
+        extent = (upper - lower).max() + max(size for _, size in visible)
+        return 0.5 * (lower + upper), max(extent, 1e-9) * (1.0 + 2.0 * self.margin)
+
+    def paint(self, painter, rect):
+        painter.fillRect(rect, self.backgroundColour)
+        painter.setRenderHint(QPainter.Antialiasing)
+        cellWidth = rect.width() / 2.0
+        cellHeight = rect.height() / 2.0
+        centre, extent = self._bounds()
+        scale = min(cellWidth, cellHeight) / extent if extent is not None else 1.0
+
+        for (title, horizontal, vertical), (column, row) in zip(self.projections, self.cells):
+            cell = QRectF(rect.left() + column * cellWidth, rect.top() + row * cellHeight, cellWidth, cellHeight)
+            painter.setPen(QPen(self.frameColour))
+            painter.setBrush(Qt.NoBrush)
+            painter.drawRect(cell.adjusted(1, 1, -1, -1))
+            painter.setPen(QPen(self.textColour))
+            painter.drawText(cell.adjusted(6, 4, -6, -4), Qt.AlignLeft | Qt.AlignTop,
+                             '%s (%s, %s)' % (title, self.axisNames[horizontal], self.axisNames[vertical]))
+            if centre is None:
+                continue
+            painter.save()
+            painter.setClipRect(cell)
+            for name, (points, colour, size, visible) in self._pointSets.items():
+                if not visible or not len(points):
+                    continue
+                x = cell.center().x() + (points[:, horizontal] - centre[horizontal]) * scale
+                y = cell.center().y() - (points[:, vertical] - centre[vertical]) * scale
+                self._paintPoints(painter, x, y, colour, max(0.5 * size * scale, self.minimumRadius),
+                                  name == self.selectedName)
+            painter.restore()
+
+        self._paintSelection(painter, QRectF(rect.left() + cellWidth, rect.top() + cellHeight, cellWidth, cellHeight))
+
+    def _paintPoints(self, painter, x, y, colour, radius, selected):
+        if len(x) > self.maxDiscs:
+            painter.setPen(QPen(colour, 2.0 * self.minimumRadius))
+            painter.drawPoints([QPointF(px, py) for px, py in zip(x, y)])
+            return
+        painter.setPen(QPen(self.selectedColour, 2.0) if selected else Qt.NoPen)
+        painter.setBrush(colour)
+        for px, py in zip(x, y):
+            painter.drawEllipse(QPointF(px, py), radius, radius)
+
+    def _paintSelection(self, painter, cell):
+        if self.selectedName not in self._pointSets:
+            return
+        points = self._pointSets[self.selectedName][0]
+        lines = [self.selectedName] + ['%.2f, %.2f, %.2f' % tuple(p) for p in points[:5]]
+        if len(points) > 5:
+            lines.append('%d points' % len(points))
+        painter.setPen(QPen(self.textColour))
+        painter.drawText(cell.adjusted(6, 4, -6, -4), Qt.AlignLeft | Qt.AlignTop, '\n'.join(lines))
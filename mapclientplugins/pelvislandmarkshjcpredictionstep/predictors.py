@@ -0,0 +1,379 @@
+'''
+Registry of hip joint centre (HJC) prediction methods.
+
+Every predictor declares the pelvic landmarks it needs, the population
+classes it has coefficients for, and a batched implementation that works
+on landmarks already aligned to the ISB pelvis anatomic coordinate system
+(x: anterior, y: superior, z: right, origin at the ASIS midpoint).
+
+Batched implementations have the signature
+
+    batchFunc(L, C, covariates) -> (N, 2, 3) array of [left HJC, right HJC]
+
+where L maps each required landmark name to an (N, 3) array, C is an
+(N, m) array of regression coefficients, one row per subject, ordered as
+the predictor's coefficientNames, and covariates maps covariate names to
+(N,) arrays (see covariates.py), possibly empty. Coefficients are gathered
+from a (classes, m) table built at registration, so subjects of different
+population classes can share a batch.
+
+Predictors may also give the derivatives of their HJCs with respect to
+the aligned landmarks,
+
+    jacobianFunc(L, C, covariates) -> (N, 6, 15) array
+
+with rows [left HJC, right HJC] and columns the five hip landmarks in the
+order LASIS, RASIS, LPSIS, RPSIS, PS. Without one, the Jacobian is taken
+by central differences of batchFunc.
+'''
+
+from collections import OrderedDict
+
+from gias3.musculoskeletal import pelvis_hjc_estimation as hjc
+
+import numpy as np
+
+_registry = OrderedDict()
+
+
+class HJCPredictor(object):
+    '''
+    A registered HJC regression method.
+    '''
+
+    def __init__(self, name, landmarks, coefficientNames, coefficients, batchFunc, referenceFunc=None,
+                 covariates=(), jacobianFunc=None):
+        '''
+        name: method name shown in the configuration and viewer.
+        landmarks: names of the hip landmarks required, in the order
+            expected by referenceFunc.
+        coefficientNames: names of the regression coefficients.
+        coefficients: dict of population class to a sequence of coefficient
+            values ordered as coefficientNames.
+        batchFunc: batched implementation, see module docstring.
+        referenceFunc: optional single-subject reference implementation with
+            the gias3 signature f(*landmarks, pop_class).
+        covariates: names of the per-subject covariates the method requires.
+        jacobianFunc: optional analytic Jacobian, see module docstring.
+        '''
+        self.name = name
+        self.landmarks = tuple(landmarks)
+        self.coefficientNames = tuple(coefficientNames)
+        self.popClasses = tuple(coefficients.keys())
+        self.coefficientTable = np.array([coefficients[c] for c in self.popClasses], dtype=float)
+        if self.coefficientTable.shape != (len(self.popClasses), len(self.coefficientNames)):
+            raise ValueError('coefficient table for %s does not match its coefficient names' % name)
+        self.batchFunc = batchFunc
+        self.referenceFunc = referenceFunc
+        self.covariates = tuple(covariates)
+        self.jacobianFunc = jacobianFunc
+
+    def classIndex(self, popClass):
+        try:
+            return self.popClasses.index(popClass)
+        except ValueError:
+            raise RuntimeError('HJC prediction failed, {} does not support population class: {}'.format(
+                self.name, popClass))
+
+    def predict(self, L, popClass, covariates=None):
+        '''
+        Predict left and right HJCs for a batch of aligned landmarks.
+
+        L: dict of landmark name to (N, 3) array in the pelvis anatomic
+            coordinate system.
+        popClass: population class, one of self.popClasses.
+        covariates: optional dict of covariate name to (N,) array.
+
+        Returns an (N, 2, 3) array of [left HJC, right HJC].
+        '''
+        n = len(L[self.landmarks[0]]) if self.landmarks[0] in L else 0
+        return self.predictMixed(L, np.full(n, self.classIndex(popClass), dtype=np.intp), covariates)
+
+    def predictMixed(self, L, classIndices, covariates=None):
+        '''
+        As predict, but with a population class index into self.popClasses
+        per subject.
+        '''
+        missing = [l for l in self.landmarks if l not in L]
+        if missing:
+            raise RuntimeError('HJC prediction failed, missing landmark: ' + missing[0])
+        if covariates is None:
+            covariates = {}
+        missing = [c for c in self.covariates if c not in covariates]
+        if missing:
+            raise RuntimeError('HJC prediction failed, missing covariate: ' + missing[0])
+        return self.batchFunc(L, self.coefficientTable[classIndices], covariates)
+
+    def jacobianMixed(self, L, classIndices, covariates=None, step=1e-3):
+        '''
+        (N, 6, 15) derivatives of the HJCs predicted by predictMixed with
+        respect to the aligned hip landmarks. step is the central
+        difference step used when there is no analytic Jacobian.
+        '''
+        if covariates is None:
+            covariates = {}
+        C = self.coefficientTable[classIndices]
+        if self.jacobianFunc is not None:
+            return self.jacobianFunc(L, C, covariates)
+        n = len(C)
+        J = np.zeros((n, 6, 15))
+        for k, name in enumerate(_JACOBIAN_LANDMARKS):
+            if name not in L:
+                continue
+            for j in range(3):
+                shifted = dict(L)
+                shifted[name] = L[name].copy()
+                shifted[name][:, j] += step
+                forward = self.predictMixed(shifted, classIndices, covariates)
+                shifted[name][:, j] -= 2.0 * step
+                backward = self.predictMixed(shifted, classIndices, covariates)
+                J[:, :, 3 * k + j] = (forward - backward).reshape(n, 6) / (2.0 * step)
+        return J
+
+
+def registerPredictor(predictor, replace=False):
+    '''
+    Add a predictor to the registry. Raises ValueError if a predictor of
+    the same name is already registered, unless replace is True.
+    '''
+    if predictor.name in _registry and not replace:
+        raise ValueError('HJC predictor already registered: ' + predictor.name)
+    _registry[predictor.name] = predictor
+    return predictor
+
+
+def unregisterPredictor(name):
+    del _registry[name]
+
+
+def getPredictor(name):
+    try:
+        return _registry[name]
+    except KeyError:
+        raise RuntimeError('HJC prediction failed, unknown prediction method: ' + name)
+
+
+def predictorNames():
+    return tuple(_registry.keys())
+
+
+def _norm(v):
+    return np.sqrt((v * v).sum(-1))
+
+
+_JACOBIAN_LANDMARKS = ('LASIS', 'RASIS', 'LPSIS', 'RPSIS', 'PS')
+
+
+def _landmarkColumns(name):
+    k = _JACOBIAN_LANDMARKS.index(name)
+    return slice(3 * k, 3 * k + 3)
+
+
+def _pelvisWidthGradient(L, covariates):
+    # (N, 15) derivative of _pelvisWidth, zero where it was measured
+    d = L['LASIS'] - L['RASIS']
+    g = np.zeros((len(d), 15))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        unit = d / _norm(d)[:, np.newaxis]
+    g[:, _landmarkColumns('LASIS')] = unit
+    g[:, _landmarkColumns('RASIS')] = -unit
+    measured = covariates.get('pelvic_width')
+    if measured is not None:
+        g[np.isfinite(measured)] = 0.0
+    return g
+
+
+def _identityColumns(J, row, name):
+    # d(landmark)/d(landmark) for an HJC that moves with a landmark
+    J[:, row:row + 3, _landmarkColumns(name)] += np.eye(3)
+
+
+def _pelvisWidth(L, covariates):
+    # measured pelvic width where given, ASIS-ASIS distance otherwise
+    width = _norm(L['LASIS'] - L['RASIS'])
+    measured = covariates.get('pelvic_width')
+    if measured is not None:
+        width = np.where(np.isfinite(measured), measured, width)
+    return width
+
+
+def _tylkowskiJacobian(L, C, covariates):
+    rd, rm, rp = C[:, 0], C[:, 1], C[:, 2]
+    dW = _pelvisWidthGradient(L, covariates)
+    J = np.zeros((len(C), 6, 15))
+    _identityColumns(J, 0, 'LASIS')
+    _identityColumns(J, 3, 'RASIS')
+    factors = np.stack([-rp, -rd, rm, -rp, -rd, -rm], axis=-1)
+    J += factors[:, :, np.newaxis] * dW[:, np.newaxis, :]
+    return J
+
+
+def _tylkowskiBatch(L, C, covariates):
+    lasis, rasis = L['LASIS'], L['RASIS']
+    rd, rm, rp = C[:, 0], C[:, 1], C[:, 2]
+    D = _pelvisWidth(L, covariates)
+    offset = np.stack([-rp * D, -rd * D, rm * D], axis=-1)
+    hjcs = np.empty((len(D), 2, 3))
+    hjcs[:, 0] = lasis + offset
+    offset[:, 2] *= -1.0
+    hjcs[:, 1] = rasis + offset
+    return hjcs
+
+
+def _bellJacobian(L, C, covariates):
+    rp = C[:, 0]
+    dW = _pelvisWidthGradient(L, covariates)
+    J = np.zeros((len(C), 6, 15))
+    J[:, 0] = -rp[:, np.newaxis] * dW
+    J[:, 3] = -rp[:, np.newaxis] * dW
+    J[:, 0, _landmarkColumns('LASIS').start] += 1.0
+    J[:, 3, _landmarkColumns('RASIS').start] += 1.0
+    for row, asis in ((0, 'LASIS'), (3, 'RASIS')):
+        for axis in (1, 2):
+            J[:, row + axis, _landmarkColumns(asis).start + axis] = 0.5
+            J[:, row + axis, _landmarkColumns('PS').start + axis] = 0.5
+    return J
+
+
+def _bellBatch(L, C, covariates):
+    lasis, rasis, ps = L['LASIS'], L['RASIS'], L['PS']
+    rp, dd, dl = C[:, 0], C[:, 1], C[:, 2]
+    D = _pelvisWidth(L, covariates)
+    hjcs = np.empty((len(D), 2, 3))
+    # antero-posterior from Tylkowski, frontal plane from Andriacchi
+    hjcs[:, 0, 0] = lasis[:, 0] - rp * D
+    hjcs[:, 1, 0] = rasis[:, 0] - rp * D
+    hjcs[:, 0, 1] = 0.5 * (lasis[:, 1] + ps[:, 1]) - dd
+    hjcs[:, 1, 1] = 0.5 * (rasis[:, 1] + ps[:, 1]) - dd
+    hjcs[:, 0, 2] = 0.5 * (lasis[:, 2] + ps[:, 2]) - dl
+    hjcs[:, 1, 2] = 0.5 * (rasis[:, 2] + ps[:, 2]) + dl
+    return hjcs
+
+
+def _seidelJacobian(L, C, covariates):
+    lasis, rasis, lpsis, rpsis, ps = L['LASIS'], L['RASIS'], L['LPSIS'], L['RPSIS'], L['PS']
+    rd, rm, rp = C[:, 0], C[:, 1], C[:, 2]
+    n = len(C)
+    dW = _pelvisWidthGradient(L, covariates)
+    dH = np.zeros((n, 15))
+    dD = np.zeros((n, 15))
+    for asis, psis in (('LASIS', 'LPSIS'), ('RASIS', 'RPSIS')):
+        sy = np.sign(L[asis][:, 1] - ps[:, 1])
+        dH[:, _landmarkColumns(asis).start + 1] += 0.5 * sy
+        dH[:, _landmarkColumns('PS').start + 1] -= 0.5 * sy
+        sx = np.sign(L[asis][:, 0] - L[psis][:, 0])
+        dD[:, _landmarkColumns(asis).start] += 0.5 * sx
+        dD[:, _landmarkColumns(psis).start] -= 0.5 * sx
+    J = np.zeros((n, 6, 15))
+    _identityColumns(J, 0, 'LASIS')
+    _identityColumns(J, 3, 'RASIS')
+    for row, side in ((0, 1.0), (3, -1.0)):
+        J[:, row] -= rp[:, np.newaxis] * dD
+        J[:, row + 1] -= rd[:, np.newaxis] * dH
+        J[:, row + 2] += side * rm[:, np.newaxis] * dW
+    return J
+
+
+def _seidelBatch(L, C, covariates):
+    lasis, rasis, lpsis, rpsis, ps = L['LASIS'], L['RASIS'], L['LPSIS'], L['RPSIS'], L['PS']
+    rd, rm, rp = C[:, 0], C[:, 1], C[:, 2]
+    W = _pelvisWidth(L, covariates)
+    H = 0.5 * (np.abs(lasis[:, 1] - ps[:, 1]) + np.abs(rasis[:, 1] - ps[:, 1]))
+    D = 0.5 * (np.abs(lasis[:, 0] - lpsis[:, 0]) + np.abs(rasis[:, 0] - rpsis[:, 0]))
+    offset = np.stack([-rp * D, -rd * H, rm * W], axis=-1)
+    hjcs = np.empty((len(W), 2, 3))
+    hjcs[:, 0] = lasis + offset
+    offset[:, 2] *= -1.0
+    hjcs[:, 1] = rasis + offset
+    return hjcs
+
+
+def _harringtonJacobian(L, C, covariates):
+    lasis, rasis, lpsis, rpsis = L['LASIS'], L['RASIS'], L['LPSIS'], L['RPSIS']
+    pdx, cx, pwy, cy, pwz, cz = C.T
+    dW = _pelvisWidthGradient(L, covariates)
+    m = 0.5 * (lasis + rasis) - 0.5 * (lpsis + rpsis)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        unit = m / _norm(m)[:, np.newaxis]
+    dPD = np.zeros((len(C), 15))
+    for name, sign in (('LASIS', 0.5), ('RASIS', 0.5), ('LPSIS', -0.5), ('RPSIS', -0.5)):
+        dPD[:, _landmarkColumns(name)] = sign * unit
+    J = np.zeros((len(C), 6, 15))
+    for row in (0, 3):
+        J[:, row] = pdx[:, np.newaxis] * dPD
+        J[:, row + 1] = pwy[:, np.newaxis] * dW
+    J[:, 5] = pwz[:, np.newaxis] * dW
+    J[:, 2] = -J[:, 5]
+    return J
+
+
+def _harringtonBatch(L, C, covariates):
+    lasis, rasis, lpsis, rpsis = L['LASIS'], L['RASIS'], L['LPSIS'], L['RPSIS']
+    pdx, cx, pwy, cy, pwz, cz = C.T
+    PW = _pelvisWidth(L, covariates)
+    PD = _norm(0.5 * (lasis + rasis) - 0.5 * (lpsis + rpsis))
+    hjcs = np.empty((len(PW), 2, 3))
+    hjcs[:, :, 0] = (pdx * PD + cx)[:, np.newaxis]
+    hjcs[:, :, 1] = (pwy * PW + cy)[:, np.newaxis]
+    hjcs[:, 1, 2] = pwz * PW + cz
+    hjcs[:, 0, 2] = -hjcs[:, 1, 2]
+    return hjcs
+
+
+def _haraJacobian(L, C, covariates):
+    # leg length regression, independent of the pelvic landmarks
+    return np.zeros((len(C), 6, 15))
+
+
+def _haraBatch(L, C, covariates):
+    # Hara et al. (2016), HJC from leg length relative to the ASIS midpoint
+    ax, bx, ay, by, az, bz = C.T
+    LL = covariates['leg_length']
+    hjcs = np.empty((len(LL), 2, 3))
+    hjcs[:, :, 0] = (ax + bx * LL)[:, np.newaxis]
+    hjcs[:, :, 1] = (ay + by * LL)[:, np.newaxis]
+    hjcs[:, 1, 2] = az + bz * LL
+    hjcs[:, 0, 2] = -hjcs[:, 1, 2]
+    return hjcs
+
+
+def _coefficients(data, names, popClasses=None):
+    if popClasses is None:
+        popClasses = data.keys()
+    return OrderedDict((c, [data[c][n] for n in names]) for c in popClasses)
+
+
+def _bellCoefficients():
+    tylkowski = hjc._literatureData['Tylkowski']
+    andriacchi = hjc._literatureData['Andriacchi']
+    return OrderedDict((c, [tylkowski[c]['rp'], andriacchi[c]['dd'], andriacchi[c]['dl']])
+                       for c in andriacchi if c in tylkowski)
+
+
+def _registerBuiltins():
+    registerPredictor(HJCPredictor('Seidel', ('LASIS', 'RASIS', 'LPSIS', 'RPSIS', 'PS'),
+                                   ('rd', 'rm', 'rp'),
+                                   _coefficients(hjc._literatureData['Seidel'], ('rd', 'rm', 'rp')),
+                                   _seidelBatch, hjc.HJCSeidel, jacobianFunc=_seidelJacobian))
+    registerPredictor(HJCPredictor('Bell', ('LASIS', 'RASIS', 'PS'),
+                                   ('rp', 'dd', 'dl'),
+                                   _bellCoefficients(),
+                                   _bellBatch, hjc.HJCBell, jacobianFunc=_bellJacobian))
+    registerPredictor(HJCPredictor('Tylkowski', ('LASIS', 'RASIS'),
+                                   ('rd', 'rm', 'rp'),
+                                   _coefficients(hjc._literatureData['Tylkowski'], ('rd', 'rm', 'rp')),
+                                   _tylkowskiBatch, hjc.HJCTylkowski, jacobianFunc=_tylkowskiJacobian))
+    # gias3 only carries Harrington (2007) coefficients in the Bell dataset,
+    # so its HJCHarrington cannot be used as a reference with the default data.
+    registerPredictor(HJCPredictor('Harrington', ('LASIS', 'RASIS', 'LPSIS', 'RPSIS'),
+                                   ('pdx', 'cx', 'pwy', 'cy', 'pwz', 'cz'),
+                                   _coefficients(hjc._literatureDataBell['Harrington'],
+                                                 ('pdx', 'cx', 'pwy', 'cy', 'pwz', 'cz'), ('adults',)),
+                                   _harringtonBatch, jacobianFunc=_harringtonJacobian))
+    registerPredictor(HJCPredictor('Hara', ('LASIS', 'RASIS'),
+                                   ('ax', 'bx', 'ay', 'by', 'az', 'bz'),
+                                   OrderedDict([('adults', [11.0, -0.063, -9.0, -0.078, 8.0, 0.086])]),
+                                   _haraBatch, covariates=('leg_length',), jacobianFunc=_haraJacobian))
+
+
+_registerBuiltins()
@@ -0,0 +1,100 @@
+'''
+Optional cProfile and tracemalloc capture around step methods.
+
+Profiling is enabled by the step's 'Profile' configuration option or by
+setting the PELVISLANDMARKSHJC_PROFILE environment variable to a non-empty
+value other than 0, false or no. Each profiled call writes into the step
+location:
+
+    <label>-<timestamp>.prof            cProfile statistics, for pstats/snakeviz
+    <label>-<timestamp>.tracemalloc     tracemalloc snapshot, for tracemalloc.Snapshot.load
+    <label>-<timestamp>-allocations.txt top allocation sites and peak memory
+
+Nested profiled calls, e.g. predict() run from execute(), are captured by
+the outermost call.
+'''
+
+import cProfile
+import datetime
+import functools
+import logging
+import os
+import tracemalloc
+from contextlib import contextmanager
+
+PROFILE_ENV = 'PELVISLANDMARKSHJC_PROFILE'
+TRACEMALLOC_FRAMES = 25
+TOP_ALLOCATIONS = 50
+
+logger = logging.getLogger(__name__)
+
+_active = False
+
+
+def profilingEnabled(config):
+    env = os.environ.get(PROFILE_ENV, '').strip().lower()
+    if env and env not in ('0', 'false', 'no'):
+        return True
+    return bool(config.get('Profile', False))
+
+
+@contextmanager
+def profile(location, label):
+    '''
+    Profile the enclosed block and dump the results into location.
+    '''
+    global _active
+    if _active:
+        yield
+        return
+
+    _active = True
+    startedTracemalloc = not tracemalloc.is_tracing()
+    if startedTracemalloc:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    tracemalloc.reset_peak()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        if startedTracemalloc:
+            tracemalloc.stop()
+        _active = False
+        _dump(location, label, profiler, snapshot, current, peak)
+
+
+def _dump(location, label, profiler, snapshot, current, peak):
+    if not os.path.isdir(location):
+        os.makedirs(location)
+    stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    base = os.path.join(location, '%s-%s' % (label, stamp))
+    profiler.dump_stats(base + '.prof')
+    snapshot.dump(base + '.tracemalloc')
+    with open(base + '-allocations.txt', 'w') as f:
+        f.write('current: %d bytes\npeak: %d bytes\n\n' % (current, peak))
+        for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]:
+            f.write('%s\n' % stat)
+    logger.info('profile written to %s.prof', base)
+
+
+def profiled(label):
+    '''
+    Decorator for step methods. Profiles the call when profiling is enabled
+    for the step's _config, writing into the step's _location.
+    '''
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not profilingEnabled(self._config):
+                return method(self, *args, **kwargs)
+            with profile(self._location, label):
+                return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,147 @@
+'''
+Progress reporting and cooperative cancellation for batch prediction.
+
+Batch runs call a progress callback with a ProgressEvent after every
+chunk, and check a CancelToken between chunks. A cancelled run stops at
+the next chunk boundary and raises PredictionCancelled carrying the
+results of the chunks already completed.
+'''
+
+import logging
+import signal
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressEvent(object):
+    '''
+    done: subjects completed so far.
+    total: subjects in the run.
+    elapsed: seconds since the run started.
+    throughput: subjects per second so far.
+    eta: estimated seconds remaining, None until a chunk has completed.
+    '''
+
+    def __init__(self, done, total, elapsed):
+        self.done = done
+        self.total = total
+        self.elapsed = elapsed
+        self.throughput = done / elapsed if elapsed > 0 else 0.0
+        self.eta = (total - done) / self.throughput if self.throughput > 0 else None
+
+    @property
+    def fraction(self):
+        return self.done / float(self.total) if self.total else 1.0
+
+    def __str__(self):
+        eta = '?' if self.eta is None else '%.0fs' % self.eta
+        return '%d/%d subjects (%.1f%%), %.0f subjects/s, eta %s' % (
+            self.done, self.total, 100.0 * self.fraction, self.throughput, eta)
+
+
+class CancelToken(object):
+    '''
+    Thread-safe flag requesting that a batch run stops at the next chunk
+    boundary.
+    '''
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+
+class PredictionCancelled(RuntimeError):
+    '''
+    Raised when a batch run is cancelled. hjcs holds the predictions with
+    NaN for subjects that were not reached, completed is an (N,) boolean
+    mask of the subjects that were.
+    '''
+
+    def __init__(self, hjcs, completed):
+        RuntimeError.__init__(self, 'HJC prediction cancelled after %d of %d subjects' % (
+            completed.sum(), len(completed)))
+        self.hjcs = hjcs
+        self.completed = completed
+
+
+class ProgressTracker(object):
+    '''
+    Accumulates completed chunks, possibly from several threads, and
+    forwards a ProgressEvent to the callback after each.
+    '''
+
+    def __init__(self, total, callback=None):
+        self._total = total
+        self._callback = callback
+        self._done = 0
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def update(self, n):
+        with self._lock:
+            self._done += n
+            event = ProgressEvent(self._done, self._total, time.perf_counter() - self._start)
+            if self._callback is not None:
+                self._callback(event)
+        return event
+
+
+class LogProgress(object):
+    '''
+    Progress callback for headless runs that reports at most once per
+    interval seconds, and always on completion. Events are logged at INFO
+    to this module's logger, or written to stream, such as sys.stdout for
+    a command line tool, if one is given.
+    '''
+
+    def __init__(self, interval=5.0, stream=None):
+        self._interval = interval
+        self._stream = stream
+        self._last = None
+
+    def __call__(self, event):
+        now = time.perf_counter()
+        if event.done < event.total and self._last is not None and now - self._last < self._interval:
+            return
+        self._last = now
+        if self._stream is None:
+            logger.info('HJC prediction: %s', event)
+        else:
+            self._stream.write('HJC prediction: %s\n' % event)
+            self._stream.flush()
+
+
+@contextmanager
+def cancelOnInterrupt(token):
+    '''
+    While active, the first Ctrl-C (SIGINT) cancels token instead of
+    interrupting, so a headless run stops cleanly at the next chunk. A
+    second Ctrl-C interrupts as usual. Has no effect outside the main
+    thread, where signal handlers cannot be installed.
+    '''
+    if threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    previous = signal.getsignal(signal.SIGINT)
+
+    def handler(signum, frame):
+        if token.cancelled:
+            signal.default_int_handler(signum, frame)
+        logger.warning('cancelling after the current chunk, interrupt again to abort')
+        token.cancel()
+
+    signal.signal(signal.SIGINT, handler)
+    try:
+        yield
+    finally:
+        signal.signal(signal.SIGINT, previous)
@@ -0,0 +1,136 @@
+'''
+Soak run of the interactive viewer lifecycle.
+
+Drives the step through hundreds of execute, predict and accept cycles
+with Qt on its offscreen platform, as a long interactive session looping
+over subjects would, aborting every so often, and samples the resident
+memory of the process. Reports the growth per cycle after a warm-up, so a
+leak of VTK pipelines or Qt widgets shows up as a steady slope.
+
+Run as
+
+    python -m mapclientplugins.pelvislandmarkshjcpredictionstep.soak --cycles 300 --max-growth 20
+
+which exits with status 1 if memory grew by more than the given number of
+kilobytes per cycle. Needs Qt, Mayavi and a VTK build that can render
+offscreen, or only Qt with --preview, which soaks the 2D preview instead.
+The time the first execution took to open the viewer is reported too.
+'''
+
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import numpy as np
+
+from mapclientplugins.pelvislandmarkshjcpredictionstep.batch import HIPLANDMARKS
+from mapclientplugins.pelvislandmarkshjcpredictionstep.harness import syntheticPelvises
+
+
+def residentMemory():
+    '''
+    Resident set size of this process in bytes, or its peak where the
+    current size is not available.
+    '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _flushEvents(app):
+    from PySide6.QtCore import QCoreApplication, QEvent
+    app.processEvents()
+    # run deleteLater, which otherwise waits for an event loop
+    QCoreApplication.sendPostedEvents(None, QEvent.DeferredDelete)
+    gc.collect()
+
+
+def soakViewer(cycles=300, warmup=20, abortEvery=10, reuseViewer=True, sampleEvery=10, seed=0, preview=False):
+    '''
+    Run cycles of execute, predict and accept through a GUI configured
+    step, aborting every abortEvery cycles (never if 0). preview uses the
+    2D preview in place of the Mayavi viewer.
+
+    Returns a dict of the memory samples (cycle, bytes) taken after warmup,
+    the least squares growth per cycle in bytes, the overall growth and the
+    seconds the first execution took to open the viewer.
+    '''
+    from PySide6.QtWidgets import QApplication
+    from mapclientplugins.pelvislandmarkshjcpredictionstep.step import PelvisLandmarksHJCPredictionStep
+
+    app = QApplication.instance() or QApplication([])
+    step = PelvisLandmarksHJCPredictionStep(tempfile.mkdtemp())
+    step.reuseViewer = reuseViewer
+    step._config['GUI'] = True
+    step._config['2D Preview'] = preview
+    # stand in for the workflow the step would run in
+    step._setCurrentWidget = lambda widget: widget.show()
+    step._doneExecution = lambda: None
+
+    pelvises = syntheticPelvises(cycles + warmup, seed)
+    samples = []
+    openTime = None
+    for cycle in range(cycles + warmup):
+        step.setPortData(0, dict(zip(HIPLANDMARKS, pelvises[cycle])))
+        start = time.perf_counter()
+        step.execute()
+        _flushEvents(app)
+        if openTime is None:
+            openTime = time.perf_counter() - start
+        step._widget._ui.predictButton.click()
+        if abortEvery and cycle % abortEvery == abortEvery - 1:
+            step._widget._abort()
+            try:
+                step._abort()
+            except RuntimeError:
+                pass
+        else:
+            step._widget._ui.acceptButton.click()
+        _flushEvents(app)
+        if cycle >= warmup and (cycle - warmup) % sampleEvery == 0:
+            samples.append((cycle - warmup, residentMemory()))
+    step._releaseWidget()
+    _flushEvents(app)
+    samples.append((cycles, residentMemory()))
+
+    x, y = np.array(samples, dtype=float).T
+    return {'samples': samples,
+            'growthPerCycle': float(np.polyfit(x, y, 1)[0]) if len(samples) > 1 else 0.0,
+            'growth': samples[-1][1] - samples[0][1],
+            'openTime': openTime,
+            }
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Check viewer memory stays bounded over many executions.')
+    parser.add_argument('--cycles', type=int, default=300)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--abort-every', type=int, default=10, help='abort every n cycles, 0 never')
+    parser.add_argument('--release', action='store_true', help='release the viewer on accept too')
+    parser.add_argument('--preview', action='store_true', help='soak the 2D preview rather than the Mayavi viewer')
+    parser.add_argument('--max-growth', type=float, default=None,
+                        help='exit with status 1 if memory grows by more than this (kB) per cycle')
+    options = parser.parse_args(args)
+    result = soakViewer(options.cycles, options.warmup, options.abort_every, not options.release,
+                        preview=options.preview)
+    print('viewer opened in %.2f s' % result['openTime'])
+    for cycle, rss in result['samples']:
+        print('%6d %10.1f MB' % (cycle, rss / 1e6))
+    print('growth %.1f MB over %d cycles, %.1f kB per cycle' % (
+        result['growth'] / 1e6, options.cycles, result['growthPerCycle'] / 1e3))
+    if options.max_growth is not None and result['growthPerCycle'] > options.max_growth * 1e3:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
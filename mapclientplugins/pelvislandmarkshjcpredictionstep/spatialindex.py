@@ -0,0 +1,183 @@
+'''
+Nearest-neighbour index over predicted cohort geometry.
+
+Each subject is described by a feature vector of its hip landmarks and
+HJCs in its ISB pelvis anatomic frame. Only the landmarks the prediction
+method needs are used, so subjects predicted without one the method does
+not read, such as the PS for Tylkowski, are still indexed. Coordinates
+are optionally divided by the subject's ASIS width, so that pelvises of
+similar shape but different size are close.
+Features are standardised per dimension and held in a KD-tree for
+k-nearest-neighbour and radius queries, e.g. for finding subjects that
+resemble a flagged outlier.
+
+scipy is optional: without it queries fall back to a chunked brute-force
+search over the same features.
+'''
+
+import json
+import logging
+import os
+
+import numpy as np
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+from mapclientplugins.pelvislandmarkshjcpredictionstep import predictors
+from mapclientplugins.pelvislandmarkshjcpredictionstep.batch import HIPLANDMARKS, alignPelvisBatch, requiredLandmarks
+from mapclientplugins.pelvislandmarkshjcpredictionstep.landmarkbatch import HJCNAMES
+
+_INDEX_FILE = 'index.json'
+_ARRAYS = ('features', 'rows', 'subjectIds')
+_BRUTE_FORCE_CHUNK = 65536
+
+logger = logging.getLogger(__name__)
+
+
+def alignedFeatures(coords, hjcs, scaled=True, landmarks=HIPLANDMARKS):
+    '''
+    (N, 3 * (len(landmarks) + 2)) raw feature vectors: the named hip
+    landmarks of coords (N, 5, 3), ordered as HIPLANDMARKS, then the
+    (N, 2, 3) HJCs, in the pelvis anatomic frame. With scaled,
+    coordinates are divided by the ASIS width.
+    '''
+    coords = np.asarray(coords, dtype=float)
+    points = np.concatenate([coords[:, [HIPLANDMARKS.index(l) for l in landmarks]],
+                             np.asarray(hjcs, dtype=float)], axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        aligned = alignPelvisBatch(points, *[coords[:, i] for i in range(4)])[0]
+        if scaled:
+            width = np.sqrt(((coords[:, 1] - coords[:, 0]) ** 2).sum(-1))
+            aligned /= width[:, np.newaxis, np.newaxis]
+    return aligned.reshape(len(aligned), -1)
+
+
+class HJCIndex(object):
+    '''
+    features: (M, D) standardised feature vectors of the indexed subjects.
+    rows: (M,) row of each indexed subject in the batch it was built from.
+        Subjects with non-finite features, such as failed predictions, are
+        not indexed.
+    subjectIds: (M,) identifiers of the indexed subjects.
+    mean, scale: per-dimension standardisation of the raw features.
+    scaled: whether raw features are divided by ASIS width.
+    landmarks: the hip landmarks in the features, in HIPLANDMARKS order.
+    '''
+
+    def __init__(self, features, rows, subjectIds, mean, scale, scaled=True, landmarks=HIPLANDMARKS):
+        self.features = features
+        self.rows = rows
+        self.subjectIds = subjectIds
+        self.mean = np.asarray(mean, dtype=float)
+        self.scale = np.asarray(scale, dtype=float)
+        self.scaled = scaled
+        self.landmarks = tuple(landmarks)
+        self._tree = None if cKDTree is None else cKDTree(features)
+
+    @classmethod
+    def fromBatch(cls, landmarkBatch, scaled=True, method=None):
+        '''
+        Index a LandmarkBatch whose names are HIPLANDMARKS, as provided on
+        the step's batch port. The features hold the landmarks method
+        needs, by default the method in the batch metadata, or all five
+        if it has none.
+        '''
+        if method is None:
+            method = landmarkBatch.metadata.get('method')
+        landmarks = HIPLANDMARKS if method is None else requiredLandmarks(predictors.getPredictor(method))
+        raw = alignedFeatures(landmarkBatch.coords[:, [landmarkBatch.index(l) for l in HIPLANDMARKS]],
+                              landmarkBatch.hjcs, scaled, landmarks)
+        rows = np.flatnonzero(np.isfinite(raw).all(axis=1))
+        if len(rows) < len(raw):
+            logger.warning('%d of %d subjects have non-finite features and are not indexed',
+                           len(raw) - len(rows), len(raw))
+        raw = raw[rows]
+        mean = raw.mean(axis=0) if len(raw) else np.zeros(raw.shape[1])
+        scale = raw.std(axis=0) if len(raw) else np.ones(raw.shape[1])
+        # constant dimensions, e.g. the ASIS in their own frame
+        scale[scale < 1e-12] = 1.0
+        return cls((raw - mean) / scale, rows, np.asarray(landmarkBatch.subjectIds)[rows], mean, scale, scaled,
+                   landmarks)
+
+    def __len__(self):
+        return len(self.features)
+
+    def transform(self, coords, hjcs):
+        '''
+        Standardised features of (N, 5, 3) hip landmarks and (N, 2, 3) HJCs,
+        for querying with subjects outside the index.
+        '''
+        return (alignedFeatures(coords, hjcs, self.scaled, self.landmarks) - self.mean) / self.scale
+
+    def query(self, features, k=1):
+        '''
+        The k nearest indexed subjects to each of (Q, D) standardised
+        feature vectors. Returns (Q, k) distances and (Q, k) positions in
+        the index, map through rows or subjectIds.
+        '''
+        features = np.atleast_2d(features)
+        k = min(k, len(self))
+        if self._tree is not None:
+            distances, indices = self._tree.query(features, k)
+            return distances.reshape(len(features), k), indices.reshape(len(features), k)
+        distances = np.empty((len(features), k))
+        indices = np.empty((len(features), k), dtype=np.intp)
+        for q, f in enumerate(features):
+            d = self._bruteForceDistances(f)
+            nearest = np.argpartition(d, k - 1)[:k] if k < len(d) else np.arange(len(d))
+            nearest = nearest[np.argsort(d[nearest])]
+            distances[q], indices[q] = d[nearest], nearest
+        return distances, indices
+
+    def queryRadius(self, features, r):
+        '''
+        Positions in the index of the subjects within distance r of each
+        of (Q, D) standardised feature vectors, one array per query.
+        '''
+        features = np.atleast_2d(features)
+        if self._tree is not None:
+            return [np.array(sorted(i), dtype=np.intp) for i in self._tree.query_ball_point(features, r)]
+        return [np.flatnonzero(self._bruteForceDistances(f) <= r) for f in features]
+
+    def querySubject(self, position, k=1):
+        '''
+        The k nearest neighbours of an indexed subject, excluding itself.
+        '''
+        distances, indices = self.query(self.features[position], k + 1)
+        keep = indices[0] != position
+        return distances[0][keep][:k], indices[0][keep][:k]
+
+    def _bruteForceDistances(self, f):
+        d = np.empty(len(self.features))
+        for start in range(0, len(self.features), _BRUTE_FORCE_CHUNK):
+            chunk = self.features[start:start + _BRUTE_FORCE_CHUNK]
+            d[start:start + _BRUTE_FORCE_CHUNK] = np.sqrt(((chunk - f) ** 2).sum(axis=1))
+        return d
+
+    def save(self, path):
+        '''
+        Write the index to directory path. The tree is rebuilt from the
+        features on load.
+        '''
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for name in _ARRAYS:
+            np.save(os.path.join(path, name + '.npy'), getattr(self, name), allow_pickle=False)
+        with open(os.path.join(path, _INDEX_FILE), 'w') as f:
+            json.dump({'points': self.landmarks + HJCNAMES,
+                       'mean': self.mean.tolist(),
+                       'scale': self.scale.tolist(),
+                       'scaled': self.scaled,
+                       }, f, indent=4, sort_keys=True)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        with open(os.path.join(path, _INDEX_FILE)) as f:
+            index = json.load(f)
+        features, rows, subjectIds = [np.load(os.path.join(path, name + '.npy'), mmap_mode='r' if mmap else None)
+                                      for name in _ARRAYS]
+        landmarks = tuple(p for p in index['points'] if p in HIPLANDMARKS)
+        return cls(features, rows, subjectIds, index['mean'], index['scale'], index['scaled'], landmarks)
@@ -3,19 +3,33 @@ MAP Client Plugin Step
 '''
 
 import json
+import logging
+import os
+import time
 
 from mapclient.mountpoints.workflowstep import WorkflowStepMountPoint
-from mapclientplugins.pelvislandmarkshjcpredictionstep.configuredialog import ConfigureDialog
-from mapclientplugins.pelvislandmarkshjcpredictionstep.hjcpredictionviewerwidget import MayaviHJCPredictionViewerWidget
-
-from gias3.musculoskeletal import pelvis_hjc_estimation as hjc
-from gias3.musculoskeletal import model_alignment as ma
+from mapclientplugins.pelvislandmarkshjcpredictionstep import predictors
+from mapclientplugins.pelvislandmarkshjcpredictionstep import configschema
+from mapclientplugins.pelvislandmarkshjcpredictionstep import covariates
+from mapclientplugins.pelvislandmarkshjcpredictionstep.profiling import profiled
+from mapclientplugins.pelvislandmarkshjcpredictionstep.landmarkbatch import LandmarkBatch
+from mapclientplugins.pelvislandmarkshjcpredictionstep import batch
+from mapclientplugins.pelvislandmarkshjcpredictionstep.batch import HIPLANDMARKS
+from mapclientplugins.pelvislandmarkshjcpredictionstep import frames
+from mapclientplugins.pelvislandmarkshjcpredictionstep import progress
+from mapclientplugins.pelvislandmarkshjcpredictionstep import jacobian
+from mapclientplugins.pelvislandmarkshjcpredictionstep import cohortinput
+from mapclientplugins.pelvislandmarkshjcpredictionstep.checkpoint import Checkpoint, inputKey
+from mapclientplugins.pelvislandmarkshjcpredictionstep.job import CohortJob
 
 import numpy as np
 
-METHODS = ('Seidel', 'Bell', 'Tylkowski')
-POP_CLASS = ('adults', 'men', 'women')
-HIPLANDMARKS = ('LASIS', 'RASIS', 'LPSIS', 'RPSIS', 'PS')
+CHECKPOINT_FILE = 'checkpoint.npz'
+CHECKPOINT_INTERVAL = 30.0
+JOB_DIRECTORY = 'job'
+INDEX_DIRECTORY = 'hjcindex'
+
+logger = logging.getLogger(__name__)
 
 
 class PelvisLandmarksHJCPredictionStep(WorkflowStepMountPoint):
@@ -23,6 +37,9 @@ class PelvisLandmarksHJCPredictionStep(WorkflowStepMountPoint):
     Skeleton step which is intended to be a helpful starting point
     for new steps.
     '''
+    # keep the viewer between executions, redrawing only the landmarks that
+    # changed, set False to release it on accept as well as on abort
+    reuseViewer = True
 
     def __init__(self, location):
         super(PelvisLandmarksHJCPredictionStep, self).__init__('Pelvis Landmark HJC Prediction', location)
@@ -36,24 +53,45 @@ class PelvisLandmarksHJCPredictionStep(WorkflowStepMountPoint):
         self.addPort(('http://physiomeproject.org/workflow/1.0/rdf-schema#port',
                       'http://physiomeproject.org/workflow/1.0/rdf-schema#provides',
                       'python#dict'))
-        self._config = {}
-        self._config['identifier'] = ''
-        self._config['Prediction Method'] = METHODS[0]
-        self._config['Population Class'] = POP_CLASS[0]
-        self._config['GUI'] = True
-        for l in HIPLANDMARKS:
-            self._config[l] = l
+        self.addPort(('http://physiomeproject.org/workflow/1.0/rdf-schema#port',
+                      'http://physiomeproject.org/workflow/1.0/rdf-schema#provides',
+                      'ju#landmarkbatch'))
+        self._config = dict(configschema.defaultConfig())
 
         self._landmarks = None
         self._hipLandmarks = None
         self._hipLandmarksAligned = None
+        self._T = None
+        self._inverseT = None
+        self._widget = None
+        self._cohortWidget = None
+        self._batch = None
+        self._index = None
+        self._jacobian = None
+        self._progressCallback = None
+        self._cancelToken = progress.CancelToken()
 
+    @profiled('execute')
     def execute(self):
         '''
         Add your code here that will kick off the execution of the step.
         Make sure you call the _doneExecution() method when finished.  This method
         may be connected up to a button in a widget for example.
         '''
+        self._batch = None
+        self._jacobian = None
+        invalid = configschema.invalidKeys(self._config)
+        if invalid:
+            raise RuntimeError('HJC prediction failed, invalid configuration: ' + ', '.join(invalid))
+        if self._isCohort():
+            try:
+                self._executeCohort(self._cancelToken)
+            finally:
+                # the token is replaced only once a run is over, so that a
+                # cancel() made before the run got going is not lost
+                self._cancelToken = progress.CancelToken()
+            return
+
         self._landmarks['HJC_left'] = np.array([0, 0, 0], dtype=float)
         self._landmarks['HJC_right'] = np.array([0, 0, 0], dtype=float)
         self._getHipLandmarks()
@@ -65,80 +103,297 @@ class PelvisLandmarksHJCPredictionStep(WorkflowStepMountPoint):
         self._hipLandmarksAligned['HJC_right'] = np.array([0, 0, 0], dtype=float)
 
         if self._config['GUI']:
-            print('launching prediction gui')
-            self._widget = MayaviHJCPredictionViewerWidget(self._landmarks,
-                                                           self._config,
-                                                           self.predict,
-                                                           METHODS,
-                                                           POP_CLASS)
-            self._widget._ui.acceptButton.clicked.connect(self._doneExecution)
-            self._widget._ui.abortButton.clicked.connect(self._abort)
-            self._widget.setModal(True)
+            logger.debug('launching prediction gui')
+            viewerClass = self._viewerClass()
+            if self._widget is not None and not isinstance(self._widget, viewerClass):
+                self._releaseWidget()
+            if self._widget is None:
+                start = time.perf_counter()
+                self._widget = viewerClass(self._landmarks,
+                                           self._config,
+                                           self.predict,
+                                           predictors.predictorNames())
+                logger.debug('%s opened in %.3f s', viewerClass.__name__, time.perf_counter() - start)
+                self._widget._ui.acceptButton.clicked.connect(self._viewerAccepted)
+                self._widget._ui.abortButton.clicked.connect(self._abort)
+                self._widget.setModal(True)
+            else:
+                # reuse the scene, redrawing only landmarks that changed
+                self._widget.reload(self._landmarks, self._config)
             self._setCurrentWidget(self._widget)
         else:
             self.predict()
             self._doneExecution()
 
+    def _viewerClass(self):
+        # imported here so that headless runs do not need Qt or Mayavi, and
+        # the 2D preview does not need Mayavi
+        if self._config.get('2D Preview'):
+            from mapclientplugins.pelvislandmarkshjcpredictionstep.hjcpreviewwidget import HJCPreviewWidget
+            return HJCPreviewWidget
+        from mapclientplugins.pelvislandmarkshjcpredictionstep.hjcpredictionviewerwidget import \
+            MayaviHJCPredictionViewerWidget
+        return MayaviHJCPredictionViewerWidget
+
+    def _isCohort(self):
+        # a dict of subject landmark dicts rather than of landmark coordinates
+        return bool(self._landmarks) and all(isinstance(v, dict) for v in self._landmarks.values())
+
+    def _executeCohort(self, cancelToken):
+        subjectIds = [str(s) for s in self._landmarks.keys()]
+        subjects = list(self._landmarks.values())
+        faultTolerant = bool(self._config.get('Fault Tolerant'))
+        # with Deduplicate Subjects only the first subject of each distinct
+        # landmark set is predicted, and the run arrays, checkpoints and
+        # jobs are over those
+        cohort = cohortinput.prepareCohort(subjects, self._config)
+        coords, errors, duplicates = cohort.coords, cohort.errors, cohort.duplicates
+        runCoords, runCovariates, runErrors = cohort.runCoords, cohort.runCovariates, cohort.runErrors
+        logger.info('predicting %d subjects using %s (%s)', len(subjects), self._config['Prediction Method'],
+                    self._config['Population Class'])
+        outputFrames = self._outputFrames()
+        progressCallback = self._progressCallback
+        if progressCallback is None and not self._config['GUI']:
+            progressCallback = progress.LogProgress()
+
+        frameHJCs = np.empty((len(runCoords), 1 + len(outputFrames), 2, 3))
+        completed = np.zeros(len(runCoords), dtype=bool)
+        checkpoint = None
+        if self._config.get('Resumable Job'):
+            # chunked results and a manifest, kept after the run completes,
+            # keyed on every subject's inputs so that a change of the
+            # deduplication settings is refused as a configuration change
+            checkpoint = CohortJob(os.path.join(self._location, JOB_DIRECTORY),
+                                   inputKey(coords, cohort.covariates), json.loads(self.serialize()),
+                                   frameHJCs, runErrors, completed)
+        elif faultTolerant:
+            # resume an interrupted run over the same inputs and settings
+            key = inputKey(runCoords, runCovariates, json.dumps(self._batchMetadata(), sort_keys=True) +
+                           self._config.get('Output Frames', ''))
+            checkpoint = Checkpoint(os.path.join(self._location, CHECKPOINT_FILE), key,
+                                    frameHJCs, runErrors, completed, CHECKPOINT_INTERVAL)
+        if checkpoint is not None:
+            resumed = checkpoint.resume()
+            if resumed:
+                logger.info('resuming from %s, %d subjects already predicted', checkpoint.path, resumed)
+        cancelled = None
+        predictStart = time.perf_counter()
+        with progress.cancelOnInterrupt(cancelToken):
+            try:
+                batch.predictBatch(runCoords, self._config['Prediction Method'],
+                                   self._config['Population Class'],
+                                   covariates=runCovariates,
+                                   chunkSize=int(self._config.get('Chunk Size', batch.DEFAULT_CHUNK_SIZE)),
+                                   workers=int(self._config.get('Workers', 1)),
+                                   frames=('input',) + outputFrames,
+                                   progress=progressCallback,
+                                   cancel=cancelToken,
+                                   errors=runErrors,
+                                   out=frameHJCs,
+                                   completed=completed,
+                                   checkpoint=checkpoint,
+                                   fused=bool(self._config.get('Fused Kernel')))
+            except progress.PredictionCancelled as e:
+                cancelled = e
+        predictSeconds = time.perf_counter() - predictStart
+        if isinstance(checkpoint, Checkpoint):
+            if cancelled is None:
+                checkpoint.clear()
+            else:
+                checkpoint.save()
+        frameHJCs = cohort.scatter(frameHJCs)
+        completed = cohort.scatter(completed)
+        if errors is not None:
+            errors[:] = cohort.scatter(runErrors)
+
+        if errors is None:
+            errors = np.zeros(len(subjects), dtype=np.int8)
+        for s, h, c, e, i in zip(subjects, frameHJCs, completed, errors, cohort.imputed):
+            if not c:
+                continue
+            if e:
+                s['HJC_error'] = batch.ERROR_MESSAGES[e]
+                continue
+            if i.any():
+                s['HJC_imputed'] = [self._config[l] for l, imputedLandmark in zip(HIPLANDMARKS, i) if imputedLandmark]
+            s['HJC_left'], s['HJC_right'] = h[0]
+            for f, hf in zip(outputFrames, h[1:]):
+                s['HJC_left_' + f], s['HJC_right_' + f] = hf
+        metadata = self._batchMetadata()
+        metadata['completed'] = int(completed.sum())
+        metadata['failed'] = batch.errorSummary(errors[completed])
+        metadata['completeness'] = cohort.completeness
+        if duplicates is not None:
+            metadata['deduplication'] = duplicates.report(predictSeconds)
+            logger.info('deduplication ratio %.2f, %d of %d subjects predicted, about %.2f s saved',
+                        duplicates.ratio, len(duplicates), duplicates.subjects,
+                        metadata['deduplication']['savedSeconds'])
+        if metadata['failed']:
+            logger.warning('%d subjects could not be predicted: %s', sum(metadata['failed'].values()),
+                           ', '.join('%s (%d)' % item for item in metadata['failed'].items()))
+        self._batch = LandmarkBatch(HIPLANDMARKS, coords, frameHJCs[:, 0], subjectIds, metadata,
+                                    dict((f, frameHJCs[:, i + 1]) for i, f in enumerate(outputFrames)),
+                                    errors)
+
+        if cancelled is not None:
+            # keep what was computed, then stop the workflow as an abort would
+            partialPath = os.path.join(self._location, 'cancelled')
+            self._batch.save(partialPath)
+            raise RuntimeError('%s, partial results saved to %s' % (cancelled, partialPath))
+
+        if self._config.get('HJC Jacobian'):
+            self._batch.jacobians = cohort.scatter(jacobian.jacobianBatch(
+                runCoords, self._config['Prediction Method'], self._config['Population Class'], runCovariates)[1])
+            self._batch.jacobians[self._batch.failed] = np.nan
+
+        if self._config.get('Spatial Index'):
+            from mapclientplugins.pelvislandmarkshjcpredictionstep.spatialindex import HJCIndex
+            self._index = HJCIndex.fromBatch(self._batch)
+            self._index.save(os.path.join(self._location, INDEX_DIRECTORY))
+            self._batch.metadata['index'] = INDEX_DIRECTORY
+
+        if self._config['GUI']:
+            # imported here so that headless cohort runs do not need Mayavi
+            from mapclientplugins.pelvislandmarkshjcpredictionstep.cohortbrowser import CohortBrowserWidget
+            self._releaseCohortWidget()
+            self._cohortWidget = CohortBrowserWidget(self._batch.names, self._batch.coords, self._batch.hjcs,
+                                                     self._batch.subjectIds,
+                                                     plainPoints=bool(self._config.get('Plain Cohort Points')))
+            # finished is emitted on Close, Esc and closing the window alike
+            self._cohortWidget.finished.connect(self._cohortClosed)
+            self._setCurrentWidget(self._cohortWidget)
+        else:
+            self._doneExecution()
+
+    def _batchMetadata(self):
+        return {'method': self._config['Prediction Method'],
+                'populationClass': self._config['Population Class'],
+                'subjectCovariates': bool(self._config.get('Subject Covariates')),
+                'landmarks': dict((l, self._config[l]) for l in HIPLANDMARKS),
+                'frame': 'input',
+                }
+
+    def _outputFrames(self):
+        # HJCs are always output in the input frame, extra frames are suffixed
+        return tuple(f for f in frames.parseFrameNames(self._config.get('Output Frames', '')) if f != 'input')
+
+    def setProgressCallback(self, callback):
+        '''
+        Set a callable receiving a progress.ProgressEvent after each chunk
+        of a cohort run. Headless runs log progress when none is set.
+        '''
+        self._progressCallback = callback
+
+    def cancel(self):
+        '''
+        Request that a running cohort prediction stops after the current
+        chunk, or that the next stops before its first chunk if none is
+        running yet. May be called from any thread.
+        '''
+        self._cancelToken.cancel()
+
+    def _viewerAccepted(self):
+        if not self.reuseViewer:
+            self._releaseWidget()
+        self._doneExecution()
+
+    def _cohortClosed(self):
+        if self._cohortWidget is None:
+            # finished again as release closes a browser still on display
+            return
+        self._releaseCohortWidget()
+        self._doneExecution()
+
     def _abort(self):
+        self._releaseWidget()
         raise RuntimeError('HJC Prediction Aborted')
 
+    def _releaseWidget(self):
+        # free the viewer's VTK pipelines, render window and Qt widgets, or
+        # the preview's
+        if self._widget is not None:
+            self._widget.release()
+            self._widget = None
+
+    def _releaseCohortWidget(self):
+        if self._cohortWidget is not None:
+            cohortWidget, self._cohortWidget = self._cohortWidget, None
+            cohortWidget.release()
+
     def _getHipLandmarks(self):
+        # only the landmarks of the alignment and the configured method are
+        # needed
+        required = batch.requiredLandmarks(predictors.getPredictor(self._config['Prediction Method']))
         self._hipLandmarks = {}
         for l in HIPLANDMARKS:
             lname = self._config[l]
             try:
                 self._hipLandmarks[l] = self._landmarks[lname]
             except KeyError:
-                raise RuntimeError('HJC prediction failed, missing landmark: ' + lname)
+                if l in required:
+                    raise RuntimeError('HJC prediction failed, missing landmark: ' + lname)
 
     def _alignHipCS(self):
-        # align landmarks to hip CS
+        # align landmarks to hip CS, keeping the (1, 4, 4) transforms for
+        # mapping predictions into the output frames
         hipLandmarks = list(self._hipLandmarks.items())
         landmarkNames = [l[0] for l in hipLandmarks]
-        landmarkCoords = np.array([l[1] for l in hipLandmarks])
-        landmarkCoordsAligned, alignT = ma.alignAnatomicPelvis(landmarkCoords,
-                                                               self._hipLandmarks['LASIS'],
-                                                               self._hipLandmarks['RASIS'],
-                                                               self._hipLandmarks['LPSIS'],
-                                                               self._hipLandmarks['RPSIS'],
-                                                               return_t=True)
-        self._hipLandmarksAligned = dict(list(zip(landmarkNames, landmarkCoordsAligned)))
-        self._inverseT = np.linalg.inv(np.vstack([alignT, [0, 0, 0, 1]]))
+        landmarkCoords = np.array([l[1] for l in hipLandmarks], dtype=float)[np.newaxis]
+        landmarkCoordsAligned, self._T, self._inverseT = batch.alignPelvisBatch(
+            landmarkCoords, *[np.asarray(self._hipLandmarks[l], dtype=float)[np.newaxis] for l in HIPLANDMARKS[:4]])
+        self._hipLandmarksAligned = dict(list(zip(landmarkNames, landmarkCoordsAligned[0])))
 
+    @profiled('predict')
     def predict(self):
         # run predictions methods
-        print('predicting using %s (%s)' % (self._config['Prediction Method'],
-                                            self._config['Population Class'],
-                                            ))
-        if self._config['Prediction Method'] == 'Seidel':
-            self._predict(('LASIS', 'RASIS', 'LPSIS', 'RPSIS', 'PS'), hjc.HJCSeidel)
-        elif self._config['Prediction Method'] == 'Tylkowski':
-            self._predict(('LASIS', 'RASIS'), hjc.HJCTylkowski)
-        elif self._config['Prediction Method'] == 'Bell':
-            self._predict(('LASIS', 'RASIS', 'PS'), hjc.HJCBell)
-
-    def _predict(self, reqLandmarks, predictor):
-        L = []
-        for l in reqLandmarks:
+        logger.info('predicting using %s (%s)', self._config['Prediction Method'], self._config['Population Class'])
+        self._predict(predictors.getPredictor(self._config['Prediction Method']))
+
+    def _predict(self, predictor):
+        L = {}
+        for l in predictor.landmarks:
             try:
-                L.append(self._hipLandmarksAligned[l])
+                L[l] = self._hipLandmarksAligned[l][np.newaxis]
             except KeyError:
                 raise RuntimeError('HJC prediction failed, missing landmark: ' + l)
-        L.append(self._config['Population Class'])
-        predictions = np.array(predictor(*L)[:2])
+        subjectCovariates = covariates.gatherCovariates([self._landmarks])
+        for c in predictor.covariates:
+            if not np.isfinite(subjectCovariates[c][0]):
+                raise RuntimeError('HJC prediction failed, missing covariate: ' + c)
+        if self._config.get('Subject Covariates'):
+            classIndices = covariates.classIndices(subjectCovariates, predictor.popClasses,
+                                                   self._config['Population Class'])
+        else:
+            classIndices = [predictor.classIndex(self._config['Population Class'])]
+            subjectCovariates = dict((c, subjectCovariates[c]) for c in predictor.covariates)
+        predictions = predictor.predictMixed(L, classIndices, subjectCovariates)[0]
 
         self._hipLandmarksAligned['HJC_left'] = predictions[0]
         self._hipLandmarksAligned['HJC_right'] = predictions[1]
+        if logger.isEnabledFor(logging.DEBUG):
+            for name in sorted(self._hipLandmarksAligned):
+                logger.debug('%s in pelvis frame: %s', name, self._hipLandmarksAligned[name])
+
+        # input frame first, then any extra output frames, in one product
+        outputFrames = self._outputFrames()
+        hipLandmarks = dict((l, np.asarray(self._hipLandmarks[l], dtype=float)[np.newaxis])
+                            for l in HIPLANDMARKS if l in self._hipLandmarks)
+        M = frames.frameTransforms(('input',) + outputFrames, hipLandmarks, self._T, self._inverseT,
+                                   predictions[np.newaxis])
+        frameHJCs = frames.transformToFrames(predictions[np.newaxis], M)[0]
 
         self._hipLandmarks['HJC_left'], \
-        self._hipLandmarks['HJC_right'] = ma.transform3D.transformAffine(predictions, self._inverseT)
+        self._hipLandmarks['HJC_right'] = frameHJCs[0]
         self._landmarks['HJC_left'], \
-        self._landmarks['HJC_right'] = ma.transform3D.transformAffine(predictions, self._inverseT)
+        self._landmarks['HJC_right'] = frameHJCs[0]
+        for f, hf in zip(outputFrames, frameHJCs[1:]):
+            self._landmarks['HJC_left_' + f], self._landmarks['HJC_right_' + f] = hf
 
-        # self._hipLandmarks['HJC_left'] = ma.transform3D.transformAffine( [predictions[0],], self._inverseT )
-        # self._hipLandmarks['HJC_right'] = ma.transform3D.transformAffine( [predictions[1],], self._inverseT )
-        # self._landmarks['HJC_left'] = ma.transform3D.transformAffine( [predictions[0],], self._inverseT )
-        # self._landmarks['HJC_right'] = ma.transform3D.transformAffine( [predictions[1],], self._inverseT )
+        if self._config.get('HJC Jacobian'):
+            coords = np.array([hipLandmarks[l][0] if l in hipLandmarks else np.full(3, np.nan)
+                               for l in HIPLANDMARKS])[np.newaxis]
+            self._jacobian = jacobian.jacobianBatch(coords, predictor.name, self._config['Population Class'],
+                                                    subjectCovariates or None)[1]
 
     def setPortData(self, index, dataIn):
         '''
@@ -154,8 +409,20 @@ class PelvisLandmarksHJCPredictionStep(WorkflowStepMountPoint):
         The index is the index of the port in the port list.  If there is only one
         provides port for this step then the index can be ignored.
         '''
+        if index == 2:
+            return self._getBatch()  # ju#landmarkbatch
         return self._landmarks  # ju#landmarks
 
+    def _getBatch(self):
+        if self._batch is None and self._landmarks is not None:
+            self._batch = LandmarkBatch.fromDicts([self._landmarks], HIPLANDMARKS,
+                                                  [self._config['identifier']],
+                                                  self._batchMetadata(),
+                                                  [self._config[l] for l in HIPLANDMARKS],
+                                                  self._outputFrames(), allowMissing=True)
+            self._batch.jacobians = self._jacobian
+        return self._batch
+
     def configure(self):
         '''
         This function will be called when the configure icon on the step is
@@ -164,7 +431,8 @@ class PelvisLandmarksHJCPredictionStep(WorkflowStepMountPoint):
         then set:
             self._configured = True
         '''
-        dlg = ConfigureDialog(METHODS, POP_CLASS, self._main_window)
+        from mapclientplugins.pelvislandmarkshjcpredictionstep.configuredialog import ConfigureDialog
+        dlg = ConfigureDialog(predictors.predictorNames(), self._main_window)
         dlg.identifierOccursCount = self._identifierOccursCount
         dlg.setConfig(self._config)
         dlg.validate()
@@ -173,7 +441,7 @@ class PelvisLandmarksHJCPredictionStep(WorkflowStepMountPoint):
         if dlg.exec_():
             self._config = dlg.getConfig()
 
-        self._configured = dlg.validate()
+        self._configured = configschema.isValid(self._config, self._identifierOccursCount)
         self._configuredObserver()
 
     def getIdentifier(self):
@@ -201,8 +469,4 @@ class PelvisLandmarksHJCPredictionStep(WorkflowStepMountPoint):
         given by mapclient
         '''
         self._config.update(json.loads(string))
-
-        d = ConfigureDialog(METHODS, POP_CLASS)
-        d.identifierOccursCount = self._identifierOccursCount
-        d.setConfig(self._config)
-        self._configured = d.validate()
+        self._configured = configschema.isValid(self._config, self._identifierOccursCount)
@@ -16,9 +16,9 @@ from PySide6.QtGui import (QBrush, QColor, QConicalGradient, QCursor,
     QImage, QKeySequence, QLinearGradient, QPainter,
     QPalette, QPixmap, QRadialGradient, QTransform)
 from PySide6.QtWidgets import (QAbstractButton, QApplication, QCheckBox, QComboBox,
-    QDialog, QDialogButtonBox, QFormLayout, QGridLayout,
-    QGroupBox, QLabel, QLineEdit, QSizePolicy,
-    QWidget)
+    QDialog, QDialogButtonBox, QDoubleSpinBox, QFormLayout,
+    QGridLayout, QGroupBox, QLabel, QLineEdit,
+    QSizePolicy, QSpinBox, QWidget)
 
 class Ui_Dialog(object):
     def setupUi(self, Dialog):
@@ -128,6 +128,164 @@ class Ui_Dialog(object):
 
         self.formLayout.setWidget(8, QFormLayout.FieldRole, self.checkBoxGUI)
 
+        self.label_8 = QLabel(self.configGroupBox)
+        self.label_8.setObjectName(u"label_8")
+
+        self.formLayout.setWidget(9, QFormLayout.LabelRole, self.label_8)
+
+        self.checkBoxCovariates = QCheckBox(self.configGroupBox)
+        self.checkBoxCovariates.setObjectName(u"checkBoxCovariates")
+
+        self.formLayout.setWidget(9, QFormLayout.FieldRole, self.checkBoxCovariates)
+
+        self.label_9 = QLabel(self.configGroupBox)
+        self.label_9.setObjectName(u"label_9")
+
+        self.formLayout.setWidget(10, QFormLayout.LabelRole, self.label_9)
+
+        self.checkBoxProfile = QCheckBox(self.configGroupBox)
+        self.checkBoxProfile.setObjectName(u"checkBoxProfile")
+
+        self.formLayout.setWidget(10, QFormLayout.FieldRole, self.checkBoxProfile)
+
+        self.label_10 = QLabel(self.configGroupBox)
+        self.label_10.setObjectName(u"label_10")
+
+        self.formLayout.setWidget(11, QFormLayout.LabelRole, self.label_10)
+
+        self.lineEditFrames = QLineEdit(self.configGroupBox)
+        self.lineEditFrames.setObjectName(u"lineEditFrames")
+
+        self.formLayout.setWidget(11, QFormLayout.FieldRole, self.lineEditFrames)
+
+        self.label_11 = QLabel(self.configGroupBox)
+        self.label_11.setObjectName(u"label_11")
+
+        self.formLayout.setWidget(12, QFormLayout.LabelRole, self.label_11)
+
+        self.checkBoxFaultTolerant = QCheckBox(self.configGroupBox)
+        self.checkBoxFaultTolerant.setObjectName(u"checkBoxFaultTolerant")
+
+        self.formLayout.setWidget(12, QFormLayout.FieldRole, self.checkBoxFaultTolerant)
+
+        self.label_12 = QLabel(self.configGroupBox)
+        self.label_12.setObjectName(u"label_12")
+
+        self.formLayout.setWidget(13, QFormLayout.LabelRole, self.label_12)
+
+        self.checkBoxJob = QCheckBox(self.configGroupBox)
+        self.checkBoxJob.setObjectName(u"checkBoxJob")
+
+        self.formLayout.setWidget(13, QFormLayout.FieldRole, self.checkBoxJob)
+
+        self.label_13 = QLabel(self.configGroupBox)
+        self.label_13.setObjectName(u"label_13")
+
+        self.formLayout.setWidget(14, QFormLayout.LabelRole, self.label_13)
+
+        self.checkBoxIndex = QCheckBox(self.configGroupBox)
+        self.checkBoxIndex.setObjectName(u"checkBoxIndex")
+
+        self.formLayout.setWidget(14, QFormLayout.FieldRole, self.checkBoxIndex)
+
+        self.label_14 = QLabel(self.configGroupBox)
+        self.label_14.setObjectName(u"label_14")
+
+        self.formLayout.setWidget(15, QFormLayout.LabelRole, self.label_14)
+
+        self.checkBoxImpute = QCheckBox(self.configGroupBox)
+        self.checkBoxImpute.setObjectName(u"checkBoxImpute")
+
+        self.formLayout.setWidget(15, QFormLayout.FieldRole, self.checkBoxImpute)
+
+        self.label_15 = QLabel(self.configGroupBox)
+        self.label_15.setObjectName(u"label_15")
+
+        self.formLayout.setWidget(16, QFormLayout.LabelRole, self.label_15)
+
+        self.checkBoxPreview = QCheckBox(self.configGroupBox)
+        self.checkBoxPreview.setObjectName(u"checkBoxPreview")
+
+        self.formLayout.setWidget(16, QFormLayout.FieldRole, self.checkBoxPreview)
+
+        self.label_16 = QLabel(self.configGroupBox)
+        self.label_16.setObjectName(u"label_16")
+
+        self.formLayout.setWidget(17, QFormLayout.LabelRole, self.label_16)
+
+        self.spinBoxChunkSize = QSpinBox(self.configGroupBox)
+        self.spinBoxChunkSize.setObjectName(u"spinBoxChunkSize")
+        self.spinBoxChunkSize.setMinimum(1)
+        self.spinBoxChunkSize.setMaximum(16777216)
+        self.spinBoxChunkSize.setSingleStep(1024)
+
+        self.formLayout.setWidget(17, QFormLayout.FieldRole, self.spinBoxChunkSize)
+
+        self.label_17 = QLabel(self.configGroupBox)
+        self.label_17.setObjectName(u"label_17")
+
+        self.formLayout.setWidget(18, QFormLayout.LabelRole, self.label_17)
+
+        self.spinBoxWorkers = QSpinBox(self.configGroupBox)
+        self.spinBoxWorkers.setObjectName(u"spinBoxWorkers")
+        self.spinBoxWorkers.setMinimum(1)
+        self.spinBoxWorkers.setMaximum(256)
+
+        self.formLayout.setWidget(18, QFormLayout.FieldRole, self.spinBoxWorkers)
+
+        self.label_18 = QLabel(self.configGroupBox)
+        self.label_18.setObjectName(u"label_18")
+
+        self.formLayout.setWidget(19, QFormLayout.LabelRole, self.label_18)
+
+        self.checkBoxPlainPoints = QCheckBox(self.configGroupBox)
+        self.checkBoxPlainPoints.setObjectName(u"checkBoxPlainPoints")
+
+        self.formLayout.setWidget(19, QFormLayout.FieldRole, self.checkBoxPlainPoints)
+
+        self.label_19 = QLabel(self.configGroupBox)
+        self.label_19.setObjectName(u"label_19")
+
+        self.formLayout.setWidget(20, QFormLayout.LabelRole, self.label_19)
+
+        self.checkBoxFused = QCheckBox(self.configGroupBox)
+        self.checkBoxFused.setObjectName(u"checkBoxFused")
+
+        self.formLayout.setWidget(20, QFormLayout.FieldRole, self.checkBoxFused)
+
+        self.label_20 = QLabel(self.configGroupBox)
+        self.label_20.setObjectName(u"label_20")
+
+        self.formLayout.setWidget(21, QFormLayout.LabelRole, self.label_20)
+
+        self.checkBoxJacobian = QCheckBox(self.configGroupBox)
+        self.checkBoxJacobian.setObjectName(u"checkBoxJacobian")
+
+        self.formLayout.setWidget(21, QFormLayout.FieldRole, self.checkBoxJacobian)
+
+        self.label_21 = QLabel(self.configGroupBox)
+        self.label_21.setObjectName(u"label_21")
+
+        self.formLayout.setWidget(22, QFormLayout.LabelRole, self.label_21)
+
+        self.checkBoxDedup = QCheckBox(self.configGroupBox)
+        self.checkBoxDedup.setObjectName(u"checkBoxDedup")
+
+        self.formLayout.setWidget(22, QFormLayout.FieldRole, self.checkBoxDedup)
+
+        self.label_22 = QLabel(self.configGroupBox)
+        self.label_22.setObjectName(u"label_22")
+
+        self.formLayout.setWidget(23, QFormLayout.LabelRole, self.label_22)
+
+        self.doubleSpinBoxTolerance = QDoubleSpinBox(self.configGroupBox)
+        self.doubleSpinBoxTolerance.setObjectName(u"doubleSpinBoxTolerance")
+        self.doubleSpinBoxTolerance.setDecimals(4)
+        self.doubleSpinBoxTolerance.setMaximum(1000.0)
+        self.doubleSpinBoxTolerance.setSingleStep(0.01)
+
+        self.formLayout.setWidget(23, QFormLayout.FieldRole, self.doubleSpinBoxTolerance)
+
 
         self.gridLayout.addWidget(self.configGroupBox, 0, 0, 1, 1)
 
@@ -150,5 +308,31 @@ class Ui_Dialog(object):
         self.label_6.setText(QCoreApplication.translate("Dialog", u"Pubis Symphysis:", None))
         self.label_7.setText(QCoreApplication.translate("Dialog", u"GUI:", None))
         self.checkBoxGUI.setText("")
+        self.label_8.setText(QCoreApplication.translate("Dialog", u"Subject Covariates:", None))
+        self.checkBoxCovariates.setText("")
+        self.label_9.setText(QCoreApplication.translate("Dialog", u"Profile:", None))
+        self.checkBoxProfile.setText("")
+        self.label_10.setText(QCoreApplication.translate("Dialog", u"Output Frames:", None))
+        self.label_11.setText(QCoreApplication.translate("Dialog", u"Fault Tolerant:", None))
+        self.checkBoxFaultTolerant.setText("")
+        self.label_12.setText(QCoreApplication.translate("Dialog", u"Resumable Job:", None))
+        self.checkBoxJob.setText("")
+        self.label_13.setText(QCoreApplication.translate("Dialog", u"Spatial Index:", None))
+        self.checkBoxIndex.setText("")
+        self.label_14.setText(QCoreApplication.translate("Dialog", u"Impute Landmarks:", None))
+        self.checkBoxImpute.setText("")
+        self.label_15.setText(QCoreApplication.translate("Dialog", u"2D Preview:", None))
+        self.checkBoxPreview.setText("")
+        self.label_16.setText(QCoreApplication.translate("Dialog", u"Chunk Size:", None))
+        self.label_17.setText(QCoreApplication.translate("Dialog", u"Workers:", None))
+        self.label_18.setText(QCoreApplication.translate("Dialog", u"Plain Cohort Points:", None))
+        self.checkBoxPlainPoints.setText("")
+        self.label_19.setText(QCoreApplication.translate("Dialog", u"Fused Kernel:", None))
+        self.checkBoxFused.setText("")
+        self.label_20.setText(QCoreApplication.translate("Dialog", u"HJC Jacobian:", None))
+        self.checkBoxJacobian.setText("")
+        self.label_21.setText(QCoreApplication.translate("Dialog", u"Deduplicate Subjects:", None))
+        self.checkBoxDedup.setText("")
+        self.label_22.setText(QCoreApplication.translate("Dialog", u"Duplicate Tolerance:", None))
     # retranslateUi
 
@@ -0,0 +1,118 @@
+'''
+Controls shared by the single subject viewers.
+
+HJCViewerControls holds what the Mayavi viewer and the 2D preview have in
+common, the prediction method, population class and landmark comboboxes,
+the screenshot fields and the button connections, and needs only Qt.
+Subclasses set up a Ui_Dialog with the same widget names and provide the
+table, drawing, predict, reset, accept and abort behaviour.
+'''
+
+import logging
+
+from PySide6.QtWidgets import QDialog
+from PySide6.QtGui import QIntValidator
+
+from mapclientplugins.pelvislandmarkshjcpredictionstep import predictors
+
+logger = logging.getLogger(__name__)
+
+
+class HJCViewerControls(QDialog):
+    objectTableHeaderColumns = {'landmarks': 0}
+
+    def _setupGui(self):
+        self._ui.screenshotPixelXLineEdit.setValidator(QIntValidator())
+        self._ui.screenshotPixelYLineEdit.setValidator(QIntValidator())
+        self._populateLandmarkComboBoxes()
+
+        for m in self._predMethods:
+            self._ui.comboBoxPredMethod.addItem(m)
+
+        self._populatePopClasses()
+
+    def _landmarkComboBoxes(self):
+        return (('LASIS', self._ui.comboBoxLASIS), ('RASIS', self._ui.comboBoxRASIS),
+                ('LPSIS', self._ui.comboBoxLPSIS), ('RPSIS', self._ui.comboBoxRPSIS), ('PS', self._ui.comboBoxPS))
+
+    def _populateLandmarkComboBoxes(self):
+        for _, comboBox in self._landmarkComboBoxes():
+            comboBox.clear()
+            comboBox.addItems(self._landmarkNames)
+
+    def _populatePopClasses(self):
+        # population classes come from the selected method's registry entry
+        popClasses = predictors.getPredictor(self._config['Prediction Method']).popClasses
+        self._ui.comboBoxPopClass.clear()
+        for p in popClasses:
+            self._ui.comboBoxPopClass.addItem(p)
+        if self._config['Population Class'] not in popClasses:
+            self._config['Population Class'] = popClasses[0]
+        self._ui.comboBoxPopClass.setCurrentIndex(popClasses.index(self._config['Population Class']))
+
+    def _makeConnections(self):
+        self._ui.tableWidget.itemClicked.connect(self._tableItemClicked)
+        self._ui.tableWidget.itemChanged.connect(self._visibleBoxChanged)
+        self._ui.screenshotSaveButton.clicked.connect(self._saveScreenShot)
+        self._ui.predictButton.clicked.connect(self._predict)
+        self._ui.resetButton.clicked.connect(self._reset)
+        self._ui.abortButton.clicked.connect(self._abort)
+        self._ui.acceptButton.clicked.connect(self._accept)
+
+        self._ui.comboBoxPredMethod.activated.connect(self._updateConfigPredMethod)
+        self._ui.comboBoxPopClass.activated.connect(self._updateConfigPopClass)
+        self._ui.comboBoxLASIS.activated.connect(self._updateConfigLASIS)
+        self._ui.comboBoxRASIS.activated.connect(self._updateConfigRASIS)
+        self._ui.comboBoxLPSIS.activated.connect(self._updateConfigLPSIS)
+        self._ui.comboBoxRPSIS.activated.connect(self._updateConfigRPSIS)
+        self._ui.comboBoxPS.activated.connect(self._updateConfigPS)
+
+    def _initialiseSettings(self):
+        self._ui.comboBoxPredMethod.setCurrentIndex(self._predMethods.index(self._config['Prediction Method']))
+        self._populatePopClasses()
+        for l, comboBox in self._landmarkComboBoxes():
+            if self._config[l] in self._landmarkNames:
+                comboBox.setCurrentIndex(self._landmarkNames.index(self._config[l]))
+            else:
+                comboBox.setCurrentIndex(0)
+
+    def _tableItemClicked(self):
+        selectedRow = self._ui.tableWidget.currentRow()
+        self.selectedObjectName = self._ui.tableWidget.item(
+            selectedRow,
+            self.objectTableHeaderColumns['landmarks']
+        ).text()
+        logger.debug('selected row %d: %s', selectedRow, self.selectedObjectName)
+
+    def _getSelectedObjectName(self):
+        return self.selectedObjectName
+
+    def _getSelectedScalarName(self):
+        return 'none'
+
+    def _screenshotSettings(self):
+        # filename, width and height from the screenshot fields
+        return (self._ui.screenshotFilenameLineEdit.text(), int(self._ui.screenshotPixelXLineEdit.text()),
+                int(self._ui.screenshotPixelYLineEdit.text()))
+
+    def _updateConfigPredMethod(self):
+        self._config['Prediction Method'] = self._ui.comboBoxPredMethod.currentText()
+        self._populatePopClasses()
+
+    def _updateConfigPopClass(self):
+        self._config['Population Class'] = self._ui.comboBoxPopClass.currentText()
+
+    def _updateConfigLASIS(self):
+        self._config['LASIS'] = self._ui.comboBoxLASIS.currentText()
+
+    def _updateConfigRASIS(self):
+        self._config['RASIS'] = self._ui.comboBoxRASIS.currentText()
+
+    def _updateConfigLPSIS(self):
+        self._config['LPSIS'] = self._ui.comboBoxLPSIS.currentText()
+
+    def _updateConfigRPSIS(self):
+        self._config['RPSIS'] = self._ui.comboBoxRPSIS.currentText()
+
+    def _updateConfigPS(self):
+        self._config['PS'] = self._ui.comboBoxPS.currentText()
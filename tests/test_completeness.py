@@ -0,0 +1,127 @@
+import warnings
+
+import numpy as np
+import pytest
+
+from mapclientplugins.pelvislandmarkshjcpredictionstep import completeness
+from mapclientplugins.pelvislandmarkshjcpredictionstep.completeness import PelvisShapeModel
+from mapclientplugins.pelvislandmarkshjcpredictionstep.harness import syntheticPelvises
+
+from .test_step import cohort, makeStep
+
+
+def posedCohort(n, modeScale, seed=0):
+    # pelvises varying along two shape modes, in random poses
+    rng = np.random.default_rng(seed)
+    modes = rng.normal(0.0, modeScale, (2, 5, 3))
+    shapes = syntheticPelvises(1, seed)[0] + np.einsum('nk,kij->nij', rng.normal(size=(n, 2)), modes)
+    q = rng.normal(size=(n, 4))
+    q /= np.linalg.norm(q, axis=1)[:, np.newaxis]
+    w, x, y, z = q.T
+    R = np.stack([1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w),
+                  2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w),
+                  2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)], axis=1).reshape(n, 3, 3)
+    return np.einsum('nij,nmj->nmi', R, shapes) + rng.normal(0.0, 100.0, (n, 1, 3))
+
+
+def withoutPS(coords):
+    coords = coords.copy()
+    coords[:, 4] = np.nan
+    present = np.ones((len(coords), 5), dtype=bool)
+    present[:, 4] = False
+    return coords, present
+
+
+def rmsError(a, b):
+    return np.sqrt((((a - b) ** 2).sum(-1)).mean())
+
+
+def test_rigid_copies_are_imputed_exactly():
+    coords = posedCohort(30, 0.0)
+    model = PelvisShapeModel.fit(coords[:20])
+    filled, imputed = model.impute(*withoutPS(coords[20:]))
+    np.testing.assert_allclose(filled, coords[20:], atol=1e-9)
+    assert imputed[:, 4].all() and not imputed[:, :4].any()
+
+
+def test_shape_modes_improve_on_the_mean_shape():
+    coords = posedCohort(120, 3.0, seed=1)
+    target, present = withoutPS(coords[100:])
+    meanError = rmsError(PelvisShapeModel.fit(coords[:100], modes=0).impute(target, present)[0][:, 4],
+                         coords[100:, 4])
+    modeError = rmsError(PelvisShapeModel.fit(coords[:100]).impute(target, present)[0][:, 4], coords[100:, 4])
+    assert modeError < 0.25 * meanError
+
+
+def test_imputation_converges_with_iterations():
+    # filled landmarks take the pose of the latest shape, so more
+    # iterations keep bringing them closer
+    coords = posedCohort(120, 3.0, seed=1)
+    model = PelvisShapeModel.fit(coords[:100])
+    target, present = withoutPS(coords[100:])
+    errors = [rmsError(model.impute(target, present, iterations=i)[0][:, 4], coords[100:, 4]) for i in (0, 1, 3, 10)]
+    assert errors == sorted(errors, reverse=True) and errors[-1] < 0.25
+
+
+@pytest.mark.parametrize('subjects', [1, 2, 4])
+def test_degenerate_cohort_gives_a_mean_shape_model(subjects):
+    coords = np.repeat(syntheticPelvises(1, seed=5), subjects, axis=0)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        model = PelvisShapeModel.fit(coords)
+        filled, imputed = model.impute(*withoutPS(coords))
+    assert len(model.variances) == 0
+    np.testing.assert_allclose(filled, coords, atol=1e-9)
+    assert imputed[:, 4].all()
+
+
+def test_too_few_landmarks_are_left_alone():
+    coords = posedCohort(10, 0.0)
+    model = PelvisShapeModel.fit(coords)
+    target, present = withoutPS(coords)
+    target[:2, :2] = np.nan
+    present[:2, :2] = False
+    filled, imputed = model.impute(target, present, subjects=np.arange(10) != 5)
+    assert np.isnan(filled[:2]).any(axis=(1, 2)).all() and not imputed[:2].any()
+    assert np.isnan(filled[5, 4]).all() and not imputed[5].any()
+    np.testing.assert_allclose(filled[6:], coords[6:], atol=1e-9)
+
+
+def test_fit_needs_complete_subjects():
+    with pytest.raises(RuntimeError, match='no complete subjects'):
+        PelvisShapeModel.fit(np.full((3, 5, 3), np.nan))
+
+
+def test_completeness_report():
+    present = np.ones((4, 5), dtype=bool)
+    present[1, 4] = False
+    present[2, 0] = False
+    assert list(completeness.usableSubjects(present, 'Tylkowski')) == [True, True, False, True]
+    assert list(completeness.usableSubjects(present, 'Seidel')) == [True, False, False, True]
+    report = completeness.completenessReport(present, 'Tylkowski')
+    assert (report['complete'], report['usable']) == (2, 3)
+    assert report['missing'] == {'LASIS': 1, 'PS': 1}
+
+
+def test_step_imputes_and_records_imputed_landmarks(tmpdir):
+    _, subjects = cohort(30, seed=2)
+    del subjects['s004']['PS']
+    step = makeStep(tmpdir, **{'Impute Landmarks': True})
+    step.setPortData(0, subjects)
+    step.execute()
+    assert subjects['s004']['HJC_imputed'] == ['PS']
+    assert all('HJC_imputed' not in s for k, s in subjects.items() if k != 's004')
+    assert step.getPortData(2).metadata['completeness']['usableAfterImputation'] == 30
+
+
+def test_step_without_imputation_names_the_missing_landmark(tmpdir):
+    _, subjects = cohort(5, seed=3)
+    del subjects['s001']['PS']
+    step = makeStep(tmpdir)
+    step.setPortData(0, subjects)
+    with pytest.raises(RuntimeError, match='missing landmark: PS'):
+        step.execute()
+    step = makeStep(tmpdir, **{'Prediction Method': 'Tylkowski'})
+    step.setPortData(0, subjects)
+    step.execute()
+    assert 'HJC_left' in subjects['s001']
@@ -0,0 +1,53 @@
+import pytest
+
+from mapclientplugins.pelvislandmarkshjcpredictionstep import configschema
+
+
+def test_default_config_is_valid():
+    assert configschema.invalidKeys(configschema.defaultConfig()) == []
+
+
+def test_missing_keys_are_invalid_in_schema_order():
+    config = configschema.defaultConfig()
+    del config['Workers']
+    del config['GUI']
+    assert configschema.invalidKeys(config) == ['GUI', 'Workers']
+
+
+@pytest.mark.parametrize('key, value', [
+    ('Prediction Method', 'Nobody'),
+    ('Population Class', 'children'),
+    ('Output Frames', 'nowhere'),
+    ('Chunk Size', 0),
+    ('Workers', 2.5),
+    ('Duplicate Tolerance', -1.0),
+    ('Duplicate Tolerance', True),
+    ('Fault Tolerant', 'yes'),
+    ('LASIS', ''),
+])
+def test_invalid_values(key, value):
+    config = configschema.defaultConfig()
+    config[key] = value
+    assert key in configschema.invalidKeys(config)
+
+
+def test_unknown_method_invalidates_population_class():
+    config = configschema.defaultConfig()
+    config['Prediction Method'] = 'Nobody'
+    assert configschema.invalidKeys(config) == ['Prediction Method', 'Population Class']
+
+
+def test_hara_population_class():
+    config = configschema.defaultConfig()
+    config['Prediction Method'] = 'Hara'
+    config['Population Class'] = 'adults'
+    assert configschema.isValid(config)
+
+
+def test_identifier_must_be_unused_or_its_own():
+    config = configschema.defaultConfig()
+    config['identifier'] = 'hjc'
+    assert configschema.isValid(config, lambda identifier: 0)
+    assert configschema.isValid(config, lambda identifier: 1)
+    assert not configschema.isValid(config, lambda identifier: 1, previousIdentifier='other')
+    assert not configschema.isValid(config, lambda identifier: 2)
@@ -0,0 +1,55 @@
+import pytest
+
+from mapclientplugins.pelvislandmarkshjcpredictionstep import configschema
+from mapclientplugins.pelvislandmarkshjcpredictionstep import predictors
+
+WIDGETS = [
+    ('Chunk Size', 'spinBoxChunkSize', 4096),
+    ('Workers', 'spinBoxWorkers', 4),
+    ('Plain Cohort Points', 'checkBoxPlainPoints', True),
+    ('Fused Kernel', 'checkBoxFused', True),
+    ('HJC Jacobian', 'checkBoxJacobian', True),
+    ('Deduplicate Subjects', 'checkBoxDedup', True),
+    ('Duplicate Tolerance', 'doubleSpinBoxTolerance', 0.5),
+]
+
+
+def makeDialog():
+    pytest.importorskip('PySide6')
+    from PySide6.QtWidgets import QApplication
+    QApplication.instance() or QApplication([])
+    from mapclientplugins.pelvislandmarkshjcpredictionstep.configuredialog import ConfigureDialog
+    dialog = ConfigureDialog(predictors.predictorNames())
+    dialog.identifierOccursCount = lambda identifier: 0
+    return dialog
+
+
+def widgetValue(widget):
+    return widget.isChecked() if hasattr(widget, 'isChecked') else widget.value()
+
+
+def setWidgetValue(widget, value):
+    widget.setChecked(value) if hasattr(widget, 'isChecked') else widget.setValue(value)
+
+
+@pytest.mark.parametrize('key, name, value', WIDGETS)
+def test_set_config_shows_option(key, name, value):
+    dialog = makeDialog()
+    config = configschema.defaultConfig()
+    config['identifier'] = 'hjc'
+    config[key] = value
+    dialog.setConfig(config)
+    assert widgetValue(getattr(dialog._ui, name)) == value
+    assert dialog.getConfig() == config
+    assert dialog.validate()
+
+
+@pytest.mark.parametrize('key, name, value', WIDGETS)
+def test_get_config_reads_widget(key, name, value):
+    dialog = makeDialog()
+    config = configschema.defaultConfig()
+    config['identifier'] = 'hjc'
+    dialog.setConfig(config)
+    assert dialog.getConfig()[key] == config[key]
+    setWidgetValue(getattr(dialog._ui, name), value)
+    assert dialog.getConfig()[key] == value
@@ -0,0 +1,101 @@
+import logging
+
+import numpy as np
+import pytest
+
+from mapclientplugins.pelvislandmarkshjcpredictionstep import dedup
+from mapclientplugins.pelvislandmarkshjcpredictionstep.batch import predictBatch
+from mapclientplugins.pelvislandmarkshjcpredictionstep.dedup import DuplicateIndex
+from mapclientplugins.pelvislandmarkshjcpredictionstep.harness import syntheticPelvises
+
+from .test_step import cohort, hjcs, makeStep
+
+
+def repeated(n, copies, seed=0):
+    # n distinct pelvises, each repeated copies times, shuffled
+    coords = np.repeat(syntheticPelvises(n, seed), copies, axis=0)
+    return coords[np.random.default_rng(seed).permutation(len(coords))]
+
+
+def test_round_trip_matches_full_prediction():
+    coords = repeated(30, 4)
+    index = DuplicateIndex.fromLandmarks(coords)
+    assert (len(index), index.subjects, index.ratio) == (30, 120, 4.0)
+    np.testing.assert_array_equal(index.scatter(index.gather(coords)), coords)
+    assert list(index.representatives) == sorted(index.representatives)
+    np.testing.assert_array_equal(index.scatter(predictBatch(index.gather(coords), 'Seidel', 'adults')),
+                                  predictBatch(coords, 'Seidel', 'adults'))
+
+
+def test_signed_zeros_and_nans_are_one_key():
+    coords = np.zeros((3, 5, 3))
+    coords[1, 0, 0] = -0.0
+    coords[:, 4] = np.nan
+    coords[2, 4, 0] = np.float64(np.nan) * -1.0
+    assert len(DuplicateIndex.fromLandmarks(coords)) == 1
+
+
+def test_covariates_and_errors_split_keys():
+    coords = repeated(1, 4)
+    covariates = {'leg_length': np.array([900.0, 900.0, 910.0, 900.0])}
+    errors = np.array([0, 0, 0, 3], dtype=np.int8)
+    index = DuplicateIndex.fromLandmarks(coords, covariates=covariates, errors=errors)
+    assert list(index.inverse) == [0, 0, 1, 2]
+    assert list(index.gather(covariates)['leg_length']) == [900.0, 910.0, 900.0]
+
+
+def test_tolerance_merges_close_sets():
+    coords = syntheticPelvises(5, seed=1)
+    coords = np.concatenate([coords, coords + 1e-4])
+    assert len(DuplicateIndex.fromLandmarks(coords)) == 10
+    index = DuplicateIndex.fromLandmarks(coords, tolerance=1.0)
+    assert list(index.inverse) == [0, 1, 2, 3, 4] * 2
+
+
+def test_hash_collisions_fall_back_to_exact_keys(monkeypatch):
+    coords = repeated(10, 3, seed=2)
+    expected = DuplicateIndex.fromLandmarks(coords)
+    monkeypatch.setattr(dedup, '_hashKeys', lambda bits: np.zeros(len(bits), dtype=np.uint64))
+    index = DuplicateIndex.fromLandmarks(coords)
+    np.testing.assert_array_equal(index.representatives, expected.representatives)
+    np.testing.assert_array_equal(index.inverse, expected.inverse)
+
+
+def test_report():
+    report = DuplicateIndex(np.arange(2), np.array([0, 1, 0, 1]), hashSeconds=0.5).report(2.0)
+    assert (report['subjects'], report['unique'], report['ratio']) == (4, 2, 2.0)
+    assert report['savedSeconds'] == 1.5
+
+
+def test_step_results_do_not_depend_on_deduplication(tmpdir):
+    _, subjects = cohort(8, seed=3)
+    for i in range(8, 16):
+        subjects['s%03d' % i] = dict(subjects['s%03d' % (i - 8)])
+    step = makeStep(tmpdir, **{'Deduplicate Subjects': True})
+    step.setPortData(0, subjects)
+    step.execute()
+    deduplicated = hjcs(subjects)
+    assert step.getPortData(2).metadata['deduplication']['unique'] == 8
+    step._config['Deduplicate Subjects'] = False
+    step.execute()
+    np.testing.assert_array_equal(hjcs(subjects), deduplicated)
+
+
+def test_resumable_job_refuses_a_deduplication_toggle(tmpdir, caplog):
+    _, subjects = cohort(8, seed=4)
+    subjects.update(('t%03d' % i, dict(s)) for i, s in enumerate(list(subjects.values())))
+    step = makeStep(tmpdir, **{'Resumable Job': True, 'Deduplicate Subjects': True, 'Chunk Size': 2})
+    step.setPortData(0, subjects)
+    step.execute()
+    chunks = tmpdir.join('job').listdir(lambda p: p.basename.startswith('chunk_'))
+    step._config['Deduplicate Subjects'] = False
+    with pytest.raises(RuntimeError, match='Deduplicate Subjects'):
+        step.execute()
+    assert tmpdir.join('job').listdir(lambda p: p.basename.startswith('chunk_')) == chunks
+
+    # other inputs start the job over, saying so
+    _, others = cohort(4, seed=5)
+    step.setPortData(0, others)
+    with caplog.at_level(logging.WARNING):
+        step.execute()
+    assert 'discarding its 8 completed subjects' in caplog.text
@@ -0,0 +1,76 @@
+import json
+
+import numpy as np
+import pytest
+
+from mapclientplugins.pelvislandmarkshjcpredictionstep import distributed
+from mapclientplugins.pelvislandmarkshjcpredictionstep.batch import predictBatch, ERROR_MISSING_LANDMARK
+from mapclientplugins.pelvislandmarkshjcpredictionstep.harness import syntheticPelvises
+
+from .test_step import cohort, makeStep
+
+
+def test_merge_matches_in_process_run(tmpdir):
+    coords = syntheticPelvises(25, seed=1)
+    root = str(tmpdir.join('job'))
+    assert distributed.submitJob(root, coords, 'Seidel', 'adults', frames=('pelvis',), chunkSize=4) == 7
+    assert distributed.runWorker(root, maxChunks=3) == 3
+    with pytest.raises(RuntimeError, match='4 of 7 chunks missing'):
+        distributed.mergeResults(root)
+    assert distributed.runWorker(root) == 4
+    assert distributed.status(root)['done'] == 7
+    hjcs, errors = distributed.mergeResults(root)
+    np.testing.assert_array_equal(hjcs, predictBatch(coords, 'Seidel', 'adults', frames=('input', 'pelvis')))
+    assert not errors.any()
+
+
+def test_failed_chunk_is_requeued(tmpdir):
+    coords = syntheticPelvises(4, seed=2)
+    root = str(tmpdir.join('job'))
+    distributed.submitJob(root, coords, 'Seidel', 'adults', chunkSize=4, maxAttempts=1)
+    np.save(str(tmpdir.join('job', 'input', 'coords.npy')), coords[:, :2])
+    distributed.runWorker(root)
+    assert distributed.status(root)['failed'] == 1
+    np.save(str(tmpdir.join('job', 'input', 'coords.npy')), coords)
+    assert distributed.requeue(root, failed=True) == ['00000000']
+    distributed.runWorker(root)
+    np.testing.assert_array_equal(distributed.mergeResults(root)[0][:, 0], predictBatch(coords, 'Seidel', 'adults'))
+
+
+def test_cohort_matches_step(tmpdir):
+    # imputation, missing landmarks and duplicates are handled as in the step
+    _, subjects = cohort(20, seed=3, leg_length=np.linspace(800.0, 990.0, 20))
+    del subjects['s003']['PS']
+    for l in ('LASIS', 'RASIS', 'PS'):
+        del subjects['s004'][l]
+    for i in range(10, 20):
+        subjects['s%03d' % i] = dict(subjects['s%03d' % (i - 10)])
+    config = {'Prediction Method': 'Seidel', 'Fault Tolerant': True, 'Impute Landmarks': True,
+              'Deduplicate Subjects': True, 'Output Frames': 'pelvis'}
+
+    root = str(tmpdir.join('job'))
+    distributed.submitCohort(root, list(subjects.values()), config, chunkSize=3)
+    with open(str(tmpdir.join('job', 'spec.json'))) as f:
+        assert json.load(f)['subjects'] == 10
+    distributed.runWorker(root)
+    merged = distributed.mergeBatch(root, list(subjects))
+
+    step = makeStep(tmpdir.mkdir('step'), **config)
+    step.setPortData(0, subjects)
+    step.execute()
+    expected = step.getPortData(2)
+    np.testing.assert_array_equal(merged.errors, expected.errors)
+    assert list(np.flatnonzero(merged.errors)) == [4, 14]
+    assert merged.errors[4] == ERROR_MISSING_LANDMARK
+    np.testing.assert_array_equal(merged.coords, expected.coords)
+    np.testing.assert_array_equal(merged.hjcs, expected.hjcs)
+    np.testing.assert_array_equal(merged.frames['pelvis'], expected.frames['pelvis'])
+    assert merged.metadata['completeness'] == expected.metadata['completeness']
+    assert merged.metadata['deduplication']['unique'] == 10
+
+
+def test_cohort_missing_landmark_raises_unless_fault_tolerant(tmpdir):
+    _, subjects = cohort(3, seed=4)
+    del subjects['s001']['PS']
+    with pytest.raises(RuntimeError, match='missing landmark: PS'):
+        distributed.submitCohort(str(tmpdir.join('job')), list(subjects.values()), {'Prediction Method': 'Seidel'})
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from mapclientplugins.pelvislandmarkshjcpredictionstep import frames
+from mapclientplugins.pelvislandmarkshjcpredictionstep.batch import predictBatch
+from mapclientplugins.pelvislandmarkshjcpredictionstep.harness import syntheticPelvises
+
+
+def rotationAboutZ(angle):
+    c, s = np.cos(angle), np.sin(angle)
+    return np.array([[c, -s, 0.0], [s, c, 0.0], [0.0, 0.0, 1.0]])
+
+
+def test_builtin_frames_registered():
+    assert frames.frameNames() == ('input', 'pelvis', 'femoral_left', 'femoral_right', 'lab')
+
+
+def test_femoral_frames_are_pelvis_axes_at_each_hjc():
+    coords = syntheticPelvises(6, seed=3)
+    hjcs = predictBatch(coords, 'Seidel', 'adults', frames=('pelvis', 'femoral_left', 'femoral_right'))
+    pelvis, left, right = np.moveaxis(hjcs, 1, 0)
+    np.testing.assert_allclose(left[:, 0], 0.0, atol=1e-9)
+    np.testing.assert_allclose(right[:, 1], 0.0, atol=1e-9)
+    np.testing.assert_allclose(left[:, 1], pelvis[:, 1] - pelvis[:, 0], atol=1e-9)
+    np.testing.assert_allclose(right[:, 0], pelvis[:, 0] - pelvis[:, 1], atol=1e-9)
+
+
+def test_lab_frame_is_vertical_and_follows_heading():
+    coords = syntheticPelvises(6, seed=4)
+    hjcs = predictBatch(coords, 'Seidel', 'adults', frames=('input', 'lab'))
+    # y is the input's vertical, and turning the subject about it leaves
+    # the lab frame HJCs as they are
+    np.testing.assert_allclose(hjcs[:, 1, :, 1], hjcs[:, 0, :, 2], atol=1e-9)
+    turned = np.einsum('ij,nkj->nki', rotationAboutZ(0.7), coords)
+    np.testing.assert_allclose(predictBatch(turned, 'Seidel', 'adults', frames=('lab',))[:, 0], hjcs[:, 1],
+                               atol=1e-9)
+
+
+def test_lab_frame_with_other_vertical():
+    coords = syntheticPelvises(4, seed=5)
+    frames.registerFrame('lab_y', frames.labFrame(up=(0, 1, 0)))
+    try:
+        hjcs = predictBatch(coords, 'Seidel', 'adults', frames=('input', 'lab_y'))
+    finally:
+        frames.unregisterFrame('lab_y')
+    np.testing.assert_allclose(hjcs[:, 1, :, 1], hjcs[:, 0, :, 1], atol=1e-9)
+
+
+def test_step_outputs_femoral_frame(tmpdir):
+    from .test_step import cohort, makeStep
+    _, subjects = cohort(1)
+    subject = subjects['s000']
+    step = makeStep(tmpdir, **{'Output Frames': 'pelvis, femoral_right'})
+    step.setPortData(0, subject)
+    step.execute()
+    np.testing.assert_allclose(subject['HJC_right_femoral_right'], 0.0, atol=1e-9)
+    np.testing.assert_allclose(subject['HJC_left_femoral_right'],
+                               subject['HJC_left_pelvis'] - subject['HJC_right_pelvis'], atol=1e-9)
+
+
+def test_unknown_frame():
+    with pytest.raises(RuntimeError, match='unknown output frame: knee'):
+        predictBatch(syntheticPelvises(2), 'Seidel', 'adults', frames=('knee',))
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from mapclientplugins.pelvislandmarkshjcpredictionstep import predictors
+from mapclientplugins.pelvislandmarkshjcpredictionstep import covariates as cov
+from mapclientplugins.pelvislandmarkshjcpredictionstep.batch import predictBatch
+from mapclientplugins.pelvislandmarkshjcpredictionstep.harness import syntheticPelvises
+from mapclientplugins.pelvislandmarkshjcpredictionstep.jacobian import jacobianBatch, finiteDifferenceJacobian
+
+CASES = [(name, c) for name in predictors.predictorNames() for c in predictors.getPredictor(name).popClasses]
+
+
+def methodCovariates(method, n):
+    if 'leg_length' in predictors.getPredictor(method).covariates:
+        return {'leg_length': np.linspace(800.0, 1000.0, n)}
+    return None
+
+
+@pytest.mark.parametrize('method, popClass', CASES)
+def test_jacobian_matches_central_differences(method, popClass):
+    coords = syntheticPelvises(10, seed=1)
+    covariates = methodCovariates(method, 10)
+    hjcs, J = jacobianBatch(coords, method, popClass, covariates, chunkSize=4)
+    np.testing.assert_allclose(hjcs, predictBatch(coords, method, popClass, covariates), atol=1e-9)
+    np.testing.assert_allclose(J, finiteDifferenceJacobian(coords, method, popClass, covariates), atol=1e-5)
+
+
+def test_jacobian_with_subject_covariates():
+    coords = syntheticPelvises(4, seed=2)
+    covariates = cov.gatherCovariates([{'sex': 'm', 'age': 40.0, 'leg_length': 900.0},
+                                       {'sex': 'f', 'age': 30.0, 'leg_length': 850.0},
+                                       {'leg_length': 870.0}, {'leg_length': 910.0}])
+    for method in ('Seidel', 'Hara'):
+        J = jacobianBatch(coords, method, 'adults', covariates)[1]
+        np.testing.assert_allclose(J, finiteDifferenceJacobian(coords, method, 'adults', covariates), atol=1e-5)
+
+
+def test_degenerate_pelvis_gives_nan():
+    coords = syntheticPelvises(3, seed=3)
+    coords[1, 1] = coords[1, 0]
+    J = jacobianBatch(coords, 'Seidel', 'adults')[1]
+    assert np.isnan(J[1]).all() and np.isfinite(J[[0, 2]]).all()
+
+
+def test_predictor_without_jacobian_is_differenced():
+    seidel = predictors.getPredictor('Seidel')
+    coefficients = dict(zip(seidel.popClasses, seidel.coefficientTable))
+    predictors.registerPredictor(predictors.HJCPredictor('Plain Seidel', seidel.landmarks, seidel.coefficientNames,
+                                                         coefficients, seidel.batchFunc))
+    try:
+        coords = syntheticPelvises(5, seed=4)
+        np.testing.assert_allclose(jacobianBatch(coords, 'Plain Seidel', 'adults')[1],
+                                   jacobianBatch(coords, 'Seidel', 'adults')[1], atol=1e-4)
+    finally:
+        predictors._registry.pop('Plain Seidel')
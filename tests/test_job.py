@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+from mapclientplugins.pelvislandmarkshjcpredictionstep import progress
+from mapclientplugins.pelvislandmarkshjcpredictionstep.batch import predictBatch
+from mapclientplugins.pelvislandmarkshjcpredictionstep.checkpoint import Checkpoint, inputKey
+from mapclientplugins.pelvislandmarkshjcpredictionstep.job import CohortJob
+from mapclientplugins.pelvislandmarkshjcpredictionstep.harness import syntheticPelvises
+
+CONFIG = {'Prediction Method': 'Seidel', 'Population Class': 'adults', 'Workers': 1}
+
+
+def cancelAfter(subjects):
+    token = progress.CancelToken()
+
+    def callback(event):
+        if event.done >= subjects:
+            token.cancel()
+
+    return token, callback
+
+
+def interruptedRun(coords, checkpoint, hjcs, errors, completed, subjects=6):
+    token, callback = cancelAfter(subjects)
+    with pytest.raises(progress.PredictionCancelled):
+        predictBatch(coords, 'Seidel', 'adults', chunkSize=3, progress=callback, cancel=token, errors=errors,
+                     out=hjcs, completed=completed, checkpoint=checkpoint)
+
+
+def test_job_resumes_completed_chunks(tmpdir):
+    coords = syntheticPelvises(20, seed=1)
+    expected = predictBatch(coords, 'Seidel', 'adults')
+    key = inputKey(coords)
+
+    hjcs, completed = np.empty((20, 2, 3)), np.zeros(20, dtype=bool)
+    job = CohortJob(str(tmpdir), key, CONFIG, hjcs, None, completed)
+    assert job.resume() == 0
+    interruptedRun(coords, job, hjcs, None, completed)
+    assert job.completedRanges == [[0, 6]]
+
+    hjcs, completed = np.empty((20, 2, 3)), np.zeros(20, dtype=bool)
+    job = CohortJob(str(tmpdir), key, dict(CONFIG, Workers=4), hjcs, None, completed)
+    assert job.resume() == 6
+    predictBatch(coords, 'Seidel', 'adults', chunkSize=3, out=hjcs, completed=completed, checkpoint=job)
+    np.testing.assert_array_equal(hjcs, expected)
+    assert job.completedRanges == [[0, 20]]
+
+
+def test_job_refuses_a_changed_configuration(tmpdir):
+    coords = syntheticPelvises(10, seed=2)
+    hjcs, completed = np.empty((10, 2, 3)), np.zeros(10, dtype=bool)
+    job = CohortJob(str(tmpdir), inputKey(coords), CONFIG, hjcs, None, completed)
+    job.resume()
+    interruptedRun(coords, job, hjcs, None, completed, 3)
+    job = CohortJob(str(tmpdir), inputKey(coords), dict(CONFIG, **{'Population Class': 'men'}),
+                    np.empty((10, 2, 3)), None, np.zeros(10, dtype=bool))
+    with pytest.raises(RuntimeError, match='Population Class'):
+        job.resume()
+
+
+def test_job_over_other_inputs_starts_afresh(tmpdir):
+    coords = syntheticPelvises(10, seed=3)
+    hjcs, completed = np.empty((10, 2, 3)), np.zeros(10, dtype=bool)
+    job = CohortJob(str(tmpdir), inputKey(coords), CONFIG, hjcs, None, completed)
+    job.resume()
+    interruptedRun(coords, job, hjcs, None, completed, 3)
+    completed = np.zeros(10, dtype=bool)
+    job = CohortJob(str(tmpdir), inputKey(coords + 1.0), CONFIG, np.empty((10, 2, 3)), None, completed)
+    assert job.resume() == 0
+    assert tmpdir.listdir(lambda p: p.basename.startswith('chunk_')) == []
+
+
+def test_checkpoint_restores_fault_tolerant_run(tmpdir):
+    coords = syntheticPelvises(12, seed=4)
+    coords[4] = np.nan
+    path = str(tmpdir.join('checkpoint.npz'))
+    expectedErrors = np.zeros(12, dtype=np.int8)
+    expected = predictBatch(coords, 'Seidel', 'adults', errors=expectedErrors)
+
+    hjcs, errors, completed = np.empty((12, 2, 3)), np.zeros(12, dtype=np.int8), np.zeros(12, dtype=bool)
+    checkpoint = Checkpoint(path, inputKey(coords), hjcs, errors, completed, interval=0.0)
+    interruptedRun(coords, checkpoint, hjcs, errors, completed)
+    checkpoint.save()
+
+    hjcs, errors, completed = np.empty((12, 2, 3)), np.zeros(12, dtype=np.int8), np.zeros(12, dtype=bool)
+    checkpoint = Checkpoint(path, inputKey(coords), hjcs, errors, completed)
+    assert checkpoint.resume() == 6
+    predictBatch(coords, 'Seidel', 'adults', chunkSize=3, errors=errors, out=hjcs, completed=completed)
+    np.testing.assert_array_equal(hjcs, expected)
+    np.testing.assert_array_equal(errors, expectedErrors)
+
+    other = Checkpoint(path, inputKey(coords + 1.0), hjcs, errors, np.zeros(12, dtype=bool))
+    assert other.resume() == 0
@@ -0,0 +1,43 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from mapclientplugins.pelvislandmarkshjcpredictionstep import predictors
+from mapclientplugins.pelvislandmarkshjcpredictionstep.batch import predictBatch
+from mapclientplugins.pelvislandmarkshjcpredictionstep.harness import syntheticPelvises
+
+numba = pytest.importorskip('numba')
+
+
+def runPython(code):
+    # a fresh interpreter, with this one's import path
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in sys.path if p))
+    return subprocess.run([sys.executable, '-c', code], env=env, timeout=300, capture_output=True, text=True)
+
+
+@pytest.mark.parametrize('method', ['Seidel', 'Bell', 'Tylkowski', 'Harrington', 'Hara'])
+def test_fused_matches_numpy(method):
+    coords = syntheticPelvises(40, seed=1)
+    covariates = {'leg_length': np.linspace(800.0, 1000.0, 40)} if method == 'Hara' else None
+    popClass = predictors.getPredictor(method).popClasses[-1]
+    np.testing.assert_allclose(predictBatch(coords, method, popClass, covariates, fused=True),
+                               predictBatch(coords, method, popClass, covariates), atol=1e-9)
+
+
+def test_fused_with_workers_exits():
+    result = runPython('from mapclientplugins.pelvislandmarkshjcpredictionstep.batch import predictBatch\n'
+                       'from mapclientplugins.pelvislandmarkshjcpredictionstep.harness import syntheticPelvises\n'
+                       'coords = syntheticPelvises(64, seed=2)\n'
+                       'assert (predictBatch(coords, "Seidel", "adults", chunkSize=8, workers=4, fused=True) ==\n'
+                       '        predictBatch(coords, "Seidel", "adults", chunkSize=64, fused=True)).all()\n')
+    assert result.returncode == 0, result.stderr
+
+
+def test_numba_is_not_imported_with_the_step():
+    result = runPython('import sys\n'
+                       'import mapclientplugins.pelvislandmarkshjcpredictionstep.step\n'
+                       'assert "numba" not in sys.modules\n')
+    assert result.returncode == 0, result.stderr
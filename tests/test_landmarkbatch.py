@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+from mapclientplugins.pelvislandmarkshjcpredictionstep.landmarkbatch import LandmarkBatch
+from mapclientplugins.pelvislandmarkshjcpredictionstep.batch import HIPLANDMARKS, ERROR_MESSAGES, \
+    ERROR_MISSING_LANDMARK
+from mapclientplugins.pelvislandmarkshjcpredictionstep.harness import syntheticPelvises
+
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_save_load_round_trip(tmpdir, mmap):
+    coords = syntheticPelvises(5, seed=6)
+    hjcs = coords[:, :2] + 1.0
+    errors = np.zeros(5, dtype=np.int8)
+    errors[3] = ERROR_MISSING_LANDMARK
+    saved = LandmarkBatch(HIPLANDMARKS, coords, hjcs, ['s%d' % i for i in range(5)], {'method': 'Seidel'},
+                          {'pelvis': hjcs * 2.0}, errors, np.ones((5, 6, 15)))
+    saved.save(str(tmpdir))
+    loaded = LandmarkBatch.load(str(tmpdir), mmap=mmap)
+    assert loaded.names == HIPLANDMARKS
+    assert loaded.metadata == {'method': 'Seidel'}
+    for name in ('coords', 'hjcs', 'subjectIds', 'errors', 'jacobians'):
+        np.testing.assert_array_equal(getattr(loaded, name), getattr(saved, name))
+    np.testing.assert_array_equal(loaded.frames['pelvis'], saved.frames['pelvis'])
+    assert loaded.errorTable() == [('s3', ERROR_MESSAGES[ERROR_MISSING_LANDMARK])]
@@ -0,0 +1,59 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from mapclientplugins.pelvislandmarkshjcpredictionstep import lod
+from mapclientplugins.pelvislandmarkshjcpredictionstep.lod import LevelOfDetail, PLAIN_POINTS
+
+
+def test_resolution_falls_with_distance():
+    policy = LevelOfDetail()
+    levels = [policy.resolution(10, 10.0, d) for d in (50.0, 500.0, 1000.0, 2000.0, 5000.0)]
+    assert levels == [16, 10, 6, 4, PLAIN_POINTS]
+
+
+def test_triangle_budget_caps_large_scenes():
+    policy = LevelOfDetail()
+    assert policy.resolution(10, 10.0, 50.0) == 16
+    assert policy.resolution(10, 10.0, 50.0, totalPoints=10000) == 7
+    assert policy.resolution(10, 10.0, 50.0, totalPoints=100000) == PLAIN_POINTS
+    for total in (10, 1000, 10000, 30000):
+        level = policy.resolution(total, 10.0, 50.0)
+        assert 2 * level ** 2 * total <= policy.triangleBudget
+
+
+def test_nearest_distance():
+    policy = LevelOfDetail()
+    points = np.array([[0.0, 0.0, 10.0], [0.0, 0.0, 3.0]])
+    assert policy.nearestDistance(points, np.zeros(3)) == 3.0
+    assert policy.nearestDistance(np.empty((0, 3)), np.zeros(3)) == np.inf
+
+
+def fakeGlyph():
+    # the attributes of a Mayavi glyph module that setGlyphLevel touches
+    sources = {'point_source': SimpleNamespace(), 'sphere_source': SimpleNamespace()}
+    source = SimpleNamespace(glyph_dict=sources, glyph_source=None)
+    return SimpleNamespace(glyph=SimpleNamespace(glyph_source=source),
+                           actor=SimpleNamespace(property=SimpleNamespace(point_size=1.0)))
+
+
+def test_update_glyphs_touches_only_changed_levels():
+    scene = SimpleNamespace(camera=SimpleNamespace(position=(0.0, 0.0, 0.0), view_angle=30.0),
+                            render_window=SimpleNamespace(size=(800, 800)))
+    near, plain = fakeGlyph(), fakeGlyph()
+    glyphSets = [('near', near, np.array([[0.0, 0.0, 50.0]]), 10.0, False),
+                 ('plain', plain, np.array([[0.0, 0.0, 50.0]]), 10.0, True)]
+    levels = {'gone': 4}
+    lod.updateGlyphs(scene, glyphSets, levels)
+    assert levels == {'near': 16, 'plain': PLAIN_POINTS}
+    sphere = near.glyph.glyph_source.glyph_source
+    assert sphere is near.glyph.glyph_source.glyph_dict['sphere_source'] and sphere.theta_resolution == 16
+    assert plain.glyph.glyph_source.glyph_source is plain.glyph.glyph_source.glyph_dict['point_source']
+    assert plain.actor.property.point_size == 3.0
+
+    sphere.theta_resolution = None
+    lod.updateGlyphs(scene, glyphSets, levels)
+    assert sphere.theta_resolution is None
+    scene.camera.position = (0.0, 0.0, -1e5)
+    lod.updateGlyphs(scene, glyphSets, levels)
+    assert levels['near'] == PLAIN_POINTS
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from mapclientplugins.pelvislandmarkshjcpredictionstep import predictors
+from mapclientplugins.pelvislandmarkshjcpredictionstep import covariates as cov
+from mapclientplugins.pelvislandmarkshjcpredictionstep.batch import predictBatch, alignPelvisBatch
+from mapclientplugins.pelvislandmarkshjcpredictionstep.harness import syntheticPelvises, referencePredict
+
+REFERENCE_CASES = [(p.name, c) for p in map(predictors.getPredictor, predictors.predictorNames())
+                   if p.referenceFunc is not None for c in p.popClasses]
+
+
+@pytest.mark.parametrize('method, popClass', REFERENCE_CASES)
+def test_batch_matches_gias3_reference(method, popClass):
+    coords = syntheticPelvises(50, seed=3)
+    np.testing.assert_allclose(predictBatch(coords, method, popClass), referencePredict(coords, method, popClass),
+                               atol=1e-6)
+
+
+def test_chunked_and_threaded_match_single_chunk():
+    coords = syntheticPelvises(101, seed=4)
+    expected = predictBatch(coords, 'Seidel', 'adults')
+    np.testing.assert_array_equal(predictBatch(coords, 'Seidel', 'adults', chunkSize=7, workers=3), expected)
+
+
+def _haraExpected(coords, legLength):
+    # HJCs in the pelvis frame from the Hara regression, mapped back to the input frame
+    ax, bx, ay, by, az, bz = predictors.getPredictor('Hara').coefficientTable[0]
+    local = np.empty((len(coords), 2, 3))
+    local[:, :, 0] = (ax + bx * legLength)[:, np.newaxis]
+    local[:, :, 1] = (ay + by * legLength)[:, np.newaxis]
+    local[:, 1, 2] = az + bz * legLength
+    local[:, 0, 2] = -local[:, 1, 2]
+    inverseT = alignPelvisBatch(coords, *[coords[:, i] for i in range(4)])[2]
+    return np.einsum('nij,nkj->nki', inverseT[:, :3, :3], local) + inverseT[:, np.newaxis, :3, 3]
+
+
+def test_hara_without_sex_or_age():
+    # a covariates dict holding only the regression input must not need sex or age
+    coords = syntheticPelvises(20, seed=5)
+    legLength = np.linspace(800.0, 1000.0, 20)
+    hjcs = predictBatch(coords, 'Hara', 'adults', covariates={'leg_length': legLength})
+    np.testing.assert_allclose(hjcs, _haraExpected(coords, legLength), atol=1e-9)
+
+
+def test_hara_with_subject_covariates():
+    coords = syntheticPelvises(4, seed=6)
+    subjects = [{'leg_length': 850.0 + 20 * i, 'sex': 'f' if i % 2 else 'm', 'age': 30.0} for i in range(4)]
+    hjcs = predictBatch(coords, 'Hara', 'adults', covariates=cov.gatherCovariates(subjects))
+    np.testing.assert_allclose(hjcs, _haraExpected(coords, 850.0 + 20 * np.arange(4)), atol=1e-9)
+
+
+def test_class_indices_fall_back_without_sex_or_age():
+    popClasses = ('adults', 'men', 'women')
+    assert list(cov.classIndices({'leg_length': np.zeros(3)}, popClasses, 'women')) == [2, 2, 2]
+    covariates = {'sex': np.array([cov.SEX_MALE, cov.SEX_FEMALE, cov.SEX_UNKNOWN], dtype=np.int8)}
+    assert list(cov.classIndices(covariates, popClasses, 'adults')) == [1, 2, 0]
+
+
+def test_subject_classes_select_coefficients():
+    coords = syntheticPelvises(2, seed=7)
+    covariates = cov.gatherCovariates([{'sex': 'm', 'age': 40}, {'sex': 'f', 'age': 40}])
+    hjcs = predictBatch(coords, 'Seidel', 'adults', covariates=covariates)
+    np.testing.assert_allclose(hjcs[0], predictBatch(coords[:1], 'Seidel', 'men')[0])
+    np.testing.assert_allclose(hjcs[1], predictBatch(coords[1:], 'Seidel', 'women')[0])
+
+
+def test_registered_predictor_runs_batched():
+    def batchFunc(L, C, covariates):
+        hjcs = np.zeros((len(C), 2, 3))
+        hjcs[:, 0, 2] = -C[:, 0]
+        hjcs[:, 1, 2] = C[:, 0]
+        return hjcs
+
+    predictors.registerPredictor(predictors.HJCPredictor('Test', ('LASIS', 'RASIS'), ('w',),
+                                                         {'adults': [50.0]}, batchFunc))
+    try:
+        coords = syntheticPelvises(3, seed=8)
+        hjcs = predictBatch(coords, 'Test', 'adults')
+        midpoint = 0.5 * (coords[:, 0] + coords[:, 1])
+        np.testing.assert_allclose(np.linalg.norm(hjcs[:, 1] - midpoint, axis=1), 50.0)
+    finally:
+        predictors._registry.pop('Test')
@@ -0,0 +1,35 @@
+import io
+import logging
+import os
+import signal
+
+from mapclientplugins.pelvislandmarkshjcpredictionstep import progress
+
+
+def test_interrupt_cancels_and_logs(caplog):
+    token = progress.CancelToken()
+    with caplog.at_level(logging.WARNING, logger='mapclientplugins.pelvislandmarkshjcpredictionstep'):
+        with progress.cancelOnInterrupt(token):
+            os.kill(os.getpid(), signal.SIGINT)
+    assert token.cancelled
+    assert any('cancelling after the current chunk' in r.getMessage() and r.name.endswith('.progress')
+               for r in caplog.records)
+
+
+def test_log_progress_logs_throttled_and_final_events(caplog, capsys):
+    report = progress.LogProgress(interval=3600.0)
+    with caplog.at_level(logging.INFO, logger='mapclientplugins.pelvislandmarkshjcpredictionstep'):
+        for done in (10, 20, 30):
+            report(progress.ProgressEvent(done, 30, 1.0))
+    messages = [r.getMessage() for r in caplog.records if r.name.endswith('.progress')]
+    assert messages == ['HJC prediction: 10/30 subjects (33.3%), 10 subjects/s, eta 2s',
+                        'HJC prediction: 30/30 subjects (100.0%), 30 subjects/s, eta 0s']
+    assert capsys.readouterr().out == ''
+
+
+def test_log_progress_writes_to_a_given_stream(caplog):
+    stream = io.StringIO()
+    with caplog.at_level(logging.INFO, logger='mapclientplugins.pelvislandmarkshjcpredictionstep'):
+        progress.LogProgress(stream=stream)(progress.ProgressEvent(5, 5, 1.0))
+    assert stream.getvalue() == 'HJC prediction: 5/5 subjects (100.0%), 5 subjects/s, eta 0s\n'
+    assert not caplog.records
@@ -0,0 +1,23 @@
+import pytest
+
+from mapclientplugins.pelvislandmarkshjcpredictionstep import soak
+
+# a short soak, long enough past the warm-up for a leaked viewer, a few MB
+# per cycle, to stand well clear of allocator noise. A one-off step of a
+# few MB in the heap, as other tests in the same process can leave, fits
+# a slope of tens of kB per cycle over so few samples.
+CYCLES = 60
+MAX_GROWTH_KB = 500
+
+
+def test_resident_memory():
+    assert soak.residentMemory() > 0
+
+
+@pytest.mark.parametrize('preview', [True, False])
+def test_viewer_memory_stays_bounded(preview):
+    pytest.importorskip('PySide6')
+    if not preview:
+        pytest.importorskip('mayavi')
+    args = ['--cycles', str(CYCLES), '--warmup', '10', '--max-growth', str(MAX_GROWTH_KB)]
+    assert soak.main(args + ['--preview'] if preview else args) == 0
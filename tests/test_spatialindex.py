@@ -0,0 +1,60 @@
+import logging
+
+import numpy as np
+
+from mapclientplugins.pelvislandmarkshjcpredictionstep.batch import HIPLANDMARKS, predictBatch
+from mapclientplugins.pelvislandmarkshjcpredictionstep.harness import syntheticPelvises
+from mapclientplugins.pelvislandmarkshjcpredictionstep.landmarkbatch import LandmarkBatch
+from mapclientplugins.pelvislandmarkshjcpredictionstep.spatialindex import HJCIndex
+
+
+def makeBatch(n, method, seed=0, withoutPS=()):
+    coords = syntheticPelvises(n, seed)
+    coords[list(withoutPS), 4] = np.nan
+    hjcs = predictBatch(coords, method, 'adults')
+    return LandmarkBatch(HIPLANDMARKS, coords, hjcs, ['s%03d' % i for i in range(n)], {'method': method})
+
+
+def test_subjects_without_unneeded_landmarks_are_indexed():
+    index = HJCIndex.fromBatch(makeBatch(30, 'Tylkowski', withoutPS=(3, 7)))
+    assert len(index) == 30
+    assert index.landmarks == ('LASIS', 'RASIS', 'LPSIS', 'RPSIS')
+    assert index.features.shape == (30, 18)
+
+
+def test_subjects_without_features_are_logged(caplog):
+    batch = makeBatch(30, 'Seidel')
+    batch.coords[[3, 7], 4] = np.nan
+    with caplog.at_level(logging.WARNING):
+        index = HJCIndex.fromBatch(batch)
+    assert 3 not in index.rows and 7 not in index.rows and len(index) == 28
+    assert '2 of 30 subjects' in caplog.text
+
+
+def test_queries_and_brute_force_agree():
+    batch = makeBatch(200, 'Seidel', seed=1)
+    batch.coords[10] = batch.coords[20]
+    batch.hjcs[10] = batch.hjcs[20]
+    index = HJCIndex.fromBatch(batch)
+    distances, positions = index.querySubject(10, k=1)
+    assert positions[0] == 20 and distances[0] < 1e-9
+
+    features = index.transform(batch.coords[:5], batch.hjcs[:5])
+    expectedDistances, expectedPositions = index.query(features, k=4)
+    expectedRadius = index.queryRadius(features, 2.0)
+    index._tree = None
+    distances, positions = index.query(features, k=4)
+    np.testing.assert_allclose(distances, expectedDistances)
+    np.testing.assert_array_equal(positions, expectedPositions)
+    for found, expected in zip(index.queryRadius(features, 2.0), expectedRadius):
+        np.testing.assert_array_equal(found, expected)
+
+
+def test_save_and_load(tmpdir):
+    batch = makeBatch(20, 'Tylkowski', seed=2, withoutPS=(1,))
+    index = HJCIndex.fromBatch(batch)
+    index.save(str(tmpdir))
+    loaded = HJCIndex.load(str(tmpdir))
+    assert loaded.landmarks == index.landmarks
+    np.testing.assert_array_equal(loaded.subjectIds, index.subjectIds)
+    np.testing.assert_array_equal(loaded.transform(batch.coords, batch.hjcs), index.transform(batch.coords, batch.hjcs))
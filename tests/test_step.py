@@ -0,0 +1,194 @@
+import os
+
+import numpy as np
+import pytest
+
+from mapclientplugins.pelvislandmarkshjcpredictionstep import covariates
+from mapclientplugins.pelvislandmarkshjcpredictionstep.step import PelvisLandmarksHJCPredictionStep
+from mapclientplugins.pelvislandmarkshjcpredictionstep.batch import HIPLANDMARKS, predictBatch
+from mapclientplugins.pelvislandmarkshjcpredictionstep.harness import syntheticPelvises
+from mapclientplugins.pelvislandmarkshjcpredictionstep.jacobian import finiteDifferenceJacobian
+
+
+def makeStep(tmpdir, **config):
+    step = PelvisLandmarksHJCPredictionStep(str(tmpdir))
+    step._config['GUI'] = False
+    step._config.update(config)
+    step.setProgressCallback(lambda event: None)
+    return step
+
+
+def cohort(n, seed=0, **covariates):
+    pelvises = syntheticPelvises(n, seed)
+    subjects = {}
+    for i in range(n):
+        subject = dict(zip(HIPLANDMARKS, pelvises[i]))
+        subject.update((k, v[i]) for k, v in covariates.items())
+        subjects['s%03d' % i] = subject
+    return pelvises, subjects
+
+
+def hjcs(subjects):
+    return np.array([[s['HJC_left'], s['HJC_right']] for s in subjects.values()])
+
+
+@pytest.mark.parametrize('subjectCovariates', [False, True])
+def test_cohort_hara(tmpdir, subjectCovariates):
+    legLength = np.linspace(820.0, 980.0, 12)
+    sex = ['m', 'f', None] * 4
+    pelvises, subjects = cohort(12, leg_length=legLength, sex=sex, age=[35.0] * 12)
+    step = makeStep(tmpdir, **{'Prediction Method': 'Hara', 'Subject Covariates': subjectCovariates})
+    step.setPortData(0, subjects)
+    step.execute()
+    expected = predictBatch(pelvises, 'Hara', 'adults', covariates={'leg_length': legLength})
+    np.testing.assert_allclose(hjcs(step.getPortData(1)), expected, atol=1e-9)
+    np.testing.assert_allclose(step.getPortData(2).hjcs, expected, atol=1e-9)
+
+
+def test_cohort_hara_missing_leg_length_is_a_subject_error(tmpdir):
+    legLength = np.full(5, 900.0)
+    legLength[2] = np.nan
+    _, subjects = cohort(5, leg_length=legLength)
+    del subjects['s002']['leg_length']
+    step = makeStep(tmpdir, **{'Prediction Method': 'Hara', 'Fault Tolerant': True})
+    step.setPortData(0, subjects)
+    step.execute()
+    assert 'covariate' in subjects['s002']['HJC_error']
+    assert all('HJC_left' in s for k, s in subjects.items() if k != 's002')
+
+
+def test_single_subject_hara(tmpdir):
+    pelvises, subjects = cohort(1, leg_length=[900.0])
+    step = makeStep(tmpdir, **{'Prediction Method': 'Hara'})
+    step.setPortData(0, subjects['s000'])
+    step.execute()
+    expected = predictBatch(pelvises, 'Hara', 'adults', covariates={'leg_length': np.array([900.0])})[0]
+    np.testing.assert_allclose([subjects['s000']['HJC_left'], subjects['s000']['HJC_right']], expected, atol=1e-9)
+
+
+def test_point_names_leave_out_covariates():
+    subject = {'LASIS': [0.0, 1.0, 2.0], 'PS': np.zeros(3), 'sex': 'm', 'age': 40.0, 'leg_length': 900.0,
+               'HJC_error': 'none', 'HJC_imputed': ['PS'], 'pelvic_width': np.float64(250.0)}
+    assert covariates.pointNames(subject) == ['LASIS', 'PS']
+
+
+@pytest.mark.parametrize('preview', [True, False])
+def test_viewer_opens_on_a_subject_with_covariates(tmpdir, preview):
+    pytest.importorskip('PySide6')
+    if not preview:
+        pytest.importorskip('mayavi')
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PySide6.QtWidgets import QApplication
+    QApplication.instance() or QApplication([])
+    pelvises, subjects = cohort(2, leg_length=[900.0, 910.0], sex=['m', 'f'], age=[30.0, 40.0])
+    step = makeStep(tmpdir, **{'GUI': True, '2D Preview': preview, 'Prediction Method': 'Hara'})
+    step._setCurrentWidget = lambda widget: None
+    for subject in subjects.values():
+        step.setPortData(0, subject)
+        step.execute()
+        assert step._widget._landmarkNames == sorted(HIPLANDMARKS + ('HJC_left', 'HJC_right'))
+        step._widget._ui.predictButton.click()
+        assert np.isfinite(subject['HJC_left']).all()
+    step._releaseWidget()
+
+
+def cohortBrowserStep(tmpdir, subjects):
+    pytest.importorskip('PySide6')
+    pytest.importorskip('mayavi')
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PySide6.QtWidgets import QApplication
+    QApplication.instance() or QApplication([])
+    step = makeStep(tmpdir, GUI=True)
+    step._setCurrentWidget = lambda widget: widget.show()
+    step.done = 0
+
+    def doneExecution():
+        step.done += 1
+    step._doneExecution = doneExecution
+    step.setPortData(0, subjects)
+    return step
+
+
+@pytest.mark.parametrize('close', ['button', 'escape', 'window'])
+def test_closing_cohort_browser_finishes_execution(tmpdir, close):
+    _, subjects = cohort(4)
+    step = cohortBrowserStep(tmpdir, subjects)
+    from PySide6.QtCore import Qt
+    step.execute()
+    browser = step._cohortWidget
+    if close == 'button':
+        browser._closeButton.click()
+    elif close == 'escape':
+        from PySide6.QtTest import QTest
+        QTest.keyClick(browser._subjectView, Qt.Key_Escape)
+    else:
+        browser.close()
+    assert step.done == 1
+    assert step._cohortWidget is None
+
+
+def test_rerun_releases_open_cohort_browser_without_finishing(tmpdir):
+    _, subjects = cohort(4)
+    step = cohortBrowserStep(tmpdir, subjects)
+    step.execute()
+    step.execute()
+    assert step.done == 0
+    step._cohortWidget.reject()
+    assert step.done == 1
+
+
+def test_cohort_browser_keys_leave_landmark_table_alone(tmpdir):
+    _, subjects = cohort(4)
+    step = cohortBrowserStep(tmpdir, subjects)
+    from PySide6.QtCore import Qt
+    from PySide6.QtTest import QTest
+    from PySide6.QtWidgets import QApplication
+    step.execute()
+    browser = step._cohortWidget
+    browser.activateWindow()
+    browser._landmarkView.setFocus()
+    QApplication.processEvents()
+    QTest.keyClick(browser._landmarkView, Qt.Key_Right)
+    QTest.keyClick(browser._landmarkView, Qt.Key_End)
+    assert browser._current == 0
+    browser._subjectView.setFocus()
+    QApplication.processEvents()
+    QTest.keyClick(browser._subjectView, Qt.Key_Right)
+    assert browser._current == 1
+    QTest.keyClick(browser._subjectView, Qt.Key_End)
+    assert browser._current == 3
+    browser.reject()
+
+
+def test_single_subject_hara_jacobian(tmpdir):
+    # only the leg length is passed on, without sex or age
+    pelvises, subjects = cohort(1, leg_length=[900.0])
+    step = makeStep(tmpdir, **{'Prediction Method': 'Hara', 'HJC Jacobian': True})
+    step.setPortData(0, subjects['s000'])
+    step.execute()
+    expected = finiteDifferenceJacobian(pelvises, 'Hara', 'adults', {'leg_length': np.array([900.0])})
+    np.testing.assert_allclose(step.getPortData(2).jacobians, expected, atol=1e-5)
+
+
+def test_jacobian_toggle_keeps_resumable_job(tmpdir):
+    _, subjects = cohort(6, seed=1)
+    step = makeStep(tmpdir, **{'Resumable Job': True})
+    step.setPortData(0, subjects)
+    step.execute()
+    step._config['HJC Jacobian'] = True
+    step.execute()
+    assert step.getPortData(2).jacobians.shape == (6, 6, 15)
+
+
+def test_cancel_before_run_starts_is_honoured(tmpdir):
+    _, subjects = cohort(10)
+    step = makeStep(tmpdir, **{'Chunk Size': 2})
+    step.setPortData(0, subjects)
+    step.cancel()
+    with pytest.raises(RuntimeError, match='cancelled'):
+        step.execute()
+    assert not any('HJC_left' in s for s in subjects.values())
+
+    # the cancellation was used up by that run
+    step.execute()
+    assert all('HJC_left' in s for s in subjects.values())